@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+
+"""Benchmark the validators against a synthetic collection.
+
+Usage:
+   benchmark.py [--scale=<n>] [--repeat=<n>] [--page-size=<px>] [--root=<dir>] [--baseline=<file>] [--save-baseline] [--tolerance=<fraction>] [--only=<name>...]
+
+Options:
+   --scale=<n>               number of issues per mvol year, and of objects
+                             in the other projects. [default: 10]
+   --repeat=<n>              number of times to run each benchmark. The
+                             fastest run is reported. [default: 3]
+   --page-size=<px>          width and height of generated TIFFs.
+                             [default: 256]
+   --root=<dir>              build the collection here and keep it, instead of
+                             in a temporary directory.
+   --baseline=<file>         baseline timings. [default: benchmark_baseline.json]
+   --save-baseline           save this run's timings as the new baseline.
+   --tolerance=<fraction>    report a regression when a benchmark is this
+                             much slower than its baseline. [default: 0.25]
+   --only=<name>             only run benchmarks whose names start with this.
+
+Baselines are only comparable between runs on the same machine, with the
+same --scale and --page-size. The exit status is 1 if any benchmark
+regressed.
+"""
+
+import contextlib, json, os, shutil, statistics, sys, tempfile, time
+from docopt import docopt
+
+from digital_collection_validators.classes import (
+    ApfValidator, ChopinValidator, GmsValidator, MvolValidator
+)
+from digital_collection_validators import make_mvol_jpegs
+from digital_collection_validators.synthetic import generate_collection
+
+
+def get_benchmarks(root, identifiers):
+    """Get the benchmarks to run.
+
+    Returns:
+        list: (name, setup, run, items) tuples. setup() is called, untimed,
+        before each run(). items is the number of things run() handles, for
+        reporting throughput.
+    """
+    # chopin and gms paths are built by string concatenation, so the root
+    # needs a trailing slash.
+    local_root = root.rstrip('/') + '/'
+
+    mvol = MvolValidator()
+    mvol.set_local_root(local_root)
+    issues = identifiers['mvol']
+
+    def take_snapshots():
+        mvol.snapshots = dict(
+            (i, mvol.get_directory_snapshot(i)) for i in issues
+        )
+
+    def clear_snapshots():
+        mvol.snapshots = {}
+
+    def no_setup():
+        pass
+
+    benchmarks = [
+        ('recursive_ls', no_setup, lambda: list(mvol.recursive_ls('mvol')), len(issues)),
+        ('get_directory_snapshot', no_setup,
+         lambda: [mvol.get_directory_snapshot(i) for i in issues], len(issues)),
+    ]
+
+    for project, cls in (('chopin', ChopinValidator), ('gms', GmsValidator)):
+        v = cls()
+        v.set_local_root(local_root)
+        benchmarks.append((
+            'list_directory.{}'.format(project),
+            no_setup,
+            (lambda v, project: lambda: v.list_directory(project))(v, project),
+            len(identifiers[project])
+        ))
+        benchmarks.append((
+            'validate.{}'.format(project),
+            no_setup,
+            (lambda v, project: lambda: [v.validate(i) for i in identifiers[project]])(v, project),
+            len(identifiers[project])
+        ))
+
+    apf = ApfValidator()
+    apf.set_local_root(local_root)
+    benchmarks.append(('list_dir.apf', no_setup, lambda: apf.list_dir('apf'), len(identifiers['apf'])))
+
+    # each mvol check on its own, against snapshots taken beforehand.
+    for check in (
+        'validate_alto_or_pos_directory',
+        'validate_tiff_directory',
+        'validate_pdf',
+        'validate_struct_txt',
+        'validate_txt',
+        'validate_dc_xml',
+        'validate_allowable_files_only'
+    ):
+        benchmarks.append((
+            'mvol.{}'.format(check),
+            take_snapshots,
+            (lambda check: lambda: [getattr(mvol, check)(i) for i in issues])(check),
+            len(issues)
+        ))
+    benchmarks.append(('mvol.validate', clear_snapshots, lambda: [mvol.validate(i) for i in issues], len(issues)))
+    benchmarks.append(('mvol.validate_dc_xml_files', no_setup, lambda: mvol.validate_dc_xml_files('mvol'), len(issues)))
+
+    # JPEG conversion runs last, since it adds JPEG directories.
+    pages = []
+    with contextlib.redirect_stdout(sys.stderr):
+        for i in issues:
+            if not os.path.isdir(os.path.join(root, *i.split('-'), 'JPEG')):
+                pages.extend(make_mvol_jpegs.get_pages(root, i))
+
+    def remove_jpegs():
+        for tif_file, jpg_file in pages:
+            if os.path.exists(jpg_file):
+                os.remove(jpg_file)
+
+    benchmarks.append((
+        'make_mvol_jpegs',
+        remove_jpegs,
+        lambda: list(make_mvol_jpegs.convert_pages(pages)),
+        len(pages)
+    ))
+    return benchmarks
+
+
+def run_benchmarks(benchmarks, repeat=3, only=None):
+    """Run benchmarks, keeping the fastest and median times.
+
+    Returns:
+        dict: benchmark names mapped to dicts of min and median seconds, and
+        items.
+    """
+    results = {}
+    for name, setup, run, items in benchmarks:
+        if only and not any(name.startswith(o) for o in only):
+            continue
+        times = []
+        for _ in range(repeat):
+            setup()
+            start = time.perf_counter()
+            run()
+            times.append(time.perf_counter() - start)
+        results[name] = {
+            'min': min(times),
+            'median': statistics.median(times),
+            'items': items
+        }
+    return results
+
+
+# differences smaller than this are timer noise, not regressions.
+MIN_REGRESSION_SECONDS = 0.001
+
+
+def compare_to_baseline(results, baseline, tolerance):
+    """Compare results to a baseline.
+
+    Returns:
+        list: (name, seconds, baseline seconds or None, regressed) tuples.
+    """
+    comparison = []
+    for name, result in results.items():
+        previous = baseline.get(name, {}).get('min')
+        regressed = (
+            bool(previous)
+            and result['min'] > previous * (1 + tolerance)
+            and result['min'] - previous > MIN_REGRESSION_SECONDS
+        )
+        comparison.append((name, result['min'], previous, regressed))
+    return comparison
+
+
+if __name__ == '__main__':
+    arguments = docopt(__doc__)
+
+    scale = int(arguments['--scale'])
+    page_size = int(arguments['--page-size'])
+
+    if arguments['--root']:
+        root = arguments['--root']
+        tmp = None
+    else:
+        tmp = tempfile.mkdtemp()
+        root = tmp
+
+    try:
+        start = time.perf_counter()
+        identifiers = generate_collection(root, scale, page_size)
+        sys.stderr.write('generated {} in {:.1f}s\n'.format(
+            ', '.join('{} {}'.format(len(v), k) for k, v in identifiers.items()),
+            time.perf_counter() - start
+        ))
+
+        results = run_benchmarks(
+            get_benchmarks(root, identifiers),
+            int(arguments['--repeat']),
+            arguments['--only']
+        )
+    finally:
+        if tmp:
+            shutil.rmtree(tmp)
+
+    baseline = {}
+    if os.path.exists(arguments['--baseline']):
+        with open(arguments['--baseline']) as f:
+            baseline = json.load(f)
+        if baseline.get('scale') != scale or baseline.get('page_size') != page_size:
+            sys.stderr.write('baseline was recorded with different settings, ignoring it.\n')
+            baseline = {}
+
+    regressions = 0
+    sys.stdout.write('{:40} {:>10} {:>12} {:>10}\n'.format('benchmark', 'seconds', 'items/s', 'baseline'))
+    for name, seconds, previous, regressed in compare_to_baseline(
+        results,
+        baseline.get('results', {}),
+        float(arguments['--tolerance'])
+    ):
+        items = results[name]['items']
+        sys.stdout.write('{:40} {:>10.4f} {:>12.1f} {:>10} {}\n'.format(
+            name,
+            seconds,
+            items / seconds if seconds else 0.0,
+            '{:.4f}'.format(previous) if previous else '-',
+            'REGRESSION' if regressed else ''
+        ))
+        regressions += regressed
+
+    if arguments['--save-baseline']:
+        with open(arguments['--baseline'], 'w') as f:
+            json.dump(
+                {'scale': scale, 'page_size': page_size, 'results': results},
+                f,
+                indent=2,
+                sort_keys=True
+            )
+
+    if regressions:
+        sys.exit(1)
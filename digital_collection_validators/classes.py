@@ -1,25 +1,1786 @@
+import calendar
+import collections
+import concurrent.futures
+import contextlib
 import csv
+import ctypes
+import datetime
+import functools
 import getpass
+import hashlib
 import io
+import json
+import mmap
+import multiprocessing
 import os
 import paramiko
+import queue
 import re
 import requests
+import select
+import shlex
 import sqlite3
 import stat
+import struct
 import subprocess
 import sys
+import threading
+import time
+import zlib
 from pathlib import Path 
 from lxml import etree
 from xml.etree import ElementTree
+from xml.parsers import expat
+
+
+# projects whose names are the first section of their identifiers. Other
+# projects are recognized by a substring, e.g. 'apf1-00001' or 'chess-0392-001'.
+PREFIX_PROJECTS = ('ewm', 'gms', 'mvol', 'speculum')
+
+# regular expressions for complete identifiers, by project.
+IDENTIFIER_RES = {
+    'apf': re.compile(r'^(apf\d{1}-\d{5}$|apf\d{1}-\d{5}-\d{3})'),
+    'chopin': re.compile(r'^chopin-\d{3}$'),
+    'ewm': re.compile(r'^ewm-\d{4}$'),
+    'gms': re.compile(r'^gms-\d{4}$'),
+    'mvol': re.compile(r'^mvol-\d{4}-\d{4}-[0-9A-Z]{4}(-\d{2})?$'),
+    'rac': re.compile(r'^(rac-\d{4}|chess-\d{4}-\d{3}|rose-\d{4}-\d{3})$'),
+    'speculum': re.compile(r'^speculum-\d{4}$')
+}
+
+# regular expressions for identifier chunks, by project.
+IDENTIFIER_CHUNK_RES = {
+    'apf': re.compile(r'^apf(\d{1}(-\d{5}(-\d{3})?)?)?$'),
+    'chopin': re.compile(r'^chopin(-\d{3}(-\d{3})?)?$'),
+    'ewm': re.compile(r'^ewm(-\d{4}(-\d{4}([A-Za-z]{2})?)?)?$'),
+    'gms': re.compile(r'^gms(-\d{4}(-\d{3})?)?$'),
+    'mvol': re.compile(r'^mvol(-\d{4}(-\d{4}(-[0-9A-Z]{4}(-\d{2})?)?)?)?$'),
+    'rac': re.compile(r'^(rac(-\d{4})?|chess-\d{4}-\d{3}?|rose-\d{4}-\d{3}?)$'),
+    'speculum': re.compile(r'^speculum(-\d{4}(-\d{3})?)?$')
+}
+
+ParsedIdentifier = collections.namedtuple(
+    'ParsedIdentifier',
+    ['project', 'levels', 'depth', 'is_identifier', 'is_identifier_chunk']
+)
+
+
+@functools.lru_cache(maxsize=65536)
+def parse_identifier(identifier_chunk):
+    """Parse an identifier chunk in one pass.
+
+    Args:
+        identifier_chunk (str): e.g. 'mvol', 'mvol-0004-1930-0103',
+        'apf1-00001', 'chess-0392-001'
+
+    Returns:
+        ParsedIdentifier: the project ('mvol', or None if the project is
+        unknown), the sections of the identifier chunk, the number of
+        sections, and whether it is a complete identifier and/or a legal
+        identifier chunk.
+    """
+    levels = tuple(identifier_chunk.split('-'))
+
+    if levels[0] in PREFIX_PROJECTS:
+        project = levels[0]
+    elif 'apf' in identifier_chunk:
+        project = 'apf'
+    elif 'chopin' in identifier_chunk:
+        project = 'chopin'
+    elif ('rac' in identifier_chunk or 'chess' in identifier_chunk
+          or 'rose' in identifier_chunk):
+        project = 'rac'
+    else:
+        return ParsedIdentifier(None, levels, len(levels), False, False)
+
+    return ParsedIdentifier(
+        project,
+        levels,
+        len(levels),
+        bool(IDENTIFIER_RES[project].match(identifier_chunk)),
+        bool(IDENTIFIER_CHUNK_RES[project].match(identifier_chunk))
+    )
+
+
+def classify(identifier_chunks):
+    """Parse many identifier chunks, e.g. every line of a directory listing
+    or every row of the validation database. Unknown projects do not raise
+    an exception- their project is None.
+
+    Args:
+        identifier_chunks: an iterable of strings.
+
+    Returns:
+        a generator of ParsedIdentifier tuples, in the same order.
+    """
+    for identifier_chunk in identifier_chunks:
+        yield parse_identifier(identifier_chunk)
+
+
+# how many sections of an identifier are used as directories above the
+# directory that holds its .dc.xml file, e.g. mvol/0004/1930/0103. Nothing
+# below that depth (ALTO, TIFF, etc.) needs to be walked. Only mvol stores
+# .dc.xml files in its directory tree; the other projects keep their
+# metadata elsewhere, so recursive_ls walks them without pruning.
+DC_XML_DEPTHS = {'mvol': 4}
+
+# output format for remote 'find -printf' commands: depth, type, size, mtime
+# and path, separated by tabs. The path comes last, so it can contain tabs.
+FIND_PRINTF_FORMAT = '%d\\t%y\\t%s\\t%T@\\t%p\\n'
+
+
+def parse_find_output(lines):
+    """Parse lines printed by 'find -printf' with FIND_PRINTF_FORMAT.
+
+    Args:
+        lines: an iterable of lines.
+
+    Returns:
+        a generator of (depth, type, size, mtime, path) tuples, where type is
+        'f' for files and 'd' for directories.
+    """
+    for line in lines:
+        try:
+            depth, file_type, size, mtime, path = line.rstrip('\n').split('\t', 4)
+            yield int(depth), file_type, int(size), float(mtime), path
+        except ValueError:
+            continue
+
+
+# a file in a sync manifest. path is relative to the directory that holds
+# the files of every identifier, starting with the identifier itself, e.g.
+# 'mvol-0004-1930-0103/TIFF/mvol-0004-1930-0103_00000001.tif', so that
+# manifests from servers with different layouts can be compared directly.
+ManifestEntry = collections.namedtuple(
+    'ManifestEntry',
+    ('path', 'size', 'mtime', 'digest')
+)
+
+# modification times closer than this, in seconds, are treated as equal.
+# WebDAV only reports whole seconds.
+SYNC_MTIME_TOLERANCE = 1.0
+
+
+def get_manifest_from_webdav(entries, exclude=()):
+    """Build a sync manifest from a WebDAV listing of IIIF_Files, e.g. from
+    owncloud.Client.list() with depth='infinity'.
+
+    Args:
+        entries: an iterable of owncloud.FileInfo objects.
+        exclude (tuple): file names to leave out directly inside each
+        identifier's directory, e.g. sentinel files.
+
+    Returns:
+        list: ManifestEntry tuples, sorted by path.
+    """
+    manifest = []
+    for e in entries:
+        if e.is_dir():
+            continue
+        sections = re.sub('^.*IIIF_Files/', '', e.path).split('/')
+        depth = DC_XML_DEPTHS.get(sections[0])
+        if depth is None or len(sections) <= depth:
+            continue
+        relpath = '/'.join(sections[depth:])
+        if relpath in exclude:
+            continue
+        manifest.append(ManifestEntry(
+            '-'.join(sections[:depth]) + '/' + relpath,
+            e.get_size(),
+            calendar.timegm(e.get_last_modified().timetuple()),
+            None
+        ))
+    manifest.sort()
+    return manifest
+
+
+def diff_manifests(source, target, mtime_tolerance=SYNC_MTIME_TOLERANCE):
+    """Compare two sync manifests by merging their sorted entries, so that
+    even manifests for all of mvol are compared in a single pass.
+
+    Files differ if their sizes differ, if both have digests and the digests
+    differ, or, when there are no digests to compare, if the source copy is
+    newer than the target copy.
+
+    Args:
+        source: an iterable of ManifestEntry tuples, sorted by path.
+        target: an iterable of ManifestEntry tuples, sorted by path.
+        mtime_tolerance (float): see SYNC_MTIME_TOLERANCE.
+
+    Returns:
+        a generator of (status, source_entry, target_entry) tuples, where
+        status is 'missing' (only in source, target_entry is None), 'extra'
+        (only in target, source_entry is None) or 'changed'.
+    """
+    source = iter(source)
+    target = iter(target)
+    s = next(source, None)
+    t = next(target, None)
+    while s is not None or t is not None:
+        if t is None or (s is not None and s.path < t.path):
+            yield 'missing', s, None
+            s = next(source, None)
+        elif s is None or t.path < s.path:
+            yield 'extra', None, t
+            t = next(target, None)
+        else:
+            if s.size != t.size:
+                changed = True
+            elif s.digest and t.digest:
+                changed = s.digest != t.digest
+            else:
+                changed = s.mtime - t.mtime > mtime_tolerance
+            if changed:
+                yield 'changed', s, t
+            s = next(source, None)
+            t = next(target, None)
+
+# columns derived from each identifier in the validation table, so that the
+# hierarchy of identifier chunks can be browsed with indexed queries.
+# 'project' holds the first section of the identifier (e.g. 'mvol', 'apf1')
+# and level1-level4 hold the sections after it.
+HIERARCHY_COLUMNS = ('project', 'level1', 'level2', 'level3', 'level4')
+
+
+# seconds to wait for another connection's write to finish before giving up
+# with 'database is locked'.
+DB_BUSY_TIMEOUT = 60
+
+# validation results are written this many rows per transaction.
+VALIDATION_BATCH_SIZE = 500
+
+def _get_hierarchy_update_sql(where):
+    """Build the UPDATE statements that fill in the depth and hierarchy
+    columns of the validation table, using only SQL so that they can run
+    inside triggers. Each statement relies on the columns set by the ones
+    before it.
+
+    Args:
+        where (str): a WHERE clause selecting the rows to update.
+
+    Returns:
+        list: SQL statements.
+    """
+    def first_section(x):
+        return "CASE WHEN instr({0}, '-') > 0 THEN substr({0}, 1, instr({0}, '-') - 1) ELSE {0} END".format(x)
+
+    statements = [
+        "UPDATE validation SET depth = length(identifier) - length(replace(identifier, '-', '')) + 1, project = {} WHERE {}".format(
+            first_section('identifier'),
+            where
+        )
+    ]
+    for n in range(1, len(HIERARCHY_COLUMNS)):
+        # skip past the sections before this one, and the dashes after them.
+        offset = ' + '.join('length({})'.format(c) for c in HIERARCHY_COLUMNS[:n])
+        statements.append(
+            'UPDATE validation SET {} = CASE WHEN depth > {} THEN {} END WHERE {}'.format(
+                HIERARCHY_COLUMNS[n],
+                n,
+                first_section('substr(identifier, {} + {})'.format(offset, n + 1)),
+                where
+            )
+        )
+    return statements
+
+
+# files are read in blocks of this many bytes when checking that XML is
+# well-formed, so memory use does not grow with file size.
+XML_CHUNK_SIZE = 64 * 1024
+
+# watch() revalidates an identifier once its files have been quiet for this
+# many seconds, so that a large upload is validated once, at the end.
+WATCH_DEBOUNCE = 5.0
+
+# watch() rescans every identifier this often, in seconds, to pick up
+# changes that inotify missed, e.g. when its event queue overflowed.
+WATCH_RECONCILE_INTERVAL = 600
+
+# sentinel files that staff and scripts use to mark where an identifier is
+# in validation: 'ready' to be validated, in the 'queue', and 'valid' or
+# 'invalid' when it is done. See sentinelutility.py.
+SENTINEL_NAMES = ('ready', 'queue', 'valid', 'invalid')
+
+# paramiko.SSHClient.connect() arguments that are never copied into worker
+# processes.
+SSH_SECRET_KEYS = ('password', 'passphrase', 'pkey')
+
+# a queued identifier goes back to 'ready' if its lease isn't renewed for
+# this many seconds, e.g. because the scheduler that claimed it crashed.
+SENTINEL_LEASE_TIMEOUT = 300
+
+# seconds between looks for new 'ready' sentinels.
+SENTINEL_POLL_INTERVAL = 30
+
+# inotify event masks, from <sys/inotify.h>.
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+# the events that mean an identifier's files changed.
+WATCH_MASK = (IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+              | IN_CREATE | IN_DELETE)
+
+# struct inotify_event, without its variable length name.
+INOTIFY_EVENT = struct.Struct('iIII')
+
+# files are hashed in blocks of this many bytes. hashlib releases the GIL
+# while it hashes a block, so files hash in parallel across the I/O pool.
+DIGEST_BLOCK_SIZE = 4 * 1024 * 1024
+
+
+def get_file_digest(path, block_size=DIGEST_BLOCK_SIZE):
+    """Get the BLAKE2b digest of a local file, reading it in large blocks
+    into a single reused buffer.
+
+    Args:
+        path (str): the file to hash.
+        block_size (int): bytes to read at a time.
+
+    Returns:
+        str: a hex digest.
+    """
+    h = hashlib.blake2b()
+    buf = bytearray(block_size)
+    view = memoryview(buf)
+    with open(path, 'rb', buffering=0) as f:
+        while True:
+            n = f.readinto(buf)
+            if not n:
+                break
+            h.update(view[:n])
+    return h.hexdigest()
+
+
+# compiled once for dc.xml checks. One XPath pass collects every Dublin Core
+# child of <metadata>.
+DC_NAMESPACES = {'dc': 'http://purl.org/dc/elements/1.1/'}
+DC_ELEMENTS_XPATH = etree.XPath('dc:*', namespaces=DC_NAMESPACES)
+DC_REQUIRED_ELEMENTS = ('title', 'identifier', 'date', 'description')
+DC_DATE_RE = re.compile(r'^\d{4}(-\d{2})?(-\d{2})?')
+DC_DATE_FIELD_RE = re.compile(r'\b\d+\b')
+
+# lxml parsers can be reused, but not shared between threads.
+_dc_xml_parsers = threading.local()
+
+
+def _get_dc_xml_parser():
+    """Get this thread's parser for dc.xml files."""
+    try:
+        return _dc_xml_parsers.parser
+    except AttributeError:
+        _dc_xml_parsers.parser = etree.XMLParser()
+        return _dc_xml_parsers.parser
+
+# what a structural check of a TIFF reports about its first image.
+TiffInfo = collections.namedtuple(
+    'TiffInfo',
+    ('width', 'height', 'compression', 'ifd_count')
+)
+
+# TIFF field types and their sizes in bytes.
+TIFF_TYPE_SIZES = {
+    1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 6: 1, 7: 1, 8: 2, 9: 4, 10: 8, 11: 4,
+    12: 8, 13: 4, 16: 8, 17: 8, 18: 8
+}
+TIFF_TYPE_FORMATS = {1: 'B', 3: 'H', 4: 'I', 13: 'I', 16: 'Q'}
+
+# TIFFs with more IFDs than this are assumed to have a loop in their chain.
+TIFF_MAX_IFDS = 1024
+
+# what a structural check of a PDF reports.
+PdfInfo = collections.namedtuple('PdfInfo', ('version', 'page_count'))
+
+# startxref has to be in this many bytes at the end of a PDF.
+PDF_TAIL_SIZE = 1024
+
+# PDFs with more xref sections than this are assumed to have a loop in
+# their /Prev chain.
+PDF_MAX_XREF_SECTIONS = 1024
+
+# objects and trailers are read in windows of this many bytes, doubled
+# until the end of the object turns up.
+PDF_OBJECT_WINDOW_SIZE = 4096
+
+
+@contextlib.contextmanager
+def _random_access(f):
+    """Get random access to a file's bytes, for reading small pieces of a
+    large file. Local files are memory-mapped, so only the pages that are
+    touched are read from disk. Other files, e.g. remote or empty ones, are
+    read with seek() and read().
+
+    Args:
+        f: a file-like object, opened in binary mode.
+
+    Returns:
+        a context manager giving a (size, read) tuple, where read(offset,
+        length) returns bytes.
+    """
+    try:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (AttributeError, io.UnsupportedOperation, OSError, ValueError):
+        buf = None
+
+    if buf is None:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+
+        def read(offset, length):
+            f.seek(offset)
+            return f.read(length)
+
+        yield size, read
+        return
+
+    def read(offset, length):
+        return buf[offset:offset + length]
+
+    try:
+        yield len(buf), read
+    finally:
+        buf.close()
+
+
+class _PdfTail:
+    """Reads the cross-reference data at the end of a PDF, and just the
+    objects needed to count its pages. Content streams are never read.
+
+    Args:
+        read: a function taking an offset and a length, returning bytes.
+        size (int): the size of the file.
+    """
+
+    startxref_re = re.compile(rb'startxref\s+(\d+)\s+%%EOF')
+    xref_header_re = re.compile(rb'\s*(\d+)\s+(\d+)\s')
+    xref_entry_re = re.compile(rb'(\d{10})\s(\d{5})\s([nf])')
+    object_re = re.compile(rb'\s*(\d+)\s+(\d+)\s+obj\b')
+    ref_re = rb'/{}\s+(\d+)\s+(\d+)\s+R'
+    int_re = rb'/{}\s+(\d+)'
+    array_re = rb'/{}\s*\[([\d\s]*)\]'
+
+    def __init__(self, read, size):
+        self.read = read
+        self.size = size
+        # object number => ('offset', offset) or ('stream', stream, index)
+        self.objects = {}
+        self.trailer = None
+
+    def get_value(self, pattern, key, dictionary):
+        m = re.search(pattern.replace(b'{}', key.encode('ascii')), dictionary)
+        if m is None:
+            return None
+        if pattern == self.array_re:
+            return [int(v) for v in m.group(1).split()]
+        return int(m.group(1))
+
+    def read_until(self, offset, markers):
+        """Read from an offset until one of some markers turns up, or the
+        end of the file. The window doubles each time, so a large object,
+        e.g. a page tree with a long /Kids array, costs a few reads.
+
+        Returns:
+            bytes: everything from offset to at least the first marker.
+        """
+        length = PDF_OBJECT_WINDOW_SIZE
+        while True:
+            chunk = self.read(offset, length)
+            if offset + len(chunk) >= self.size or any(m in chunk for m in markers):
+                return chunk
+            length *= 2
+
+    def load_xref(self):
+        """Follow the chain of xref sections back from startxref."""
+        tail_start = max(0, self.size - PDF_TAIL_SIZE)
+        matches = list(self.startxref_re.finditer(self.read(tail_start, PDF_TAIL_SIZE)))
+        if not matches:
+            raise ValueError('startxref missing')
+        offset = int(matches[-1].group(1))
+
+        seen = set()
+        while offset is not None:
+            if offset in seen or len(seen) >= PDF_MAX_XREF_SECTIONS:
+                raise ValueError('xref chain loops')
+            seen.add(offset)
+            if offset >= self.size:
+                raise ValueError('xref past the end of the file')
+            if self.read(offset, 4) == b'xref':
+                trailer = self.load_xref_table(offset + 4)
+            else:
+                trailer = self.load_xref_stream(offset)
+            if self.trailer is None:
+                self.trailer = trailer
+            offset = self.get_value(self.int_re, 'Prev', trailer)
+
+    def load_xref_table(self, offset):
+        """Read a classic xref table. Entries from newer sections, which are
+        read first, take precedence.
+
+        Returns:
+            bytes: the trailer dictionary.
+        """
+        while True:
+            chunk = self.read(offset, 64)
+            if chunk.lstrip().startswith(b'trailer'):
+                trailer = self.read_until(offset, (b'startxref',))
+                return trailer[:trailer.find(b'startxref')]
+            m = self.xref_header_re.match(chunk)
+            if m is None:
+                raise ValueError('xref table damaged')
+            first, count = int(m.group(1)), int(m.group(2))
+            offset += m.end()
+            entries = self.read(offset, count * 20)
+            found = 0
+            for found, e in enumerate(self.xref_entry_re.finditer(entries), 1):
+                if e.group(3) == b'n':
+                    self.objects.setdefault(first + found - 1, ('offset', int(e.group(1))))
+                if found == count:
+                    offset += e.end()
+                    break
+            if found < count:
+                raise ValueError('xref table truncated')
+
+    def load_xref_stream(self, offset):
+        """Read a PDF 1.5 cross-reference stream.
+
+        Returns:
+            bytes: the stream dictionary, which doubles as the trailer.
+        """
+        dictionary, data = self.read_object(offset)
+        if b'/XRef' not in dictionary or data is None:
+            raise ValueError('xref not found')
+        widths = self.get_value(self.array_re, 'W', dictionary)
+        index = self.get_value(self.array_re, 'Index', dictionary)
+        if index is None:
+            index = [0, self.get_value(self.int_re, 'Size', dictionary)]
+        if not widths or len(widths) != 3 or None in index:
+            raise ValueError('xref stream damaged')
+
+        entry_size = sum(widths)
+        position = 0
+        for first, count in zip(index[0::2], index[1::2]):
+            for number in range(first, first + count):
+                entry = data[position:position + entry_size]
+                if len(entry) < entry_size:
+                    raise ValueError('xref stream truncated')
+                position += entry_size
+                fields = []
+                start = 0
+                for width in widths:
+                    fields.append(int.from_bytes(entry[start:start + width], 'big'))
+                    start += width
+                entry_type = fields[0] if widths[0] else 1
+                if entry_type == 1:
+                    self.objects.setdefault(number, ('offset', fields[1]))
+                elif entry_type == 2:
+                    self.objects.setdefault(number, ('stream', fields[1], fields[2]))
+        return dictionary
+
+    def read_object(self, offset, number=None):
+        """Read an object's dictionary, and decode its stream if it has
+        one.
+
+        Returns:
+            tuple: (dictionary, stream data or None)
+        """
+        if offset >= self.size:
+            raise ValueError('object past the end of the file')
+        chunk = self.read_until(offset, (b'stream', b'endobj'))
+        m = self.object_re.match(chunk)
+        if m is None or (number is not None and int(m.group(1)) != number):
+            raise ValueError('xref points to the wrong place')
+        stream = chunk.find(b'stream', m.end())
+        end = chunk.find(b'endobj', m.end())
+        if stream == -1 or (end != -1 and end < stream):
+            return chunk[m.end():end if end != -1 else len(chunk)], None
+
+        dictionary = chunk[m.end():stream]
+        length_ref = re.search(self.ref_re.replace(b'{}', b'Length'), dictionary)
+        if length_ref:
+            # xref streams always have a direct /Length, so by the time an
+            # indirect one turns up the xref has been read.
+            try:
+                length = int(self.get_object(int(length_ref.group(1))).split()[0])
+            except (IndexError, ValueError):
+                raise ValueError('stream length missing')
+        else:
+            length = self.get_value(self.int_re, 'Length', dictionary)
+        if length is None:
+            raise ValueError('stream length missing')
+        start = offset + stream + len(b'stream')
+        start += 2 if self.read(start, 2) == b'\r\n' else 1
+        if start + length > self.size:
+            raise ValueError('stream truncated')
+        data = self.read(start, length)
+
+        if b'/FlateDecode' in dictionary:
+            try:
+                data = zlib.decompress(data)
+            except zlib.error:
+                raise ValueError('stream damaged')
+        predictor = self.get_value(self.int_re, 'Predictor', dictionary)
+        if predictor and predictor >= 10:
+            data = self.undo_png_predictor(
+                data,
+                self.get_value(self.int_re, 'Columns', dictionary) or 1
+            )
+        return dictionary, data
+
+    @staticmethod
+    def undo_png_predictor(data, columns):
+        rows = []
+        previous = bytearray(columns)
+        for start in range(0, len(data), columns + 1):
+            kind = data[start]
+            row = bytearray(data[start + 1:start + 1 + columns])
+            for i in range(len(row)):
+                left = row[i - 1] if i else 0
+                up = previous[i]
+                if kind == 1:
+                    row[i] = (row[i] + left) & 0xff
+                elif kind == 2:
+                    row[i] = (row[i] + up) & 0xff
+                elif kind == 3:
+                    row[i] = (row[i] + (left + up) // 2) & 0xff
+                elif kind == 4:
+                    upper_left = previous[i - 1] if i else 0
+                    p = left + up - upper_left
+                    if abs(p - left) <= abs(p - up) and abs(p - left) <= abs(p - upper_left):
+                        row[i] = (row[i] + left) & 0xff
+                    elif abs(p - up) <= abs(p - upper_left):
+                        row[i] = (row[i] + up) & 0xff
+                    else:
+                        row[i] = (row[i] + upper_left) & 0xff
+            rows.append(bytes(row))
+            previous = row
+        return b''.join(rows)
+
+    def get_object(self, number):
+        """Get the dictionary of an object, from the file or from inside a
+        compressed object stream."""
+        if number not in self.objects:
+            raise ValueError('object {} missing from xref'.format(number))
+        location = self.objects[number]
+        if location[0] == 'offset':
+            return self.read_object(location[1], number)[0]
+
+        dictionary, data = self.read_object(self.get_location(location[1]), location[1])
+        count = self.get_value(self.int_re, 'N', dictionary)
+        first = self.get_value(self.int_re, 'First', dictionary)
+        if data is None or count is None or first is None:
+            raise ValueError('object stream damaged')
+        header = [int(v) for v in data[:first].split()]
+        offsets = dict(zip(header[0::2], header[1::2]))
+        if number not in offsets:
+            raise ValueError('object {} missing from object stream'.format(number))
+        following = [o for o in offsets.values() if o > offsets[number]]
+        end = first + min(following) if following else len(data)
+        return data[first + offsets[number]:end]
+
+    def get_location(self, number):
+        location = self.objects.get(number)
+        if location is None or location[0] != 'offset':
+            raise ValueError('object {} missing from xref'.format(number))
+        return location[1]
+
+    def get_page_count(self):
+        """Count pages by reading /Count from the root of the page tree."""
+        self.load_xref()
+        root = re.search(self.ref_re.replace(b'{}', b'Root'), self.trailer)
+        if root is None:
+            raise ValueError('trailer has no /Root')
+        catalog = self.get_object(int(root.group(1)))
+        pages = re.search(self.ref_re.replace(b'{}', b'Pages'), catalog)
+        if pages is None:
+            raise ValueError('catalog has no /Pages')
+        count = self.get_value(self.int_re, 'Count', self.get_object(int(pages.group(1))))
+        if count is None:
+            raise ValueError('page tree has no /Count')
+        return count
+
+# per-thread I/O counters, read before and after each profiled check.
+# Per-thread counts keep checks running at the same time apart.
+PROC_IO_PATH = '/proc/thread-self/io'
+
+# the profiled check running in each thread, if any. I/O pool threads
+# borrow the record of the check that handed them work.
+_profile_state = threading.local()
+_profile_lock = threading.Lock()
+_proc_io_overhead = None
+
+
+def _read_proc_io():
+    """Read the current thread's I/O counters.
+
+    Returns:
+        tuple: (bytes read, read and write syscalls), or (0, 0) where
+        /proc is not available.
+    """
+    try:
+        with open(PROC_IO_PATH, 'rb') as f:
+            data = f.read()
+    except OSError:
+        return 0, 0
+    counters = dict(line.split(b': ', 1) for line in data.splitlines())
+    return int(counters[b'rchar']), int(counters[b'syscr']) + int(counters[b'syscw'])
+
+
+def _get_proc_io_delta(start):
+    """Get the I/O counters since start, minus the cost of reading them."""
+    global _proc_io_overhead
+    if _proc_io_overhead is None:
+        a = _read_proc_io()
+        b = _read_proc_io()
+        _proc_io_overhead = (b[0] - a[0], b[1] - a[1])
+    end = _read_proc_io()
+    return (
+        max(0, end[0] - start[0] - _proc_io_overhead[0]),
+        max(0, end[1] - start[1] - _proc_io_overhead[1])
+    )
+
+
+class _CheckProfile:
+    """Counters for one check of one identifier."""
+
+    def __init__(self, identifier, check):
+        self.identifier = identifier
+        self.check = check
+        self.seconds = 0.0
+        self.files = 0
+        self.bytes_read = 0
+        self.read_write_syscalls = 0
+        # I/O done for this check in other threads. It is passed up to any
+        # enclosing check, which can't see other threads' counters.
+        self.worker_bytes_read = 0
+        self.worker_read_write_syscalls = 0
+
+    def as_dict(self):
+        return {
+            'identifier': self.identifier,
+            'check': self.check,
+            'seconds': self.seconds,
+            'files': self.files,
+            'bytes_read': self.bytes_read,
+            'read_write_syscalls': self.read_write_syscalls
+        }
+
+
+def write_profile_jsonl(records, f):
+    """Write profile records as JSON Lines, one per check per identifier.
+
+    Args:
+        records (list): dicts from DigitalCollectionValidator.profile.
+        f: a text file-like object.
+    """
+    for record in records:
+        f.write(json.dumps(record, sort_keys=True) + '\n')
+
+
+def write_profile_prometheus(records, path):
+    """Write profile totals per check for one run as a Prometheus textfile,
+    for the node exporter's textfile collector. The file is rewritten by
+    every run, so the values are gauges, not counters. The file is written
+    to a temporary name and renamed into place, so the exporter never
+    reads half of it.
+
+    Args:
+        records (list): dicts from DigitalCollectionValidator.profile.
+        path (str): e.g. '/var/lib/node_exporter/textfile/mvol.prom'
+    """
+    totals = collections.OrderedDict()
+    for record in records:
+        t = totals.setdefault(
+            record['check'],
+            {'runs': 0, 'seconds': 0.0, 'files': 0, 'bytes_read': 0, 'read_write_syscalls': 0}
+        )
+        t['runs'] += 1
+        for k in ('seconds', 'files', 'bytes_read', 'read_write_syscalls'):
+            t[k] += record[k]
+
+    lines = []
+    for field, help_text in (
+        ('runs', 'Number of times each check ran in the last run.'),
+        ('seconds', 'Wall time spent in each check in the last run.'),
+        ('files', 'Files opened by each check in the last run.'),
+        ('bytes_read', 'Bytes read by each check in the last run.'),
+        ('read_write_syscalls', 'Read and write system calls made by each check in the last run. Other system calls, e.g. stat, open and getdents, are not counted.')
+    ):
+        name = 'dcv_check_{}'.format(field)
+        lines.append('# HELP {} {}'.format(name, help_text))
+        lines.append('# TYPE {} gauge'.format(name))
+        for check, t in totals.items():
+            lines.append('{}{{check="{}"}} {}'.format(name, check, t[field]))
+
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    os.replace(tmp_path, path)
+
+
+# validator used by each worker process in
+# DigitalCollectionValidator.validate_identifiers().
+_worker_validator = None
+
+
+def _init_validation_worker(validator):
+    """Set up a worker process for a process pool.
+
+    Args:
+        validator: a pickled copy of the validator that started the pool.
+    """
+    global _worker_validator
+    _worker_validator = validator
+
+
+def _validate_in_worker(identifier):
+    """Validate a single identifier inside a worker process.
+
+    Args:
+        identifier (str): e.g. 'mvol-0001-0002-0003'
+
+    Returns:
+        list: error messages, or an empty list. When the validator is
+        profiling, a tuple of error messages and profile records instead.
+    """
+    if _worker_validator.profile is None:
+        return _worker_validator.validate(identifier)
+    _worker_validator.profile = []
+    errors = _worker_validator.validate(identifier)
+    return errors, _worker_validator.profile
+
+
+class DirectorySnapshot:
+    """A listing of an identifier's directory and the directories directly
+    inside it (e.g. ALTO, TIFF), with the type, size and modification time of
+    every entry. Taking one snapshot per identifier lets every check share a
+    single pass over the filesystem instead of listing and stat'ing the same
+    directories again and again.
+
+    Relative paths use forward slashes, e.g. 'TIFF/mvol-0004-1930-0103_00000001.tif'.
+    The root of the snapshot is ''.
+    """
+
+    def __init__(self, path, mtime=0):
+        self.path = path
+        self.entries = {'': (True, 0, mtime)}
+        self.children = {'': []}
+
+    def __len__(self):
+        """The number of entries in the snapshot, not counting the root."""
+        return len(self.entries) - 1
+
+    def add(self, relpath, is_dir, size, mtime):
+        """Record an entry.
+
+        Args:
+            relpath (str): path relative to the root of the snapshot.
+            is_dir (bool)
+            size (int): size in bytes.
+            mtime (float): modification time as a unix timestamp.
+        """
+        parent, _, name = relpath.rpartition('/')
+        self.entries[relpath] = (is_dir, size, mtime)
+        self.children.setdefault(parent, []).append(name)
+        if is_dir:
+            self.children.setdefault(relpath, [])
+
+    def exists(self, relpath):
+        return relpath in self.entries
+
+    def isdir(self, relpath):
+        return relpath in self.entries and self.entries[relpath][0]
+
+    def isfile(self, relpath):
+        return relpath in self.entries and not self.entries[relpath][0]
+
+    def getsize(self, relpath):
+        """Get the size of an entry, raising FileNotFoundError like
+        os.path.getsize() if it does not exist."""
+        try:
+            return self.entries[relpath][1]
+        except KeyError:
+            raise FileNotFoundError(self.path + '/' + relpath)
+
+    def getmtime(self, relpath):
+        try:
+            return self.entries[relpath][2]
+        except KeyError:
+            raise FileNotFoundError(self.path + '/' + relpath)
+
+    def listdir(self, relpath=''):
+        """List the names in a directory, like os.listdir().
+
+        Raises:
+            FileNotFoundError: the directory is not in the snapshot.
+            NotADirectoryError: the entry is a file.
+        """
+        if relpath not in self.entries:
+            raise FileNotFoundError(self.path + '/' + relpath)
+        if not self.entries[relpath][0]:
+            raise NotADirectoryError(self.path + '/' + relpath)
+        return sorted(self.children.get(relpath, []))
+
+    def get_abspath(self, relpath):
+        return self.path + '/' + relpath
+
+    def get_newest_modification_time(self, exclude=()):
+        """Get the newest modification time of any entry in the snapshot,
+        including directories, so that deleted files count as changes too.
+
+        Args:
+            exclude: relative paths to leave out.
+
+        Returns:
+            float: a unix timestamp.
+        """
+        return max(e[2] for relpath, e in self.entries.items() if relpath not in exclude)
+
+
+class _PooledSFTPFile:
+    """A remote file that holds on to its SFTP channel until it is closed."""
+
+    def __init__(self, f, release):
+        self._f = f
+        self._release = release
+
+    def __getattr__(self, name):
+        return getattr(self._f, name)
+
+    def __iter__(self):
+        return iter(self._f)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self._release:
+            self._f.close()
+            self._release()
+            self._release = None
+
+
+class SFTPFilesystem:
+    """Read-only access to a remote filesystem over SSH, through a pool of
+    SSH connections with several SFTP channels each. Each request checks out
+    a channel of its own, so requests from different threads run side by
+    side. Methods mirror paramiko.SFTPClient.
+    """
+
+    def __init__(self, hostname, config=None, connections=2, channels=4,
+                 client_factory=None):
+        """Open the pool.
+
+        Args:
+            hostname (str): e.g. 'xtf.lib.uchicago.edu'
+            config (dict): keyword arguments for paramiko.SSHClient.connect(),
+            e.g. {'username': 'xtf'}
+            connections (int): number of SSH connections.
+            channels (int): number of SFTP channels per connection.
+            client_factory: a function that returns a connected object with
+            open_sftp() and close() methods, like paramiko.SSHClient. Used
+            for testing.
+        """
+        self.hostname = hostname
+        self.config = config or {}
+        self.clients = []
+        self.channels = queue.Queue()
+        self.threads = connections * channels
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+        for _ in range(connections):
+            if client_factory:
+                client = client_factory()
+            else:
+                client = paramiko.SSHClient()
+                # hosts have to be in known_hosts already.
+                client.load_system_host_keys()
+                client.set_missing_host_key_policy(paramiko.RejectPolicy())
+                client.connect(hostname, **self.config)
+            self.clients.append(client)
+            for _ in range(channels):
+                self.channels.put(client.open_sftp())
+
+    def close(self):
+        if self._executor:
+            self._executor.shutdown()
+        while not self.channels.empty():
+            self.channels.get().close()
+        for client in self.clients:
+            client.close()
+
+    @contextlib.contextmanager
+    def _channel(self):
+        """Check out an SFTP channel, waiting for one to be free.
+        paramiko's SFTPClient can not be shared between threads."""
+        channel = self.channels.get()
+        try:
+            yield channel
+        finally:
+            self.channels.put(channel)
+
+    def map(self, fn, args):
+        """Call fn for each argument, with one request in flight per channel.
+
+        Returns:
+            list: results in the same order as args.
+        """
+        args = list(args)
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self.threads
+                )
+        return list(self._executor.map(fn, args))
+
+    def listdir(self, path):
+        return [a.filename for a in self.listdir_attr(path)]
+
+    def listdir_attr(self, path):
+        """List a directory, with paramiko.SFTPAttributes for each entry.
+        READDIR requests are pipelined, so large directories do not cost one
+        round trip per batch of entries."""
+        with self._channel() as channel:
+            return list(channel.listdir_iter(path))
+
+    def listdir_attr_many(self, paths):
+        """List several directories concurrently.
+
+        Returns:
+            list: a list of SFTPAttributes lists, in the same order as paths.
+        """
+        return self.map(self.listdir_attr, paths)
+
+    def stat(self, path):
+        with self._channel() as channel:
+            return channel.stat(path)
+
+    def stat_many(self, paths):
+        """Stat several paths concurrently.
+
+        Returns:
+            list: SFTPAttributes, in the same order as paths.
+        """
+        return self.map(self.stat, paths)
+
+    def exec_lines(self, command):
+        """Run a shell command on the server and yield its output one line
+        at a time, as it arrives.
+
+        Args:
+            command (str): e.g. "find /data -printf '%p\\n'"
+
+        Returns:
+            a generator of lines, without line endings.
+        """
+        stdin, stdout, stderr = self.clients[0].exec_command(command)
+        stdin.close()
+        for line in stdout:
+            yield line.rstrip('\n')
+
+    def open(self, path, mode='r'):
+        """Open a remote file. It keeps its channel until it is closed, so
+        close it promptly (e.g. with a 'with' statement)."""
+        channel = self.channels.get()
+        try:
+            f = channel.open(path, mode)
+        except Exception:
+            self.channels.put(channel)
+            raise
+        return _PooledSFTPFile(f, lambda: self.channels.put(channel))
+
+    file = open
+
+
+class _Inotify:
+    """Linux's inotify API, through ctypes. Watches are not recursive, so
+    every directory needs a watch of its own.
+
+    Raises:
+        OSError: inotify is not available.
+    """
+
+    def __init__(self):
+        self._libc = ctypes.CDLL(None, use_errno=True)
+        try:
+            self._libc.inotify_add_watch.argtypes = (
+                ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32
+            )
+        except AttributeError:
+            raise OSError('inotify is not available on this platform')
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            e = ctypes.get_errno()
+            raise OSError(e, os.strerror(e))
+        self.paths = {}
+
+    def add_watch(self, path, mask=WATCH_MASK):
+        """Watch a directory.
+
+        Raises:
+            OSError: e.g. ENOSPC when the user's watch limit is reached.
+        """
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            e = ctypes.get_errno()
+            raise OSError(e, os.strerror(e), path)
+        self.paths[wd] = path
+
+    def read_events(self):
+        """Read the events that are waiting, without blocking.
+
+        Returns:
+            list: (path, mask, name) tuples, where path is the watched
+            directory and name is the entry in it that changed, or '' for
+            events about the directory itself or the queue.
+        """
+        try:
+            data = os.read(self.fd, 256 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = INOTIFY_EVENT.unpack_from(data, offset)
+            offset += INOTIFY_EVENT.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+            if mask & IN_IGNORED:
+                # the directory was removed.
+                self.paths.pop(wd, None)
+                continue
+            events.append((self.paths.get(wd), mask, name))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class LocalSentinelStore:
+    """Sentinel files kept in each identifier's own directory on the local
+    filesystem. Moves are renames, so only one scheduler can claim an
+    identifier."""
+
+    def __init__(self, validator):
+        """
+        Args:
+            validator: a DigitalCollectionValidator, for get_path().
+        """
+        self.validator = validator
+
+    def _get_sentinel_path(self, identifier, name):
+        return os.path.join(self.validator.get_path(identifier), name)
+
+    def get_sentinels(self, identifiers):
+        """Get the sentinels in some identifiers' directories.
+
+        Returns:
+            dict: identifiers mapped to dicts of sentinel names and their
+            modification times, as unix timestamps.
+        """
+        def get_sentinels(identifier):
+            sentinels = {}
+            try:
+                with os.scandir(self.validator.get_path(identifier)) as it:
+                    for entry in it:
+                        if entry.name in SENTINEL_NAMES and entry.is_file():
+                            sentinels[entry.name] = entry.stat().st_mtime
+            except FileNotFoundError:
+                pass
+            return sentinels
+        identifiers = list(identifiers)
+        return dict(zip(identifiers, self.validator._map_io(get_sentinels, identifiers)))
+
+    def move(self, identifier, source, target):
+        """Rename a sentinel, atomically, without replacing the target.
+        The target is hard linked to the source, which fails if it already
+        exists, and then the source is removed.
+
+        Returns:
+            bool: False if the source sentinel was already gone, or the
+            target already exists, e.g. because another scheduler claimed
+            the identifier first.
+        """
+        source_path = self._get_sentinel_path(identifier, source)
+        try:
+            os.link(source_path, self._get_sentinel_path(identifier, target))
+        except (FileNotFoundError, FileExistsError):
+            return False
+        try:
+            os.unlink(source_path)
+        except FileNotFoundError:
+            pass
+        return True
+
+    def touch(self, identifier, name):
+        """Update a sentinel's modification time, renewing a lease."""
+        try:
+            os.utime(self._get_sentinel_path(identifier, name))
+        except FileNotFoundError:
+            pass
+
+    def write(self, identifier, name, text):
+        """Write a sentinel. It is written to a temporary file first and
+        renamed into place, so it never appears half written."""
+        path = self._get_sentinel_path(identifier, name)
+        tmp_path = os.path.join(os.path.dirname(path), '.{}.tmp'.format(name))
+        with open(tmp_path, 'w') as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+
+    def remove(self, identifier, name):
+        try:
+            os.remove(self._get_sentinel_path(identifier, name))
+        except FileNotFoundError:
+            pass
+
+
+class SentinelQueue:
+    """Validate identifiers that have been marked 'ready'.
+
+    Each 'ready' sentinel is renamed to 'queue' to claim the identifier,
+    which is then validated by a pool of workers. When it is done, 'queue'
+    is replaced with 'valid', or with 'invalid' holding the error messages.
+    The modification time of 'queue' is a lease: while an identifier is
+    being validated its lease is renewed, and any 'queue' that goes
+    unrenewed for longer than the lease timeout, because the scheduler that
+    claimed it crashed, goes back to 'ready'.
+    """
+
+    def __init__(self, validator, store=None, lease_timeout=SENTINEL_LEASE_TIMEOUT,
+                 jobs=1, processes=False):
+        """
+        Args:
+            validator: a DigitalCollectionValidator.
+            store: where the sentinels are. Defaults to a
+            LocalSentinelStore. Anything with the same methods works, e.g.
+            sentinelutility.WebDAVSentinelStore.
+            lease_timeout (float): seconds before an unrenewed lease
+            expires.
+            jobs (int): number of workers.
+            processes (bool): see validate_identifiers().
+        """
+        self.validator = validator
+        self.store = store or LocalSentinelStore(validator)
+        self.lease_timeout = lease_timeout
+        self.jobs = jobs
+        self.processes = processes
+        # identifiers this scheduler has claimed, mapped to their futures.
+        self.in_flight = {}
+
+    def claim(self, identifiers):
+        """Claim every 'ready' identifier, and put expired leases back.
+
+        Returns:
+            list: the identifiers this scheduler claimed.
+        """
+        claimed = []
+        now = time.time()
+        for identifier, sentinels in sorted(self.store.get_sentinels(identifiers).items()):
+            if identifier in self.in_flight:
+                continue
+            if 'queue' in sentinels and now - sentinels['queue'] > self.lease_timeout:
+                if 'ready' in sentinels:
+                    # marked ready again while its scheduler was gone.
+                    self.store.remove(identifier, 'queue')
+                elif self.store.move(identifier, 'queue', 'ready'):
+                    sentinels['ready'] = now
+            if 'ready' in sentinels and self.store.move(identifier, 'ready', 'queue'):
+                # moves keep the modification time of 'ready', so start the
+                # lease now.
+                self.store.touch(identifier, 'queue')
+                claimed.append(identifier)
+        return claimed
+
+    def finish(self, identifier, errors):
+        """Replace an identifier's 'queue' sentinel with its result."""
+        if errors:
+            self.store.write(identifier, 'invalid', ''.join(errors))
+            self.store.remove(identifier, 'valid')
+        else:
+            self.store.write(identifier, 'valid', '')
+            self.store.remove(identifier, 'invalid')
+        self.store.remove(identifier, 'queue')
+
+    def process(self, identifier_chunks, poll_interval=SENTINEL_POLL_INTERVAL,
+                once=False, stop=None):
+        """Validate 'ready' identifiers as they appear.
+
+        Args:
+            identifier_chunks (list): e.g. ['mvol-0004']
+            poll_interval (float): seconds between looks for new 'ready'
+            sentinels.
+            once (bool): stop once everything that was ready at the start
+            is done.
+            stop: a threading.Event that ends processing when it is set.
+            Identifiers still being validated are finished first.
+
+        Returns:
+            a generator of (identifier, errors) tuples, as each identifier
+            is finished.
+        """
+        executor, validate = self.validator._get_validation_executor(
+            self.jobs,
+            self.processes
+        )
+        renew_interval = self.lease_timeout / 3
+        next_poll = next_renewal = time.monotonic()
+        try:
+            while True:
+                now = time.monotonic()
+                if now >= next_poll and not (stop and stop.is_set()):
+                    identifiers = []
+                    for identifier_chunk in identifier_chunks:
+                        identifiers.extend(self.validator.get_identifiers(identifier_chunk))
+                    for identifier in self.claim(identifiers):
+                        self.in_flight[identifier] = executor.submit(validate, identifier)
+                    next_poll = float('inf') if once else now + poll_interval
+                if now >= next_renewal:
+                    for identifier in self.in_flight:
+                        self.store.touch(identifier, 'queue')
+                    next_renewal = now + renew_interval
+
+                if not self.in_flight and (next_poll == float('inf') or (stop and stop.is_set())):
+                    return
+
+                timeout = max(0, min(next_poll, next_renewal) - time.monotonic())
+                if not self.in_flight:
+                    if stop:
+                        stop.wait(timeout)
+                    else:
+                        time.sleep(timeout)
+                    continue
+                done, _ = concurrent.futures.wait(
+                    list(self.in_flight.values()),
+                    timeout=timeout,
+                    return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                for identifier, future in sorted(self.in_flight.items()):
+                    if future not in done:
+                        continue
+                    del self.in_flight[identifier]
+                    try:
+                        errors = future.result()
+                    except concurrent.futures.BrokenExecutor:
+                        # a worker died. Put everything back, and start again
+                        # with a new pool.
+                        for i in [identifier] + list(self.in_flight):
+                            self.store.move(i, 'queue', 'ready')
+                        self.in_flight = {}
+                        executor.shutdown()
+                        executor, validate = self.validator._get_validation_executor(
+                            self.jobs,
+                            self.processes
+                        )
+                        next_poll = time.monotonic()
+                        break
+                    except Exception as e:
+                        errors = ['{} could not be validated: {}\n'.format(identifier, e)]
+                    if self.processes and self.validator.profile is not None:
+                        errors, profile = errors
+                        self.validator.profile.extend(profile)
+                    self.finish(identifier, errors)
+                    yield identifier, errors
+        finally:
+            executor.shutdown()
 
 
 class DigitalCollectionValidator:
     def __init__(self):
         self.local_root = None
+        self.snapshots = {}
+        self.io_threads = 8
+        self._io_executor = None
+        self._io_executor_lock = threading.Lock()
+        self.profile = None
+        self.inventory = {}
+
+    def __getstate__(self):
+        """Drop database and SSH connections and thread pools when a
+        validator is copied into a worker process. Workers only need the
+        settings. Passwords and keys are dropped too, so workers reconnect
+        with an SSH agent or key files."""
+        state = self.__dict__.copy()
+        for k in ('conn', 'ftp', '_io_executor', '_io_executor_lock'):
+            state.pop(k, None)
+        if state.get('ssh_connection'):
+            hostname, config = state['ssh_connection']
+            state['ssh_connection'] = (
+                hostname,
+                dict((k, v) for k, v in config.items() if k not in SSH_SECRET_KEYS)
+            )
+        if state.get('profile') is not None:
+            state['profile'] = []
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._io_executor = None
+        self._io_executor_lock = threading.Lock()
+        # workers open their own SSH connections.
+        if state.get('ssh_connection'):
+            self.connect(*state['ssh_connection'])
+
+    def connect(self, hostname, config):
+        """Read files over SSH instead of from the local filesystem. Paths
+        still come from get_path(), so set_local_root() should point at the
+        remote root.
+
+        Args:
+            hostname (str): e.g. 'xtf.lib.uchicago.edu'
+            config (dict): keyword arguments for paramiko.SSHClient.connect(),
+            e.g. {'username': 'xtf'}. The host has to be in known_hosts.
+            Worker processes reconnect without any password or key given
+            here, so validating with processes needs an SSH agent or key
+            files.
+        """
+        self.ftp = SFTPFilesystem(hostname, config)
+        self.ssh_connection = (hostname, config)
+
+    def _open(self, path, mode='r'):
+        """Open a file locally, or over SSH after connect()."""
+        record = getattr(_profile_state, 'record', None)
+        if record is not None:
+            with _profile_lock:
+                record.files += 1
+        if getattr(self, 'ftp', None):
+            return self.ftp.open(path, mode)
+        return open(path, mode)
+
+    def _listdir(self, path):
+        """List a directory locally, or over SSH after connect()."""
+        if getattr(self, 'ftp', None):
+            return self.ftp.listdir(path)
+        return os.listdir(path)
+
+    def _listdir_many(self, paths):
+        """List many directories at once on the shared pool of I/O threads,
+        locally or over SSH, so that a listing takes about as long as its
+        slowest directory rather than the sum of all of them.
+
+        Args:
+            paths (list): directories to list.
+
+        Returns:
+            a generator of sorted lists of the names in each directory, in
+            the same order as paths. Each listing is yielded as soon as it
+            and the ones before it are done.
+        """
+        for names in self._iter_io(self._listdir, paths):
+            yield sorted(names)
+
+    def set_io_threads(self, io_threads):
+        """Set the number of threads used to overlap file reads within a
+        single identifier, e.g. parsing every ALTO file of an issue.
+
+        Args:
+            io_threads (int): 1 reads files one at a time.
+        """
+        self.io_threads = io_threads
+
+    def _map_io(self, fn, items):
+        """Call fn on each item using a shared pool of I/O threads.
+
+        Args:
+            fn: a function that takes one argument.
+            items (list)
+
+        Returns:
+            list: results, in the same order as items.
+        """
+        return list(self._iter_io(fn, items))
+
+    def _iter_io(self, fn, items):
+        """Like _map_io(), but results are yielded in order as they are
+        done instead of all at once."""
+        items = list(items)
+        if self.io_threads <= 1 or len(items) <= 1:
+            return (fn(i) for i in items)
+        with self._io_executor_lock:
+            if self._io_executor is None:
+                self._io_executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self.io_threads
+                )
+        record = getattr(_profile_state, 'record', None)
+        if record is not None:
+            fn = self._get_profiled_io_function(fn, record)
+        return self._io_executor.map(fn, items)
+
+    @staticmethod
+    def _get_profiled_io_function(fn, record):
+        """Wrap a function run in the I/O pool, so that the I/O it does is
+        counted towards the check that started it."""
+        def profiled(item):
+            previous = getattr(_profile_state, 'record', None)
+            _profile_state.record = record
+            start = _read_proc_io()
+            try:
+                return fn(item)
+            finally:
+                bytes_read, read_write_syscalls = _get_proc_io_delta(start)
+                with _profile_lock:
+                    record.worker_bytes_read += bytes_read
+                    record.worker_read_write_syscalls += read_write_syscalls
+                _profile_state.record = previous
+        return profiled
+
+    def enable_profiling(self):
+        """Start recording wall time, files opened, bytes read and read and
+        write syscalls for each check of each identifier. Other syscalls,
+        e.g. stat, open and getdents, are not counted. Records collect in
+        self.profile, see write_profile_jsonl() and
+        write_profile_prometheus(). Bytes and syscalls come from
+        /proc/thread-self/io, so they are zero where that isn't available.
+        """
+        self.profile = []
+
+    @contextlib.contextmanager
+    def _profile(self, identifier, check):
+        """Profile a block of code as one check of an identifier. Does
+        nothing unless enable_profiling() was called. Checks can be nested,
+        e.g. each check inside validate() as a whole.
+
+        Args:
+            identifier (str): e.g. 'mvol-0001-0002-0003'
+            check (str): e.g. 'validate_pdf'
+        """
+        if self.profile is None:
+            yield
+            return
+
+        record = _CheckProfile(identifier, check)
+        previous = getattr(_profile_state, 'record', None)
+        _profile_state.record = record
+        start_io = _read_proc_io()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            record.seconds = time.perf_counter() - start
+            bytes_read, read_write_syscalls = _get_proc_io_delta(start_io)
+            with _profile_lock:
+                record.bytes_read = bytes_read + record.worker_bytes_read
+                record.read_write_syscalls = read_write_syscalls + record.worker_read_write_syscalls
+                if previous is not None:
+                    previous.files += record.files
+                    previous.worker_bytes_read += record.worker_bytes_read
+                    previous.worker_read_write_syscalls += record.worker_read_write_syscalls
+            _profile_state.record = previous
+            self.profile.append(record.as_dict())
+
+    def connect_to_db(self, db_path, timeout=DB_BUSY_TIMEOUT):
+        """Open the validation database. Writers wait for each other
+        instead of failing with 'database is locked'.
+
+        Args:
+            db_path (str): path to the sqlite database.
+            timeout (float): seconds to wait for a lock.
+        """
+        self.conn = sqlite3.connect(db_path, timeout=timeout)
+        self._set_synchronous()
+        self.db_has_hierarchy = None
+
+    def _set_synchronous(self, journal_mode=None):
+        """Sync less often when the database is in WAL mode, see
+        upgrade_db(). That is safe there: a power failure can lose the last
+        transactions, but can't corrupt the database. Other journal modes
+        keep sqlite's default.
+
+        Args:
+            journal_mode (str): the database's journal mode, if known.
+        """
+        if journal_mode is None:
+            journal_mode = self.conn.execute('PRAGMA journal_mode').fetchone()[0]
+        if journal_mode.lower() == 'wal':
+            self.conn.execute('PRAGMA synchronous=NORMAL')
+
+    def upgrade_db(self):
+        """Add columns, indexes and triggers that newer versions of these
+        scripts rely on to the validation table. Safe to run on a database
+        that is already up to date.
+
+        Columns:
+            entry_count (int): the number of files and directories an
+            identifier had when it was validated.
+
+            project, level1, level2, level3, level4 (str): the sections of
+            the identifier, e.g. 'mvol', '0004', '1930', '0103', NULL.
+
+            depth (int): the number of sections in the identifier.
+
+        The hierarchy columns are indexed, and kept up to date by triggers,
+        so rows inserted by other programs are covered too.
+
+        Identifiers are made unique, keeping the newest row for each, so
+        that results can be upserted by record_validation_results().
+
+        The digest table, used by get_digests(), is created as well.
+
+        The database is switched to WAL journaling, which sticks for every
+        later connection, so readers never wait behind a long write.
+        """
+        self._set_synchronous(
+            self.conn.execute('PRAGMA journal_mode=WAL').fetchone()[0]
+        )
+        self._create_digest_table()
+        c = self.conn.cursor()
+        columns = set(r[1] for r in c.execute('PRAGMA table_info(validation)'))
+        if 'entry_count' not in columns:
+            c.execute('ALTER TABLE validation ADD COLUMN entry_count INTEGER')
+
+        if 'depth' not in columns:
+            for column in HIERARCHY_COLUMNS:
+                c.execute('ALTER TABLE validation ADD COLUMN {} TEXT'.format(column))
+            c.execute('ALTER TABLE validation ADD COLUMN depth INTEGER')
+            for sql in _get_hierarchy_update_sql('1'):
+                c.execute(sql)
+
+        for event in ('INSERT', 'UPDATE OF identifier'):
+            c.execute(
+                'CREATE TRIGGER IF NOT EXISTS validation_hierarchy_{} AFTER {} ON validation BEGIN {}; END'.format(
+                    event.split()[0].lower(),
+                    event,
+                    '; '.join(_get_hierarchy_update_sql('rowid = NEW.rowid'))
+                )
+            )
+        indexes = set(r[1] for r in c.execute('PRAGMA index_list(validation)'))
+        if 'validation_identifier_unique' not in indexes:
+            c.execute('CREATE INDEX IF NOT EXISTS validation_identifier ON validation (identifier)')
+            c.execute(
+                ' '.join((
+                    'DELETE FROM validation WHERE EXISTS (SELECT 1 FROM validation AS newer',
+                    'WHERE newer.identifier = validation.identifier',
+                    "AND (COALESCE(newer.validation_date, '') > COALESCE(validation.validation_date, '')",
+                    "OR (COALESCE(newer.validation_date, '') = COALESCE(validation.validation_date, '')",
+                    'AND newer.rowid > validation.rowid)))'
+                ))
+            )
+            c.execute('CREATE UNIQUE INDEX validation_identifier_unique ON validation (identifier)')
+            c.execute('DROP INDEX IF EXISTS validation_identifier')
+        c.execute(
+            'CREATE INDEX IF NOT EXISTS validation_hierarchy ON validation ({}, depth, validation, identifier)'.format(
+                ', '.join(HIERARCHY_COLUMNS)
+            )
+        )
+        self.conn.commit()
+        self.db_has_hierarchy = True
+
+    def _create_digest_table(self):
+        """Create the table that caches file digests, if it does not exist.
+        Files are keyed by path, with the size, modification time (in
+        nanoseconds) and inode they had when they were hashed."""
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS digest (path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, inode INTEGER, digest TEXT, digest_date TEXT)'
+        )
+        self.conn.commit()
+
+    def record_validation_results(self, results, validation_date=None,
+                                  states=None, batch_size=VALIDATION_BATCH_SIZE):
+        """Store validation results, replacing earlier results for the same
+        identifiers. Rows are upserted in large transactions, so several
+        processes can record results at once without holding the database
+        for long. Requires upgrade_db().
+
+        Args:
+            results: an iterable of (identifier, errors) tuples, e.g. from
+            validate_identifiers().
+            validation_date (str): ISO timestamp for every result. Defaults
+            to now.
+            states (dict): identifiers mapped to (unix timestamp, entry
+            count) tuples, from get_changed_identifiers(). Identifiers
+            without a state are recorded without an identifier_date or
+            entry_count.
+            batch_size (int): rows per transaction.
+
+        Returns:
+            int: the number of results recorded.
+        """
+        if validation_date is None:
+            validation_date = datetime.datetime.now().isoformat()
+        states = states or {}
+
+        sql = ' '.join((
+            'INSERT INTO validation (identifier, identifier_date, entry_count, validation, validation_date, validation_errors)',
+            'VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (identifier) DO UPDATE SET',
+            'identifier_date = excluded.identifier_date, entry_count = excluded.entry_count,',
+            'validation = excluded.validation, validation_date = excluded.validation_date,',
+            'validation_errors = excluded.validation_errors'
+        ))
 
-    def connect_to_db(self, db_path):
-        self.conn = sqlite3.connect(db_path)
+        count = 0
+        rows = []
+        for identifier, errors in results:
+            state = states.get(identifier)
+            if state:
+                identifier_date = datetime.datetime.fromtimestamp(state[0]).isoformat()
+                entry_count = state[1]
+            else:
+                identifier_date = None
+                entry_count = None
+            rows.append((
+                identifier,
+                identifier_date,
+                entry_count,
+                int(not errors),
+                validation_date,
+                ''.join(errors)
+            ))
+            if len(rows) >= batch_size:
+                with self.conn:
+                    self.conn.executemany(sql, rows)
+                count += len(rows)
+                rows = []
+        if rows:
+            with self.conn:
+                self.conn.executemany(sql, rows)
+            count += len(rows)
+        return count
+
+    def delete_validation_results(self, identifiers):
+        """Delete stored results, e.g. for identifiers whose directories
+        were removed.
+
+        Args:
+            identifiers (list): e.g. ['mvol-0004-1930-0103', ...]
+        """
+        with self.conn:
+            self.conn.executemany(
+                'DELETE FROM validation WHERE identifier = ?',
+                [(i,) for i in identifiers]
+            )
+
+    def _has_hierarchy(self):
+        """Check if upgrade_db() has added hierarchy columns to this database."""
+        if self.db_has_hierarchy is None:
+            c = self.conn.cursor()
+            columns = set(r[1] for r in c.execute('PRAGMA table_info(validation)'))
+            self.db_has_hierarchy = 'depth' in columns
+        return self.db_has_hierarchy
+
+    @staticmethod
+    def _get_hierarchy_where(identifier_chunk):
+        """Build a WHERE clause that matches an identifier chunk and
+        everything under it using the indexed hierarchy columns.
+
+        Returns:
+            tuple: (SQL, parameters)
+        """
+        levels = identifier_chunk.split('-')
+        return (
+            ' AND '.join('{} = ?'.format(c) for c in HIERARCHY_COLUMNS[:len(levels)]),
+            levels
+        )
 
     def get_identifiers_from_db(self, identifier_chunk, valid_only=True):
         """Get valid and non-valid identifiers for a given identifier chunk.
@@ -38,15 +1799,22 @@ class DigitalCollectionValidator:
         """
     
         c = self.conn.cursor()
-        if valid_only:
-            sql = 'SELECT identifier FROM validation WHERE (identifier LIKE ? OR identifier = ?) AND validation = 1'
+        if self._has_hierarchy() and identifier_chunk.count('-') < len(HIERARCHY_COLUMNS):
+            where, params = self._get_hierarchy_where(identifier_chunk)
+            sql = 'SELECT identifier FROM validation WHERE ' + where
+            if valid_only:
+                sql += ' AND validation = 1'
+            c.execute(sql, params)
         else:
-            sql = 'SELECT identifier FROM validation WHERE (identifier LIKE ? OR identifier = ?)'
+            if valid_only:
+                sql = 'SELECT identifier FROM validation WHERE (identifier LIKE ? OR identifier = ?) AND validation = 1'
+            else:
+                sql = 'SELECT identifier FROM validation WHERE (identifier LIKE ? OR identifier = ?)'
 
-        c.execute(
-            sql,
-            ('{}-%'.format(identifier_chunk), identifier_chunk)
-        )
+            c.execute(
+                sql,
+                ('{}-%'.format(identifier_chunk), identifier_chunk)
+            )
         identifiers = set()
         for r in c.fetchall():
             identifiers.add(r[0])
@@ -70,6 +1838,9 @@ class DigitalCollectionValidator:
         """
     
         child_chunk_count = len(identifier_chunk.split('-')) + 1
+
+        if self._has_hierarchy() and child_chunk_count <= len(HIERARCHY_COLUMNS):
+            return [r[0] for r in self.get_identifier_chunk_summary_from_db(identifier_chunk) if r[2]]
     
         identifier_chunks = set()
         for i in self.get_identifiers_from_db(identifier_chunk):
@@ -78,6 +1849,37 @@ class DigitalCollectionValidator:
                 identifier_chunks.add(test_child)
         return sorted(list(identifier_chunks))
 
+    def get_identifier_chunk_summary_from_db(self, identifier_chunk):
+        """Count the identifiers under each child of an identifier chunk,
+        with a single indexed GROUP BY query. Requires upgrade_db(), which
+        makes identifiers unique, so rows can be counted directly.
+
+        Args:
+            identifier_chunk (str): e.g., 'mvol', 'mvol-0005',
+            'mvol-0005-0001'
+
+        Returns:
+            a list of (child, identifiers, valid, invalid) tuples, e.g.
+            ('mvol-0005', 17, 15, 2), sorted by child.
+        """
+        depth = identifier_chunk.count('-') + 1
+        if depth >= len(HIERARCHY_COLUMNS):
+            return []
+
+        child_column = HIERARCHY_COLUMNS[depth]
+        where, params = self._get_hierarchy_where(identifier_chunk)
+        c = self.conn.cursor()
+        c.execute(
+            ' '.join((
+                'SELECT {0}, COUNT(*), SUM(validation = 1), SUM(validation = 0)',
+                'FROM validation WHERE {1} AND depth > ? GROUP BY {0} ORDER BY {0}'
+            )).format(child_column, where),
+            params + [depth]
+        )
+        return [
+            ('{}-{}'.format(identifier_chunk, r[0]), r[1], r[2], r[3])
+            for r in c.fetchall()
+        ]
 
     def set_local_root(self, local_root):
         """Set a local root for local validation
@@ -170,17 +1972,10 @@ class DigitalCollectionValidator:
         Returns:
             str: the first part of the identifier chunk.
         """
-        project = re.sub('-.*', '', identifier_chunk)
-        if project in ('ewm', 'gms', 'mvol', 'speculum'):
-            return project
-        elif 'apf' in identifier_chunk:
-            return 'apf'
-        elif 'chopin' in identifier_chunk:
-            return 'chopin'
-        elif 'rac' in identifier_chunk or 'chess' in identifier_chunk or 'rose' in identifier_chunk:
-            return 'rac'
-        else:
+        project = parse_identifier(identifier_chunk).project
+        if project is None:
             raise NotImplementedError
+        return project
 
     def is_identifier(self, identifier_chunk):
         """Return true if this identifier chunk is a complete identifier. 
@@ -191,25 +1986,10 @@ class DigitalCollectionValidator:
         Returns:
             bool
         """
-        if self.get_project(identifier_chunk) == 'ewm':
-            return bool(re.match('^ewm-\d{4}$', identifier_chunk))
-        elif self.get_project(identifier_chunk) == 'gms':
-            return bool(re.match('^gms-\d{4}$', identifier_chunk))
-        elif self.get_project(identifier_chunk) == 'mvol':
-            return bool(re.match('^mvol-\d{4}-\d{4}-[0-9A-Z]{4}(-\d{2})?$', identifier_chunk))
-        elif self.get_project(identifier_chunk) == 'speculum':
-            return bool(re.match('^speculum-\d{4}$', identifier_chunk))
-        elif self.get_project(identifier_chunk) == 'apf':
-            return (bool(re.match('^apf\d{1}-\d{5}$',identifier_chunk))
-                    or bool(re.match('^apf\d{1}-\d{5}-\d{3}',identifier_chunk)))
-        elif self.get_project(identifier_chunk) == 'chopin':
-            return bool(re.match('^chopin-\d{3}$',identifier_chunk)) 
-        elif self.get_project(identifier_chunk) == 'rac':
-            return (bool(re.match('^rac-\d{4}$',identifier_chunk))
-                    or bool(re.match('^chess-\d{4}-\d{3}$',identifier_chunk))
-                    or bool(re.match('^rose-\d{4}-\d{3}$',identifier_chunk)))
-        else:
+        parsed = parse_identifier(identifier_chunk)
+        if parsed.project is None:
             raise NotImplementedError
+        return parsed.is_identifier
 
     def is_identifier_chunk(self, identifier_chunk):
         """Return true if this is a valid identifier chunk.
@@ -221,53 +2001,49 @@ class DigitalCollectionValidator:
         Returns:
             bool
         """
-        if self.get_project(identifier_chunk) == 'ewm':
-            r = '^ewm(-\d{4}(-\d{4}([A-Za-z]{2})?)?)?$'
-        elif self.get_project(identifier_chunk) == 'gms':
-            r = '^gms(-\d{4}(-\d{3})?)?$'
-        elif self.get_project(identifier_chunk) == 'mvol':
-            r = '^mvol(-\d{4}(-\d{4}(-[0-9A-Z]{4}(-\d{2})?)?)?)?$'
-        elif self.get_project(identifier_chunk) == 'speculum':
-            r = '^speculum(-\d{4}(-\d{3})?)?$'
-        elif self.get_project(identifier_chunk) == 'apf':
-            r = '^apf(\d{1}(-\d{5}(-\d{3})?)?)?$'
-        elif self.get_project(identifier_chunk) == 'chopin':
-            r = '^chopin(-\d{3}(-\d{3})?)?$'
-        elif self.get_project(identifier_chunk) == 'rac':
-            q = '^rac(-\d{4})?$'
-            r = '^chess-\d{4}-\d{3}?$'
-            s = '^rose-\d{4}-\d{3}?$'
-            return (bool(re.match(q, identifier_chunk)) 
-                    or bool(re.match(r, identifier_chunk)) 
-                    or bool(re.match(s, identifier_chunk)))
-        else:
+        parsed = parse_identifier(identifier_chunk)
+        if parsed.project is None:
             raise NotImplementedError
-        return bool(re.match(r, identifier_chunk))
+        return parsed.is_identifier_chunk
 
     def recursive_ls(self, identifier_chunk):
-        """Get a list of identifiers in on disk. 
+        """Get the identifiers on disk under an identifier chunk, by looking
+        for .dc.xml files. Directories are read with os.scandir, in sorted
+        order, and identifiers are yielded as soon as they are found. For
+        projects with a known layout the walk stops at the directories
+        that hold .dc.xml files, so page directories are never read.
 
         Args:
             identifier chunk (str): e.g., 'mvol-0001', 'mvol-0001-0002-0003'
 
         Returns:
-            list: a list of identifiers, e.g. 'mvol-0001-0002-0003'
+            a generator of identifiers, e.g. 'mvol-0001-0002-0003'
         """
-        output = subprocess.run(
-            [
-                'find',
-                self.local_root + os.sep + identifier_chunk.replace('-', os.sep),
-                '-name',
-                '*.dc.xml'
-            ],
-            capture_output=True
-        )
-        identifiers = []
-        for line in output.stdout.decode('utf-8').split('\n'):
-            potential_identifier = os.path.basename(line).replace('.dc.xml', '')
-            if potential_identifier and self.is_identifier(potential_identifier):
-                identifiers.append(potential_identifier)
-        return identifiers
+        levels = identifier_chunk.split('-')
+        max_depth = DC_XML_DEPTHS.get(parse_identifier(identifier_chunk).project)
+
+        stack = [(self.local_root + os.sep + os.sep.join(levels), len(levels))]
+        while stack:
+            path, depth = stack.pop()
+            try:
+                with os.scandir(path) as it:
+                    entries = sorted(it, key=lambda e: e.name)
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+
+            subdirectories = []
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    # below the .dc.xml depth, only descend into two-digit
+                    # directories, e.g. mvol/0001/0002/0003/01.
+                    if (max_depth is None or depth < max_depth
+                            or (depth == max_depth and re.match(r'^\d{2}$', entry.name))):
+                        subdirectories.append((entry.path, depth + 1))
+                elif entry.name.endswith('.dc.xml'):
+                    potential_identifier = entry.name.replace('.dc.xml', '')
+                    if potential_identifier and self.is_identifier(potential_identifier):
+                        yield potential_identifier
+            stack.extend(reversed(subdirectories))
 
     def list_directory(self, identifier):
         """Get a list of files from starting identifier.
@@ -297,11 +2073,15 @@ class DigitalCollectionValidator:
 
         #prints all the files in all existing directories
         if identifier in general:
-            dir_files = os.listdir(self.get_path(identifier))
-            for chunk in dir_files:
-                for folder in os.listdir(self.get_path(chunk)):
-                    if '.' not in folder:
-                        identifiers += os.listdir(self.get_path(chunk) + '/' + str(folder))
+            chunk_paths = [
+                self.get_path(chunk)
+                for chunk in sorted(self._listdir(self.get_path(identifier)))
+            ]
+            folder_paths = []
+            for chunk_path, folders in zip(chunk_paths, self._listdir_many(chunk_paths)):
+                folder_paths += [chunk_path + '/' + f for f in folders if '.' not in f]
+            for files in self._listdir_many(folder_paths):
+                identifiers += files
             return identifiers
 
         #prints all files in specified directory
@@ -312,10 +2092,9 @@ class DigitalCollectionValidator:
         elif 'speculum' in identifier:
             path = self.get_path(identifier[:13])
 
-        dir_files = os.listdir(path)
-        for folder in dir_files:
-            if '.' not in folder:
-                identifiers += os.listdir(path + '/' + str(folder))
+        folder_paths = [path + '/' + f for f in sorted(self._listdir(path)) if '.' not in f]
+        for files in self._listdir_many(folder_paths):
+            identifiers += files
 
         #searching for single, unique file
         if length >= general[self.get_project(identifier)]:
@@ -356,55 +2135,387 @@ class DigitalCollectionValidator:
         
         return ['{} tiff missing\n'.format(identifier)]
 
-    def validate_tiff_directory(self, identifier, folder_name):
-        """Validates TIFF directories within an identifier.
-        
+    def validate_tiff_directory(self, identifier, folder_name):
+        """Validates TIFF directories within an identifier.
+        
+        Args:
+            identifier (str): e.g. 'chopin-001' 
+            folder_name (str): e.g. 'TIFF' 
+            
+        Returns:
+            pass: empty list
+            fail: list with error messages
+        """
+
+        extensions = {
+            'ALTO': 'xml',
+            'JPEG': 'jpg',
+            'POS': 'pos',
+            'TIFF': 'tif'
+        }
+
+        if folder_name not in extensions:
+            raise ValueError('unsupported folder name.\n')
+
+        if not self.is_identifier(identifier):
+            raise ValueError('invalid identifier.\n')
+
+        path = self.get_path(identifier)
+        folders = os.listdir(path)
+
+        entries = []
+        for directory in folders:
+            if '.' not in directory:
+                for entry in os.listdir(path + '/' + str(directory)):
+                    entries.append(path + '/' + directory + '/' + str(entry))
+        
+        # read the headers of nonempty TIFFs concurrently.
+        def check(i):
+            if folder_name != 'TIFF' or not i.endswith(extensions[folder_name]):
+                return None
+            with open(i, 'rb') as f:
+                try:
+                    self._check_tiff_structure(f)
+                except ValueError as e:
+                    return str(e)
+            return None
+
+        errors = []
+        for i, problem in zip(entries, self._map_io(check, entries)):
+            file_name = i.split('/')[-1]
+
+            if not file_name.endswith(extensions[folder_name]):
+                errors.append('%s is not a tif file' % file_name)
+
+            f = open(i)
+            empty = self._validate_file_notempty(f)
+            if empty:
+                errors.append(empty[0])
+            elif problem:
+                errors.append('%s problem: %s.\n' % (file_name, problem))
+            f.close()
+
+        return errors
+                        
+
+    def get_identifiers(self, identifier_chunk, from_db=False, valid_only=False):
+        """Expand an identifier chunk into the identifiers it contains,
+        either by looking on disk or by asking the database.
+
+        Args:
+            identifier_chunk (str): e.g., 'mvol', 'mvol-0004',
+            'mvol-0004-1930', 'mvol-0004-1930-0103'
+
+            from_db (bool): use the validation database instead of the
+            local filesystem.
+
+            valid_only (bool): when reading from the database, only return
+            identifiers that passed validation.
+
+        Returns:
+            list: a sorted list of identifiers.
+        """
+        if from_db:
+            return self.get_identifiers_from_db(identifier_chunk, valid_only)
+        return sorted(set(self.recursive_ls(identifier_chunk)))
+
+    def validate_identifiers(self, identifiers, jobs=1, processes=False):
+        """Validate many identifiers, spreading calls to validate() over a
+        pool of threads or processes. Results are yielded in the same order
+        as the identifiers that were passed in, as soon as each one (and
+        everything before it) is done, so output matches a serial run.
+
+        Args:
+            identifiers (list): e.g. ['mvol-0004-1930-0103', ...]
+            jobs (int): number of workers. With 1, identifiers are validated
+            serially in this process.
+            processes (bool): use a process pool instead of a thread pool.
+            Threads work well for I/O-bound checks, processes help when
+            parsing dominates.
+
+        Returns:
+            a generator of (identifier, errors) tuples.
+        """
+        identifiers = list(identifiers)
+
+        if jobs <= 1 or len(identifiers) <= 1:
+            for identifier in identifiers:
+                yield identifier, self.validate(identifier)
+            return
+
+        executor, validate = self._get_validation_executor(jobs, processes)
+        if processes:
+            results = executor.map(
+                validate,
+                identifiers,
+                chunksize=max(1, min(16, len(identifiers) // (jobs * 4)))
+            )
+            if self.profile is not None:
+                results = self._collect_worker_profiles(results)
+        else:
+            results = executor.map(validate, identifiers)
+
+        with executor:
+            for identifier, errors in zip(identifiers, results):
+                yield identifier, errors
+
+    def _get_validation_executor(self, jobs, processes=False):
+        """Start a pool of validation workers.
+
+        Returns:
+            tuple: (executor, function). The function validates one
+            identifier in a worker. In a process pool it returns a tuple of
+            errors and profile records when this validator is profiling.
+        """
+        if processes:
+            # spawn rather than fork: forking while I/O threads are running
+            # can leave locks held forever in the child.
+            executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=jobs,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_validation_worker,
+                initargs=(self,)
+            )
+            return executor, _validate_in_worker
+        return concurrent.futures.ThreadPoolExecutor(max_workers=jobs), self.validate
+
+    def _collect_worker_profiles(self, results):
+        """Add profile records sent back by worker processes to this
+        validator's profile, passing the errors through."""
+        for errors, profile in results:
+            self.profile.extend(profile)
+            yield errors
+
+    def get_identifier_state(self, identifier):
+        """Get the newest modification time and the number of entries in an
+        identifier's directory. Validation results are still current as long
+        as neither of these has changed. Sentinel files are left out, so that
+        renewing a lease or writing a result doesn't count as a change.
+
+        Args:
+            identifier (str): e.g. 'mvol-0001-0002-0003'
+
+        Returns:
+            tuple: (unix timestamp, entry count)
+        """
+        snapshot = self.get_directory_snapshot(identifier)
+        return (
+            snapshot.get_newest_modification_time(SENTINEL_NAMES),
+            len(snapshot) - len([n for n in SENTINEL_NAMES if snapshot.exists(n)])
+        )
+
+    def needs_validation(self, identifier, state, check_count=False):
+        """Compare an identifier's current state against its last recorded
+        validation result.
+
+        Args:
+            identifier (str): e.g. 'mvol-0001-0002-0003'
+            state (tuple): (unix timestamp, entry count), from
+            get_identifier_state().
+            check_count (bool): also treat a change in the number of entries
+            as a change. Requires upgrade_db().
+
+        Returns:
+            bool: True if the identifier has never been validated, or if it
+            has changed since it was.
+        """
+        c = self.conn.cursor()
+        if check_count:
+            sql = 'SELECT validation_date, entry_count FROM validation WHERE identifier = ? ORDER BY validation_date DESC LIMIT 1'
+        else:
+            sql = 'SELECT validation_date, NULL FROM validation WHERE identifier = ? ORDER BY validation_date DESC LIMIT 1'
+        row = c.execute(sql, (identifier,)).fetchone()
+
+        if row is None or not row[0]:
+            return True
+        mtime, entry_count = state
+        if datetime.datetime.fromtimestamp(mtime) >= datetime.datetime.fromisoformat(row[0]):
+            return True
+        if check_count and row[1] is not None and row[1] != entry_count:
+            return True
+        return False
+
+    def get_changed_identifiers(self, identifiers, check_count=False):
+        """Find the identifiers that need to be validated again, for
+        incremental runs. Identifiers whose directories are missing are
+        included, so that validation can report them.
+
+        Args:
+            identifiers (list): e.g. ['mvol-0004-1930-0103', ...]
+            check_count (bool): see needs_validation().
+
+        Returns:
+            dict: identifiers that changed, mapped to their current state, or
+            to None if their directory is missing.
+        """
+        changed = {}
+        for identifier, state in self.get_identifier_states(identifiers).items():
+            if state is None or self.needs_validation(identifier, state, check_count):
+                changed[identifier] = state
+        return changed
+
+    def get_identifier_states(self, identifiers):
+        """Get the current state of many identifiers, e.g. to record with
+        the results of a full run, so that the next incremental run can
+        skip anything that hasn't changed.
+
+        Args:
+            identifiers (list): e.g. ['mvol-0004-1930-0103', ...]
+
+        Returns:
+            dict: identifiers mapped to (unix timestamp, entry count)
+            tuples, see get_identifier_state(), or to None if their
+            directory is missing.
+        """
+        states = {}
+        for identifier in identifiers:
+            try:
+                states[identifier] = self.get_identifier_state(identifier)
+            except FileNotFoundError:
+                states[identifier] = None
+        return states
+
+    def get_directory_snapshot(self, identifier):
+        """Take a snapshot of an identifier's directory and the directories
+        directly inside it with os.scandir, recording names, types, sizes
+        and modification times. Identifiers in the inventory, see
+        load_inventory(), use their snapshot from there.
+
+        Args:
+            identifier (str): e.g. 'mvol-0001-0002-0003'
+
+        Returns:
+            DirectorySnapshot
+
+        Raises:
+            FileNotFoundError: the identifier's directory does not exist.
+        """
+        if identifier in self.inventory:
+            return self.inventory[identifier]
+        path = self.get_path(identifier)
+        if getattr(self, 'ftp', None):
+            return self._get_remote_directory_snapshot(path)
+        snapshot = DirectorySnapshot(path, os.stat(path).st_mtime)
+        for d in self._scandir_into_snapshot(snapshot, path, ''):
+            self._scandir_into_snapshot(snapshot, path + '/' + d, d + '/')
+        return snapshot
+
+    @contextlib.contextmanager
+    def use_inventory(self, identifiers):
+        """Validate from an inventory of these identifiers, see
+        load_inventory(), until the block ends. The inventory is dropped
+        afterwards, so later snapshots read the server again.
+
+        Args:
+            identifiers (list): e.g. ['mvol-0004-1930-0103', ...]
+        """
+        self.load_inventory(identifiers)
+        try:
+            yield
+        finally:
+            self.inventory = {}
+
+    def load_inventory(self, identifiers):
+        """Take directory snapshots of many identifiers on the remote server
+        at once, with one 'find' command per batch of identifiers, instead
+        of listing each identifier's directories over SFTP. Validating these
+        identifiers afterwards needs no more listings. The inventory is
+        kept until it is cleared, so prefer use_inventory(), which clears
+        it when validation is done. Requires connect().
+
         Args:
-            identifier (str): e.g. 'chopin-001' 
-            folder_name (str): e.g. 'TIFF' 
-            
+            identifiers (list): e.g. ['mvol-0004-1930-0103', ...]
+
         Returns:
-            pass: empty list
-            fail: list with error messages
+            int: the number of identifiers found on the server.
         """
+        roots = dict((self.get_path(i), i) for i in identifiers)
+        snapshots = {}
+        # snapshots cover an identifier's directory and the directories
+        # directly inside it.
+        for root, depth, file_type, size, mtime, path in self._find(roots, maxdepth=2):
+            identifier = roots[root]
+            if depth == 0:
+                snapshots[identifier] = DirectorySnapshot(root, mtime)
+            elif identifier in snapshots:
+                snapshots[identifier].add(
+                    path[len(root) + 1:],
+                    file_type == 'd',
+                    size,
+                    mtime
+                )
+        self.inventory.update(snapshots)
+        return len(snapshots)
 
-        extensions = {
-            'ALTO': 'xml',
-            'JPEG': 'jpg',
-            'POS': 'pos',
-            'TIFF': 'tif'
-        }
+    def _get_remote_directory_snapshot(self, path):
+        """Take a directory snapshot over SFTP. Subdirectories are listed
+        concurrently.
 
-        if folder_name not in extensions:
-            raise ValueError('unsupported folder name.\n')
+        Args:
+            path (str): the identifier's directory on the remote server.
 
-        if not self.is_identifier(identifier):
-            raise ValueError('invalid identifier.\n')
+        Returns:
+            DirectorySnapshot
+        """
+        try:
+            snapshot = DirectorySnapshot(path, self.ftp.stat(path).st_mtime)
+        except IOError:
+            raise FileNotFoundError(path)
 
-        path = self.get_path(identifier)
-        folders = os.listdir(path)
+        subdirectories = []
+        for a in self.ftp.listdir_attr(path):
+            is_dir = stat.S_ISDIR(a.st_mode)
+            snapshot.add(a.filename, is_dir, a.st_size, a.st_mtime)
+            if is_dir:
+                subdirectories.append(a.filename)
 
-        entries = []
-        for directory in folders:
-            if '.' not in directory:
-                for entry in os.listdir(path + '/' + str(directory)):
-                    entries.append(path + '/' + directory + '/' + str(entry))
-        
-        errors = []
-        for i in entries:
-            file_name = i.split('/')[-1]
+        listings = self.ftp.listdir_attr_many(
+            [path + '/' + d for d in subdirectories]
+        )
+        for d, listing in zip(subdirectories, listings):
+            for a in listing:
+                snapshot.add(
+                    d + '/' + a.filename,
+                    stat.S_ISDIR(a.st_mode),
+                    a.st_size,
+                    a.st_mtime
+                )
+        return snapshot
 
-            if not file_name.endswith(extensions[folder_name]):
-                errors.append('%s is not a tif file' % file_name)
+    @staticmethod
+    def _scandir_into_snapshot(snapshot, path, prefix):
+        """Add the entries of one directory to a snapshot.
 
-            f = open(i)
-            empty = self._validate_file_notempty(f)
-            if empty:
-                errors.append(empty[0])
-            f.close()
+        Args:
+            snapshot: a DirectorySnapshot.
+            path (str): the directory to scan.
+            prefix (str): relative path of that directory in the snapshot,
+            e.g. '' or 'TIFF/'.
 
-        return errors
-                        
+        Returns:
+            list: the names of subdirectories.
+        """
+        subdirectories = []
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    # a dangling symlink.
+                    st = entry.stat(follow_symlinks=False)
+                is_dir = stat.S_ISDIR(st.st_mode)
+                snapshot.add(prefix + entry.name, is_dir, st.st_size, st.st_mtime)
+                if is_dir:
+                    subdirectories.append(entry.name)
+        return subdirectories
+
+    def _get_snapshot(self, identifier):
+        """Get the snapshot that validate() took for this identifier, or take
+        a new one if a check is being run on its own."""
+        try:
+            return self.snapshots[identifier]
+        except KeyError:
+            return self.get_directory_snapshot(identifier)
 
     def get_newest_modification_time_from_directory(self, directory):
         """ Helper function for get_newest_modification_time. Recursively searches
@@ -422,8 +2533,10 @@ class DigitalCollectionValidator:
         mtimes = []
         for entry in self.ftp.listdir_attr(directory):
             if stat.S_ISDIR(entry.st_mode):
-                mtime = self.get_newest_modification_time_from_directory(
-                    '{}/{}'.format(directory, entry.filename)
+                mtimes.append(
+                    self.get_newest_modification_time_from_directory(
+                        '{}/{}'.format(directory, entry.filename)
+                    )
                 )
             else:
                 try:
@@ -437,8 +2550,509 @@ class DigitalCollectionValidator:
         else:
             return 0
 
+    def _list_directories(self, paths):
+        """List several directories at once, locally or over SSH.
+
+        Args:
+            paths (list): directories to list.
+
+        Returns:
+            list: for each path, a list of (name, is_dir, mtime) tuples, or
+            None if the directory does not exist.
+        """
+        if getattr(self, 'ftp', None):
+            def list_directory(path):
+                try:
+                    return [
+                        (a.filename, stat.S_ISDIR(a.st_mode), a.st_mtime)
+                        for a in self.ftp.listdir_attr(path)
+                    ]
+                except FileNotFoundError:
+                    return None
+            return self.ftp.map(list_directory, paths)
+
+        def list_directory(path):
+            try:
+                with os.scandir(path) as it:
+                    return [
+                        (e.name, e.is_dir(follow_symlinks=False), e.stat(follow_symlinks=False).st_mtime)
+                        for e in it
+                    ]
+            except (FileNotFoundError, NotADirectoryError):
+                return None
+        return self._map_io(list_directory, paths)
+
+    def get_newest_modification_times(self, identifiers, use_find=False):
+        """Get the newest file modification time for many identifiers at
+        once. Directories are walked breadth-first, one level at a time
+        across every identifier, with many listings in flight at once.
+
+        Args:
+            identifiers (list): e.g. ['mvol-0004-1930-0103', ...]
+            use_find (bool): after connect(), run a single remote 'find'
+            command instead of walking directories over SFTP.
+
+        Returns:
+            dict: identifiers mapped to the newest unix timestamp of any file
+            in their directories, 0 if there are no files, or None if the
+            directory does not exist.
+        """
+        if use_find:
+            return self._get_newest_modification_times_with_find(identifiers)
+
+        newest = {}
+        frontier = []
+        for identifier in identifiers:
+            newest[identifier] = None
+            frontier.append((identifier, self.get_path(identifier)))
+
+        top_level = True
+        while frontier:
+            next_frontier = []
+            listings = self._list_directories([path for _, path in frontier])
+            for (identifier, path), listing in zip(frontier, listings):
+                if listing is None:
+                    if not top_level:
+                        # removed while we were walking.
+                        continue
+                    newest[identifier] = None
+                    continue
+                if newest[identifier] is None:
+                    newest[identifier] = 0
+                for name, is_dir, mtime in listing:
+                    if is_dir:
+                        next_frontier.append((identifier, path + '/' + name))
+                    else:
+                        newest[identifier] = max(newest[identifier], mtime)
+            frontier = next_frontier
+            top_level = False
+        return newest
+
+    def _get_newest_modification_times_with_find(self, identifiers):
+        """Get newest modification times with one remote 'find' command per
+        batch of identifiers, streaming and parsing its output. See
+        get_newest_modification_times()."""
+        roots = {}
+        for identifier in identifiers:
+            roots[self.get_path(identifier)] = identifier
+
+        newest = dict((identifier, None) for identifier in identifiers)
+
+        for root, depth, file_type, size, mtime, path in self._find(roots):
+            if depth == 0:
+                if newest[roots[root]] is None:
+                    newest[roots[root]] = 0
+            elif file_type == 'f':
+                identifier = roots[root]
+                newest[identifier] = max(newest[identifier], mtime)
+        return newest
+
+    def _find(self, paths, maxdepth=None):
+        """Walk remote directories with one 'find' command per batch of
+        paths, streaming and parsing its output.
+
+        Args:
+            paths: an iterable of directories on the server.
+            maxdepth (int): how far below each path to look, or None for
+            no limit.
+
+        Returns:
+            a generator of (root, depth, type, size, mtime, path) tuples,
+            where root is the path that was searched. Each root comes first
+            with a depth of 0, so that empty and missing directories can be
+            told apart.
+        """
+        # keep command lines well under the server's argument length limit.
+        batches = [[]]
+        length = 0
+        for path in paths:
+            if length > 64 * 1024:
+                batches.append([])
+                length = 0
+            batches[-1].append(path)
+            length += len(path) + 3
+
+        for batch in batches:
+            if not batch:
+                continue
+            command = "find {} {}-printf {} 2>/dev/null".format(
+                ' '.join(shlex.quote(p) for p in batch),
+                '' if maxdepth is None else '-maxdepth {} '.format(int(maxdepth)),
+                shlex.quote(FIND_PRINTF_FORMAT)
+            )
+            root = None
+            for depth, file_type, size, mtime, path in parse_find_output(
+                self.ftp.exec_lines(command)
+            ):
+                if depth == 0:
+                    root = path
+                yield root, depth, file_type, size, mtime, path
+
+    def get_manifest(self, identifiers, digest=None):
+        """Build a sync manifest of every file under some identifiers'
+        directories. After connect() this is one remote 'find' command per
+        batch of identifiers. Locally, identifiers are walked with
+        os.scandir across the I/O thread pool.
+
+        Args:
+            identifiers (list): e.g. ['mvol-0004-1930-0103', ...]
+            digest: a function that takes the path to a local file and
+            returns a digest of its contents, e.g. the get method of a dict
+            from get_digests(), or None to leave digests out.
+
+        Returns:
+            list: ManifestEntry tuples, sorted by path. Identifiers whose
+            directories do not exist have no entries.
+        """
+        if getattr(self, 'ftp', None):
+            roots = dict((self.get_path(i), i) for i in identifiers)
+            manifest = []
+            for root, depth, file_type, size, mtime, path in self._find(roots):
+                if file_type == 'f':
+                    manifest.append(ManifestEntry(
+                        roots[root] + path[len(root):],
+                        size,
+                        mtime,
+                        None
+                    ))
+            manifest.sort()
+            return manifest
+
+        def walk(identifier):
+            entries = []
+            directories = [(self.get_path(identifier), identifier)]
+            while directories:
+                path, relpath = directories.pop()
+                try:
+                    with os.scandir(path) as it:
+                        for entry in it:
+                            if entry.is_dir(follow_symlinks=False):
+                                directories.append((entry.path, relpath + '/' + entry.name))
+                                continue
+                            st = entry.stat(follow_symlinks=False)
+                            entries.append(ManifestEntry(
+                                relpath + '/' + entry.name,
+                                st.st_size,
+                                st.st_mtime,
+                                digest(entry.path) if digest else None
+                            ))
+                except (FileNotFoundError, NotADirectoryError):
+                    continue
+            return entries
+
+        manifest = []
+        for entries in self._map_io(walk, identifiers):
+            manifest.extend(entries)
+        manifest.sort()
+        return manifest
+
+    @staticmethod
+    def _stat_tree(path):
+        """Walk a directory with os.scandir, recording the stat data that
+        digests are keyed on.
+
+        Returns:
+            dict: paths of files mapped to (size, mtime in nanoseconds,
+            inode) tuples. Empty if the directory does not exist.
+        """
+        files = {}
+        directories = [path]
+        while directories:
+            try:
+                with os.scandir(directories.pop()) as it:
+                    for entry in it:
+                        if entry.is_dir(follow_symlinks=False):
+                            directories.append(entry.path)
+                        else:
+                            st = entry.stat(follow_symlinks=False)
+                            files[entry.path] = (st.st_size, st.st_mtime_ns, st.st_ino)
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+        return files
+
+    def _get_cached_digests(self, identifiers):
+        """Stat every file under some identifiers' directories and look up
+        their digests in the digest table.
+
+        Returns:
+            tuple: (files, cached, stale). files maps paths to stat data,
+            see _stat_tree(). cached maps paths to digests for files whose
+            stat data has not changed since they were hashed. stale lists
+            paths in the table that no longer exist.
+        """
+        self._create_digest_table()
+
+        roots = [self.get_path(i) for i in identifiers]
+        files = {}
+        if getattr(self, 'ftp', None):
+            # 'find' does not report inodes, so remote files are keyed on
+            # their size and modification time alone.
+            for root, depth, file_type, size, mtime, path in self._find(roots):
+                if file_type == 'f':
+                    files[path] = (size, int(round(mtime * 1e9)), None)
+        else:
+            for listing in self._map_io(self._stat_tree, roots):
+                files.update(listing)
+
+        cached = {}
+        stale = []
+        c = self.conn.cursor()
+        for root in roots:
+            # every path under root + '/' sorts between it and root + '0',
+            # since '0' comes right after '/'. This is a range scan of the
+            # primary key.
+            c.execute(
+                'SELECT path, size, mtime, inode, digest FROM digest WHERE path > ? AND path < ?',
+                (root + '/', root + '0')
+            )
+            for path, size, mtime, inode, digest in c.fetchall():
+                if path not in files:
+                    stale.append(path)
+                elif files[path] == (size, mtime, inode):
+                    cached[path] = digest
+        return files, cached, stale
+
+    def _get_file_digest_or_none(self, path):
+        """Hash a file, or return None if it was removed since it was
+        listed. After connect(), the file is read over SFTP."""
+        try:
+            if getattr(self, 'ftp', None):
+                h = hashlib.blake2b()
+                with self._open(path, 'rb') as f:
+                    for block in iter(lambda: f.read(DIGEST_BLOCK_SIZE), b''):
+                        h.update(block)
+                return h.hexdigest()
+            return get_file_digest(path)
+        except FileNotFoundError:
+            return None
+
+    def get_digests(self, identifiers):
+        """Get the BLAKE2b digest of every file under some identifiers'
+        directories. Digests are cached in the digest table, and a file is
+        only hashed again when its size, modification time or inode
+        changes, so repeat runs cost a stat walk plus hashes of new and
+        changed files. Files are hashed across the I/O thread pool. After
+        connect(), files are listed with one remote 'find' command per
+        batch of identifiers and read over SFTP.
+
+        For sync manifests with digests, pass the result's get method to
+        get_manifest().
+
+        Args:
+            identifiers (list): e.g. ['mvol-0004-1930-0103', ...]
+
+        Returns:
+            dict: paths of files mapped to hex digests.
+        """
+        files, digests, stale = self._get_cached_digests(identifiers)
+
+        changed = sorted(p for p in files if p not in digests)
+        digest_date = datetime.datetime.now().isoformat()
+        rows = []
+        for path, digest in zip(changed, self._map_io(self._get_file_digest_or_none, changed)):
+            if digest is None:
+                continue
+            digests[path] = digest
+            rows.append((path,) + files[path] + (digest, digest_date))
+
+        with self.conn:
+            self.conn.executemany(
+                'DELETE FROM digest WHERE path = ?',
+                [(p,) for p in stale]
+            )
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO digest (path, size, mtime, inode, digest, digest_date) VALUES (?, ?, ?, ?, ?, ?)',
+                rows
+            )
+        return digests
+
+    def audit_digests(self, identifiers):
+        """Hash every file that has a cached digest again, to find files
+        whose contents changed even though their size, modification time
+        and inode did not. Recorded digests are left as they are.
+
+        Args:
+            identifiers (list): e.g. ['mvol-0004-1930-0103', ...]
+
+        Returns:
+            list: error messages.
+        """
+        files, cached, stale = self._get_cached_digests(identifiers)
+        paths = sorted(cached)
+        errors = []
+        for path, digest in zip(paths, self._map_io(self._get_file_digest_or_none, paths)):
+            if digest is not None and digest != cached[path]:
+                errors.append('{} digest does not match the recorded digest.\n'.format(path))
+        return errors
+
+    def _get_identifier_from_local_path(self, path):
+        """Get the identifier that a path under local_root belongs to.
+
+        Returns:
+            str: e.g. 'mvol-0004-1930-0103', or None if the path is above
+            the level of identifiers.
+        """
+        relpath = os.path.relpath(path, self.local_root)
+        if relpath.startswith('..'):
+            return None
+        # get_identifier_chunk() reads paths relative to IIIF_Files.
+        try:
+            identifier = self.get_identifier_chunk(
+                'IIIF_Files/' + relpath.replace(os.sep, '/')
+            )
+        except (IndexError, NotImplementedError):
+            return None
+        if self.is_identifier(identifier):
+            return identifier
+        return None
+
+    def _add_watches(self, inotify, path):
+        """Watch a directory and everything under it.
+
+        Returns:
+            list: the directories that are now watched.
+        """
+        watched = []
+        directories = [path]
+        while directories:
+            directory = directories.pop()
+            try:
+                inotify.add_watch(directory)
+                with os.scandir(directory) as it:
+                    for entry in it:
+                        if entry.is_dir(follow_symlinks=False):
+                            directories.append(entry.path)
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+            except OSError as e:
+                # out of watches. Reconciliation still finds these changes,
+                # just later.
+                sys.stderr.write('could not watch {}: {}\n'.format(directory, e))
+                continue
+            watched.append(directory)
+        return watched
+
+    def _revalidate(self, identifiers, jobs=1, processes=False):
+        """Validate some identifiers and record the results. Identifiers
+        whose directories were removed have their results deleted instead.
+
+        Returns:
+            list: (identifier, errors) tuples for the identifiers that were
+            validated.
+        """
+        validation_date = datetime.datetime.now().isoformat()
+        states = {}
+        removed = []
+        for identifier in identifiers:
+            try:
+                states[identifier] = self.get_identifier_state(identifier)
+            except FileNotFoundError:
+                removed.append(identifier)
+        if removed:
+            self.delete_validation_results(removed)
+        results = list(self.validate_identifiers(sorted(states), jobs, processes))
+        self.record_validation_results(results, validation_date, states)
+        return results
+
+    def watch(self, identifier_chunks, debounce=WATCH_DEBOUNCE,
+              reconcile_interval=WATCH_RECONCILE_INTERVAL, jobs=1,
+              processes=False, check_count=False, stop=None):
+        """Watch local_root with inotify and validate identifiers again as
+        their files change, recording the results in the database.
+
+        Changed paths are mapped back to identifiers, and an identifier is
+        validated once nothing in it has changed for debounce seconds.
+        Every identifier is also checked against its recorded result when
+        watching starts and every reconcile_interval seconds after that,
+        which catches anything inotify missed. Without inotify, only these
+        checks run. Requires connect_to_db() and upgrade_db().
+
+        Args:
+            identifier_chunks (list): e.g. ['mvol-0004']
+            debounce (float): seconds of quiet before validating.
+            reconcile_interval (float): seconds between full checks.
+            jobs (int): see validate_identifiers().
+            processes (bool): see validate_identifiers().
+            check_count (bool): see needs_validation().
+            stop: a threading.Event that ends the watch when it is set.
+
+        Returns:
+            a generator that yields a list of (identifier, errors) tuples
+            after each round of validation.
+        """
+        try:
+            inotify = _Inotify()
+        except OSError as e:
+            sys.stderr.write('inotify is not available, rescanning every {}s: {}\n'.format(reconcile_interval, e))
+            inotify = None
+
+        # identifiers mapped to the time of the last change seen in them.
+        pending = {}
+        next_reconcile = time.monotonic()
+        try:
+            if inotify:
+                for identifier_chunk in identifier_chunks:
+                    self._add_watches(inotify, self.get_path(identifier_chunk))
+
+            while not (stop and stop.is_set()):
+                now = time.monotonic()
+                if now >= next_reconcile:
+                    identifiers = []
+                    for identifier_chunk in identifier_chunks:
+                        identifiers.extend(self.get_identifiers(identifier_chunk))
+                    for identifier, state in self.get_changed_identifiers(identifiers, check_count).items():
+                        if state is not None:
+                            pending.setdefault(identifier, now - debounce)
+                    next_reconcile = now + reconcile_interval
+
+                due = sorted(i for i, t in pending.items() if now - t >= debounce)
+                if due:
+                    for identifier in due:
+                        del pending[identifier]
+                    results = self._revalidate(due, jobs, processes)
+                    if results:
+                        yield results
+                    continue
+
+                # wake up for the next deadline, and at least once a second
+                # so that stop is noticed.
+                timeout = min([next_reconcile] + [t + debounce for t in pending.values()]) - now
+                timeout = min(max(timeout, 0), 1.0)
+                if not inotify:
+                    time.sleep(timeout)
+                    continue
+                if not select.select([inotify.fd], [], [], timeout)[0]:
+                    continue
+                for directory, mask, name in inotify.read_events():
+                    if mask & IN_Q_OVERFLOW:
+                        next_reconcile = time.monotonic()
+                        continue
+                    if directory is None:
+                        continue
+                    path = os.path.join(directory, name) if name else directory
+                    paths = [path]
+                    if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                        # files can land in a new directory before it is
+                        # watched, so everything under it counts as changed.
+                        paths.extend(self._add_watches(inotify, path))
+                    for p in paths:
+                        identifier = self._get_identifier_from_local_path(p)
+                        if identifier:
+                            pending[identifier] = time.monotonic()
+        finally:
+            if inotify:
+                inotify.close()
+
     def get_newest_modification_time(self, identifier):
-        return self.get_newest_modification_time_from_directory(self.get_path(identifier))
+        """Get the newest file modification time for one identifier.
+
+        Raises:
+            FileNotFoundError: the identifier's directory does not exist.
+        """
+        mtime = self.get_newest_modification_times([identifier])[identifier]
+        if mtime is None:
+            raise FileNotFoundError(self.get_path(identifier))
+        return mtime
 
     @staticmethod
     def _validate_file_notempty(f):
@@ -459,10 +3073,191 @@ class DigitalCollectionValidator:
                 errors.append('%s is an empty file.\n' % name)
             except AttributeError:
                 errors.append('empty file.\n')
-    
+
         f.close()
         return errors
 
+    @staticmethod
+    def _check_xml_wellformed(f, chunk_size=XML_CHUNK_SIZE):
+        """Check that an XML file is well-formed without building a tree.
+        The file is fed to expat in fixed-size binary blocks with no event
+        handlers, so memory use stays flat and nothing is decoded to str.
+        Namespace processing is on, so unbound prefixes are errors, as they
+        are for ElementTree.
+
+        Args:
+            f: a file-like object, opened in binary mode.
+            chunk_size (int): bytes to read at a time.
+
+        Returns:
+            None if the file is well-formed, or a (line, column) tuple
+            giving the location of the first error. Columns start at 1.
+        """
+        parser = expat.ParserCreate(namespace_separator=' ')
+        try:
+            while True:
+                chunk = f.read(chunk_size)
+                parser.Parse(chunk, not chunk)
+                if not chunk:
+                    break
+        except expat.ExpatError as e:
+            return e.lineno, e.offset + 1
+        return None
+
+    @staticmethod
+    def _check_tiff_structure(f):
+        """Check that a TIFF is structurally sound without decoding it. Only
+        the header and the chain of IFDs are read, and every strip or tile
+        has to lie inside the file, so truncated uploads are caught. Local
+        files are memory-mapped, so only the pages holding the header and
+        IFDs are read from disk.
+
+        Args:
+            f: a file-like object, opened in binary mode.
+
+        Returns:
+            TiffInfo: the size and compression of the first image, and the
+            number of IFDs.
+
+        Raises:
+            ValueError: the TIFF is damaged. The message says how.
+        """
+        with _random_access(f) as (size, read):
+            return DigitalCollectionValidator._read_tiff_structure(read, size)
+
+    @staticmethod
+    def _read_tiff_structure(read, size):
+        """Helper for _check_tiff_structure()."""
+        try:
+            if size < 8:
+                raise ValueError('truncated header')
+            header = read(0, 16)
+            if header[:2] == b'II':
+                order = '<'
+            elif header[:2] == b'MM':
+                order = '>'
+            else:
+                raise ValueError('not a TIFF')
+            version = struct.unpack(order + 'H', header[2:4])[0]
+            if version == 42:
+                count_format, offset_format, entry_size = 'H', 'I', 12
+                ifd_offset = struct.unpack(order + 'I', header[4:8])[0]
+            elif version == 43 and size >= 16:
+                count_format, offset_format, entry_size = 'Q', 'Q', 20
+                ifd_offset = struct.unpack(order + 'Q', header[8:16])[0]
+            else:
+                raise ValueError('not a TIFF')
+            count_size = struct.calcsize(count_format)
+            offset_size = struct.calcsize(offset_format)
+
+            def get_values(field_type, count, value):
+                length = TIFF_TYPE_SIZES.get(field_type, 1) * count
+                if length > offset_size:
+                    value_offset = struct.unpack(order + offset_format, value)[0]
+                    if value_offset + length > size:
+                        raise ValueError('IFD values past the end of the file')
+                    value = read(value_offset, length)
+                if field_type not in TIFF_TYPE_FORMATS:
+                    return None
+                return struct.unpack(
+                    '{}{}{}'.format(order, count, TIFF_TYPE_FORMATS[field_type]),
+                    value[:length]
+                )
+
+            info = None
+            seen = set()
+            while ifd_offset:
+                if ifd_offset in seen or len(seen) >= TIFF_MAX_IFDS:
+                    raise ValueError('IFD chain loops')
+                seen.add(ifd_offset)
+                if ifd_offset + count_size > size:
+                    raise ValueError('IFD past the end of the file')
+                entry_count = struct.unpack(
+                    order + count_format,
+                    read(ifd_offset, count_size)
+                )[0]
+                ifd_size = entry_count * entry_size + offset_size
+                if ifd_offset + count_size + ifd_size > size:
+                    raise ValueError('IFD past the end of the file')
+                ifd = read(ifd_offset + count_size, ifd_size)
+
+                fields = {}
+                for e in range(entry_count):
+                    entry = ifd[e * entry_size:(e + 1) * entry_size]
+                    tag, field_type = struct.unpack(order + 'HH', entry[:4])
+                    if tag in (256, 257, 259, 273, 279, 324, 325):
+                        count = struct.unpack(
+                            order + offset_format,
+                            entry[4:4 + offset_size]
+                        )[0]
+                        fields[tag] = get_values(
+                            field_type,
+                            count,
+                            entry[4 + offset_size:]
+                        )
+
+                if 256 not in fields or 257 not in fields:
+                    raise ValueError('image size missing')
+                if 273 in fields:
+                    offsets, byte_counts, kind = fields.get(273), fields.get(279), 'strip'
+                else:
+                    offsets, byte_counts, kind = fields.get(324), fields.get(325), 'tile'
+                if not offsets or not byte_counts or len(offsets) != len(byte_counts):
+                    raise ValueError('{} offsets missing'.format(kind))
+                for i, (offset, byte_count) in enumerate(zip(offsets, byte_counts)):
+                    if offset + byte_count > size:
+                        raise ValueError(
+                            '{} {} runs past the end of the file'.format(kind, i)
+                        )
+
+                if info is None:
+                    info = [fields[256][0], fields[257][0], (fields.get(259) or (1,))[0]]
+                ifd_offset = struct.unpack(
+                    order + offset_format,
+                    ifd[-offset_size:]
+                )[0]
+            if info is None:
+                raise ValueError('no images')
+            return TiffInfo(info[0], info[1], info[2], len(seen))
+        except struct.error:
+            raise ValueError('truncated IFD')
+
+    @staticmethod
+    def _check_pdf_structure(f):
+        """Check that a PDF's cross-reference data is intact and count its
+        pages, without reading content streams. Only the tail of the file,
+        the xref sections, the catalog and the root of the page tree are
+        read, so this is cheap even for very large PDFs.
+
+        Args:
+            f: a file-like object, opened in binary mode.
+
+        Returns:
+            PdfInfo: the PDF version, e.g. '1.5', and the page count.
+
+        Raises:
+            ValueError: the PDF is damaged. The message says how.
+        """
+        with _random_access(f) as (size, read):
+            header = read(0, 16)
+            m = re.match(rb'%PDF-(\d\.\d)', header)
+            if m is None:
+                raise ValueError('not a PDF')
+            page_count = _PdfTail(read, size).get_page_count()
+            return PdfInfo(m.group(1).decode('ascii'), page_count)
+
+    @staticmethod
+    def _validate_snapshot_notempty(snapshot, relpath):
+        """Make sure that a file in a snapshot is not empty.
+
+        Args:
+            snapshot: a DirectorySnapshot.
+            relpath (str): path to the file, relative to the snapshot root.
+        """
+        if snapshot.getsize(relpath):
+            return []
+        return ['%s is an empty file.\n' % relpath.split('/')[-1]]
+
     def get_csv_data(self, identifier_chunk):
         """Get CSV data for a specific identifier chunk.
  
@@ -474,20 +3269,20 @@ class DigitalCollectionValidator:
         """
         path = self.get_path(identifier_chunk)
         csv_data = {}
-        for entry in os.listdir(path):
+        for entry in self._listdir(path):
             if re.search('\.csv$', entry):
-                f = self.ftp.file('{}/{}'.format(path, entry))
-                reader = csv.reader(f)
-                next(reader, None)
-                try:
-                    for row in reader:
-                        csv_data[row[2]] = {
-                            'title': row[0],
-                            'date': row[1],
-                            'description': row[3]
-                        }
-                except IndexError:
-                    break
+                with self._open('{}/{}'.format(path, entry)) as f:
+                    reader = csv.reader(f)
+                    next(reader, None)
+                    try:
+                        for row in reader:
+                            csv_data[row[2]] = {
+                                'title': row[0],
+                                'date': row[1],
+                                'description': row[3]
+                            }
+                    except IndexError:
+                        break
         return csv_data
     
 
@@ -548,11 +3343,13 @@ class ApfValidator(DigitalCollectionValidator):
             print("File doesn't exist")
         
         if identifier == 'apf':
-            for directory in os.listdir(path):
-                identifiers += os.listdir(path + '/' + str(directory))
-            return identifiers 
+            for files in self._listdir_many(
+                [path + '/' + d for d in sorted(self._listdir(path))]
+            ):
+                identifiers += files
+            return identifiers
 
-        identifiers = os.listdir(path)
+        identifiers = sorted(self._listdir(path))
 
         fin = []
         for i in identifiers:
@@ -706,36 +3503,47 @@ class MvolValidator(DigitalCollectionValidator):
         if folder_name not in extensions.keys():
             raise ValueError('unsupported folder_name.\n')
 
-        mmdd_path = self.get_path(identifier)
+        snapshot = self._get_snapshot(identifier)
 
-        # raise an IOError if the ALTO, JPEG, or TIFF directory does not exist.
-        os.stat(mmdd_path + '/' + folder_name)
-
-        filename_re = '^{}_[0-9]+\.{}$'.format(identifier, extensions[folder_name])
+        filename_re = re.compile(
+            '^{}_[0-9]+\.{}$'.format(identifier, extensions[folder_name])
+        )
 
+        # raise an IOError if the ALTO, JPEG, or TIFF directory does not exist.
         entries = []
-        for entry in os.listdir('{}/{}'.format(mmdd_path, folder_name)):
+        for entry in snapshot.listdir(folder_name):
             if entry.endswith(extensions[folder_name]):
                 entries.append(entry)
-        entries.sort()
 
-        entries_pass = []
-        entries_fail = []
-        for entry in entries:
-            if re.match(filename_re, entry):
+        # check the contents of correctly named ALTO and TIFF files
+        # concurrently. ALTO files are streamed, TIFFs only have their
+        # headers read.
+        def check(entry):
+            if not filename_re.match(entry):
+                return None
+            with self._open(snapshot.get_abspath(folder_name + '/' + entry), 'rb') as f:
                 if folder_name == 'ALTO':
-                    with open('{}/ALTO/{}'.format(self.get_path(identifier), entry)) as f:
-                        try:
-                            ElementTree.fromstring(f.read())
-                            entries_pass.append(entry)
-                        except (ElementTree.ParseError, UnicodeDecodeError):
-                            entries_fail.append(entry)
-            else:
-                entries_fail.append(entry)
+                    position = self._check_xml_wellformed(f)
+                    if position:
+                        return 'not well-formed at line {}, column {}'.format(
+                            position[0],
+                            position[1]
+                        )
+                else:
+                    try:
+                        self._check_tiff_structure(f)
+                    except ValueError as e:
+                        return str(e)
+            return None
+
+        if folder_name in ('ALTO', 'TIFF'):
+            problems = self._map_io(check, entries)
+        else:
+            problems = [None] * len(entries)
 
         errors = []
-        if entries_fail:
-            for entry in entries_fail:
+        for entry, problem in zip(entries, problems):
+            if not filename_re.match(entry):
                 errors.append(
                     '{}/{}/{} problem.\n'.format(
                         identifier,
@@ -743,8 +3551,40 @@ class MvolValidator(DigitalCollectionValidator):
                         entry
                     )
                 )
+            elif problem:
+                errors.append(
+                    '{}/{}/{} problem: {}.\n'.format(
+                        identifier,
+                        folder_name,
+                        entry,
+                        problem
+                    )
+                )
         return errors
 
+    def get_tiff_info(self, identifier):
+        """Read the structure of every TIFF in an identifier's TIFF folder,
+        in parallel, without decoding any images.
+
+        Args:
+            identifier (str): e.g. 'mvol-0001-0002-0003'
+
+        Returns:
+            dict: file names mapped to a TiffInfo, or to an error message if
+            the TIFF is damaged.
+        """
+        snapshot = self._get_snapshot(identifier)
+        entries = [e for e in snapshot.listdir('TIFF') if e.endswith('.tif')]
+
+        def check(entry):
+            with self._open(snapshot.get_abspath('TIFF/' + entry), 'rb') as f:
+                try:
+                    return self._check_tiff_structure(f)
+                except ValueError as e:
+                    return str(e)
+
+        return dict(zip(entries, self._map_io(check, entries)))
+
     def validate_alto_or_pos_directory(self, identifier):
         """Validate that an ALTO or POS folder exists. Make sure it contains appropriate
         files.
@@ -815,51 +3655,45 @@ class MvolValidator(DigitalCollectionValidator):
         errors = []
 
         if not f:
+            snapshot = self._get_snapshot(identifier)
             try:
-                f = open('{}/{}.dc.xml'.format(
-                    self.get_path(identifier),
-                    identifier)
-                )
+                if not snapshot.isfile(identifier + '.dc.xml'):
+                    raise FileNotFoundError
+                f = self._open(snapshot.get_abspath(identifier + '.dc.xml'), 'rb')
             except (FileNotFoundError, IOError):
                 errors.append('{} dc.xml missing\n'.format(identifier))
                 return errors
-
-        try:
-            ElementTree.parse(f)
-        except ElementTree.ParseError:
-            errors.append('{} dc.xml not well-formed\n'.format(identifier))
-            return errors
-
-        f.seek(0)
-
+            with f:
+                return self.validate_dc_xml(identifier, f)
+
+        # parse once, with this thread's parser. dc.xml files are small, so
+        # read them whole.
+        data = f.read()
+        if isinstance(data, str):
+            data = data.encode('utf-8')
         try:
-            metadata = etree.parse(f)
-        except etree.XMLSyntaxError as e:
+            root = etree.fromstring(data, _get_dc_xml_parser())
+        except etree.XMLSyntaxError:
             errors.append('{} dc.xml not well-formed\n'.format(identifier))
             return errors
 
-        if not metadata.getroot().tag == 'metadata':
+        if not root.tag == 'metadata':
             errors.append('{} dc.xml root is not metadata element\n'.format(identifier))
 
-        if not len(metadata.findall('dc:title', namespaces={'dc': 'http://purl.org/dc/elements/1.1/'})) == 1:
-            errors.append('{} dc.xml does not contain a single dc:title element\n'.format(identifier))
-
-        if not len(metadata.findall('dc:identifier', namespaces={'dc': 'http://purl.org/dc/elements/1.1/'})) == 1:
-            errors.append('{} dc.xml does not contain a single dc:identifier element\n'.format(identifier))
-
-        if not len(metadata.findall('dc:date', namespaces={'dc': 'http://purl.org/dc/elements/1.1/'})) == 1:
-            errors.append('{} dc.xml does not contain a single dc:date element\n'.format(identifier))
+        elements = collections.defaultdict(list)
+        for element in DC_ELEMENTS_XPATH(root):
+            elements[etree.QName(element).localname].append(element)
 
-        if not len(metadata.findall('dc:description', namespaces={'dc': 'http://purl.org/dc/elements/1.1/'})) == 1:
-            errors.append('{} dc.xml does not contain a single dc:description element\n'.format(identifier))
+        for name in DC_REQUIRED_ELEMENTS:
+            if not len(elements[name]) == 1:
+                errors.append('{} dc.xml does not contain a single dc:{} element\n'.format(identifier, name))
 
-        elif identifier.startswith('mvol-0004') or identifier.startswith('mvol-0448'):
-            datepull = metadata.findtext('dc:date', namespaces={'dc': 'http://purl.org/dc/elements/1.1/'})
-            pattern = re.compile("^\d{4}(-\d{2})?(-\d{2})?")
-            attemptmatch = pattern.fullmatch(datepull)
+        if len(elements['description']) == 1 and (identifier.startswith('mvol-0004') or identifier.startswith('mvol-0448')):
+            datepull = elements['date'][0].text or '' if elements['date'] else ''
+            attemptmatch = DC_DATE_RE.fullmatch(datepull)
             if attemptmatch:
                 sections = [int(s)
-                            for s in re.findall(r'\b\d+\b', datepull)]
+                            for s in DC_DATE_FIELD_RE.findall(datepull)]
                 length = len(sections)
                 if (sections[0] < 1700) | (sections[0] > 2100):
                     errors.append(
@@ -878,6 +3712,32 @@ class MvolValidator(DigitalCollectionValidator):
 
         return errors
 
+    def validate_dc_xml_files(self, identifier_chunk):
+        """Validate the dc.xml file of every identifier under a chunk. Files
+        are opened directly, without taking directory snapshots, and read
+        and parsed across the I/O thread pool.
+
+        Args:
+            identifier_chunk (str): e.g. 'mvol-0004-1930'
+
+        Returns:
+            list: (identifier, errors) tuples, sorted by identifier.
+        """
+        identifiers = self.get_identifiers(identifier_chunk)
+
+        def check(identifier):
+            try:
+                f = self._open(
+                    '{}/{}.dc.xml'.format(self.get_path(identifier), identifier),
+                    'rb'
+                )
+            except (FileNotFoundError, IOError):
+                return ['{} dc.xml missing\n'.format(identifier)]
+            with f:
+                return self.validate_dc_xml(identifier, f)
+
+        return list(zip(identifiers, self._map_io(check, identifiers)))
+
     def validate_struct_txt(self, identifier, f=None):
         """Make sure that a given struct.txt is valid. It should be tab-delimited
         data, with a header row. Each record should contains a field for object,
@@ -891,11 +3751,15 @@ class MvolValidator(DigitalCollectionValidator):
         assert self.get_project(identifier) == 'mvol'
 
         if not f:
+            snapshot = self._get_snapshot(identifier)
             try:
-                f = open(
-                    '{}/{}.struct.txt'.format(self.get_path(identifier), identifier))
+                if not snapshot.isfile(identifier + '.struct.txt'):
+                    raise FileNotFoundError
+                f = self._open(snapshot.get_abspath(identifier + '.struct.txt'))
             except (FileNotFoundError, IOError):
                 return ['{} struct.txt missing\n'.format(identifier)]
+            with f:
+                return self.validate_struct_txt(identifier, f)
 
         line = f.readline()
         if not re.match('^object\tpage\tmilestone', line):
@@ -916,16 +3780,17 @@ class MvolValidator(DigitalCollectionValidator):
 
         assert self.get_project(identifier) == 'mvol'
 
-        try:
-            f = open('{}/{}.txt'.format(
-                self.get_path(identifier),
-                identifier))
-            return DigitalCollectionValidator._validate_file_notempty(f)
-        except (FileNotFoundError, IOError):
+        snapshot = self._get_snapshot(identifier)
+        if not snapshot.isfile(identifier + '.txt'):
             return ['{} txt missing\n'.format(identifier)]
+        return DigitalCollectionValidator._validate_snapshot_notempty(
+            snapshot,
+            identifier + '.txt'
+        )
 
     def validate_pdf(self, identifier):
-        """Make sure that a PDF exists for an identifier.
+        """Make sure that a PDF exists for an identifier, that its
+        cross-reference data is intact, and that it has one page per TIFF.
 
         Args:
             identifier (str): e.g. 'mvol-0001-0002-0003'
@@ -933,13 +3798,35 @@ class MvolValidator(DigitalCollectionValidator):
 
         assert self.get_project(identifier) == 'mvol'
 
-        try:
-            f = open('{}/{}.pdf'.format(
-                self.get_path(identifier),
-                identifier))
-            return DigitalCollectionValidator._validate_file_notempty(f)
-        except (FileNotFoundError, IOError):
+        snapshot = self._get_snapshot(identifier)
+        if not snapshot.isfile(identifier + '.pdf'):
             return ['{} pdf missing\n'.format(identifier)]
+        errors = DigitalCollectionValidator._validate_snapshot_notempty(
+            snapshot,
+            identifier + '.pdf'
+        )
+        if errors:
+            return errors
+
+        with self._open(snapshot.get_abspath(identifier + '.pdf'), 'rb') as f:
+            try:
+                info = self._check_pdf_structure(f)
+            except ValueError as e:
+                return ['{} pdf problem: {}.\n'.format(identifier, e)]
+
+        if snapshot.isdir('TIFF'):
+            tiff_count = len([
+                e for e in snapshot.listdir('TIFF') if e.endswith('.tif')
+            ])
+            if info.page_count != tiff_count:
+                errors.append(
+                    '{} pdf has {} pages, but there are {} TIFFs.\n'.format(
+                        identifier,
+                        info.page_count,
+                        tiff_count
+                    )
+                )
+        return errors
 
     def validate_allowable_files_only(self, identifier):
         """
@@ -957,54 +3844,34 @@ class MvolValidator(DigitalCollectionValidator):
             '{}.struct.txt'.format(identifier),
             '{}.txt'.format(identifier)
         ))
+        # sentinels mark where an identifier is in validation.
+        allowable_files.update(SENTINEL_NAMES)
+
+        snapshot = self._get_snapshot(identifier)
 
         files_present = set()
-        for f in os.listdir('{}/{}'.format(
-            self.local_root, 
-            identifier.replace('-', '/')
-        )):
-            if os.path.isfile('{}/{}/{}'.format(
-                self.local_root,
-                identifier.replace('-', '/'),
-                f
-            )):
+        for f in snapshot.listdir():
+            if snapshot.isfile(f):
                 files_present.add(f)
 
         for f in files_present.difference(allowable_files):
             errors.append('non-allowable file {} in {}\n'.format(f, identifier))
 
         '''
-        if not os.path.isdir('{}/{}/JPEG'.format(
-            self.local_root,
-            identifier.replace('-', '/')
-        )):
+        if not snapshot.isdir('JPEG'):
             errors.append('JPEG dir missing in {}\n'.format(identifier))
         '''
 
-        if not os.path.isdir('{}/{}/TIFF'.format(
-            self.local_root,
-            identifier.replace('-', '/')
-        )):
+        if not snapshot.isdir('TIFF'):
             errors.append('JPEG dir missing in {}\n'.format(identifier))
 
-        if not os.path.isdir('{}/{}/ALTO'.format(
-            self.local_root,
-            identifier.replace('-', '/')
-        )) and not os.path.isdir('{}/{}/POS'.format(
-            self.local_root,
-            identifier.replace('-', '/')
-        )):
+        if not snapshot.isdir('ALTO') and not snapshot.isdir('POS'):
             errors.append('ALTO or POS dir missing in {}\n'.format(identifier))
 
         counts = {}
         for d in ('ALTO', 'POS', 'JPEG', 'TIFF'):
-            directory = '{}/{}/{}'.format(
-                self.local_root,
-                identifier.replace('-', '/'),
-                d
-            )
-            if os.path.isdir(directory):
-                counts[d] = len(os.listdir(directory))
+            if snapshot.isdir(d):
+                counts[d] = len(snapshot.listdir(d))
 
         if len(set(counts.values())) > 1:
             errors.append('file count mismatch in {}\n'.format(identifier))
@@ -1046,18 +3913,30 @@ class MvolValidator(DigitalCollectionValidator):
 
         assert self.get_project(identifier) == 'mvol'
 
-        errors = []
-        errors += self.validate_alto_or_pos_directory(identifier)
-        # errors += self.validate_jpeg_directory(identifier)
-        errors += self.validate_tiff_directory(identifier)
-        errors += self.validate_pdf(identifier)
-        errors += self.validate_struct_txt(identifier)
-        errors += self.validate_txt(identifier)
-        errors += self.validate_dc_xml(identifier)
-        errors += self.validate_allowable_files_only(identifier)
-        if not errors:
-            pass
-            #errors += self.validate_ocr(identifier)
+        with self._profile(identifier, 'validate'):
+            # every check below reads from this one snapshot of the mmdd
+            # directory.
+            with self._profile(identifier, 'get_directory_snapshot'):
+                self.snapshots[identifier] = self.get_directory_snapshot(identifier)
+            try:
+                errors = []
+                for check in (
+                    self.validate_alto_or_pos_directory,
+                    # self.validate_jpeg_directory,
+                    self.validate_tiff_directory,
+                    self.validate_pdf,
+                    self.validate_struct_txt,
+                    self.validate_txt,
+                    self.validate_dc_xml,
+                    self.validate_allowable_files_only
+                ):
+                    with self._profile(identifier, check.__name__):
+                        errors += check(identifier)
+                if not errors:
+                    pass
+                    #errors += self.validate_ocr(identifier)
+            finally:
+                del self.snapshots[identifier]
         return errors
 
 
@@ -1114,20 +3993,21 @@ class RacValidator(DigitalCollectionValidator):
         #prints all the files in all existing directories
         if identifier == 'rac':
             path = self.get_path('rac')
-            dir_files = os.listdir(path)
-            for chunk in dir_files:
-                path_new = path
-                path_new += '/' + str(chunk)
-                for folder in os.listdir(path_new):
-                    identifiers += os.listdir(path_new + '/' + str(folder))
+            chunk_paths = [path + '/' + c for c in sorted(self._listdir(path))]
+            folder_paths = []
+            for chunk_path, folders in zip(chunk_paths, self._listdir_many(chunk_paths)):
+                folder_paths += [chunk_path + '/' + f for f in folders]
+            for files in self._listdir_many(folder_paths):
+                identifiers += files
             return identifiers
 
         #prints all files in specified directory
         elif 'rac' in identifier:
             path = self.get_path(identifier)
-            dir_files = os.listdir(path)
-            for chunk in dir_files:
-                identifiers += os.listdir(path + '/' + str(chunk))
+            for files in self._listdir_many(
+                [path + '/' + c for c in sorted(self._listdir(path))]
+            ):
+                identifiers += files
             return identifiers
 
         #searching for single, unique file
@@ -1135,18 +4015,69 @@ class RacValidator(DigitalCollectionValidator):
             folder = identifier[-8:]
             folder = folder[:4]
             path = self.get_path('rac') + '/' + str(folder)
-            for folder in os.listdir(path):
-                identifiers += os.listdir(path + '/' + str(folder))
+            for files in self._listdir_many(
+                [path + '/' + f for f in sorted(self._listdir(path))]
+            ):
+                identifiers += files
             for i in identifiers:
                 if identifier in i:
                     return [i]
 
 
-class XTFValidator(DigitalCollectionValidator):
+class XTFValidator(MvolValidator):
+    """Validate and inventory mvol identifiers on an XTF server. Connect
+    first, then validate a chunk with validate_chunk(), which lists it in a
+    few round trips before validating it."""
+
     def __init__(self, production):
         super().__init__()
         self.production = production
 
+    def get_identifiers(self, identifier_chunk, from_db=False, valid_only=False):
+        """Expand an identifier chunk into the identifiers on the XTF
+        server. Identifiers' directories sit side by side in the bookreader
+        directory, so this is a single listing.
+
+        Args:
+            identifier_chunk (str): e.g. 'mvol', 'mvol-0004'
+            from_db (bool): see DigitalCollectionValidator.get_identifiers().
+            valid_only (bool): see DigitalCollectionValidator.get_identifiers().
+
+        Returns:
+            list: a sorted list of identifiers.
+        """
+        if from_db:
+            return super().get_identifiers(identifier_chunk, from_db, valid_only)
+        directory = os.path.dirname(self.get_path(identifier_chunk))
+        if getattr(self, 'ftp', None):
+            names = self.ftp.listdir(directory)
+        else:
+            names = os.listdir(directory)
+        return sorted(
+            n for n in names
+            if (n == identifier_chunk or n.startswith(identifier_chunk + '-'))
+            and self.is_identifier(n)
+        )
+
+    def validate_chunk(self, identifier_chunk, jobs=1, processes=False):
+        """Validate every identifier in a chunk on the XTF server. The chunk
+        is listed with one listing of the bookreader directory and one
+        remote find per batch of identifiers, and validated from that
+        inventory. Requires connect().
+
+        Args:
+            identifier_chunk (str): e.g. 'mvol-0004-1930'
+            jobs (int): see validate_identifiers().
+            processes (bool): see validate_identifiers().
+
+        Returns:
+            a generator of (identifier, errors) tuples.
+        """
+        identifiers = self.get_identifiers(identifier_chunk)
+        with self.use_inventory(identifiers):
+            for result in self.validate_identifiers(identifiers, jobs, processes):
+                yield result
+
     def get_path(self, identifier):
         assert self.get_project(identifier) == 'mvol'
 
@@ -1,16 +1,26 @@
 #!/usr/bin/env python3
 
 """Usage:
-   make_mvol_jpegs --local-root=<local-root> <identifier-chunk>
+   make_mvol_jpegs --local-root=<local-root> [--jobs=<n>] [--size=<px>] [--memory-limit=<mb>] <identifier-chunk>
+
+Options:
+   --jobs=<n>           number of worker processes. Defaults to the number of
+                        CPUs.
+   --size=<px>          scale JPEGs down to fit in a <px> by <px> box. By
+                        default JPEGs are the same size as their TIFFs.
+   --memory-limit=<mb>  memory ceiling for each worker process, including
+                        about 128MB for Python and Pillow themselves. Pages
+                        that would need more than the rest to decode are
+                        reported as failures instead of being converted.
 """
 
-import os, pathlib, re, sys
+import collections, concurrent.futures, contextlib, functools, math, os, pathlib, re, resource, sys, time
 from docopt import docopt
 from PIL import Image
 
 def identifier_chunk_to_path(root, identifier_chunk):
     """Get a path on disk from a root and identifier chunk."""
-    return root + os.path.sep + os.path.sep.join(identifier_chunk.split('-')) 
+    return root + os.path.sep + os.path.sep.join(identifier_chunk.split('-'))
 
 def get_identifiers_under_root(root):
     """Get identifiers under some root in the filesystem."""
@@ -21,48 +31,334 @@ def get_identifiers_under_root(root):
                 identifiers.add(f.replace('.dc.xml', ''))
     return sorted(list(identifiers))
 
+def get_pages(root, identifier):
+    """Get the pages of an identifier that still need a JPEG.
+
+    Args:
+        root (str): the local root.
+        identifier (str): e.g. 'mvol-0004-1930-0103'
+
+    Returns:
+        list: (tif_file, jpg_file) tuples. Pages that already have a JPEG,
+        e.g. from an interrupted run, are skipped.
+    """
+    mvol_dir = identifier_chunk_to_path(root, identifier)
+    if os.path.exists('{}{}TIFF'.format(mvol_dir, os.path.sep)):
+        jpg_dir = '{}{}JPEG'.format(mvol_dir, os.path.sep)
+        tif_dir = '{}{}TIFF'.format(mvol_dir, os.path.sep)
+    elif os.path.exists('{}{}tif'.format(mvol_dir, os.path.sep)):
+        jpg_dir = '{}{}jpg'.format(mvol_dir, os.path.sep)
+        tif_dir = '{}{}tif'.format(mvol_dir, os.path.sep)
+    else:
+        raise NotImplementedError
+
+    if not os.path.isdir(jpg_dir):
+        print(jpg_dir)
+        os.mkdir(jpg_dir)
+
+    pages = []
+    for tif_file in sorted(os.listdir(tif_dir)):
+        stem = pathlib.Path(tif_file).stem
+        jpg_file = '{}{}{}.jpg'.format(jpg_dir, os.path.sep, stem)
+        if not os.path.exists(jpg_file):
+            pages.append((os.path.sep.join((tif_dir, tif_file)), jpg_file))
+    return pages
+
+# bytes per pixel for modes that can be read straight out of uncompressed
+# TIFF strips.
+RAW_MODE_BYTES = {'L': 1, 'RGB': 3, 'RGBA': 4, 'CMYK': 4}
+
+# rows are read from uncompressed TIFFs in bands of about this many bytes.
+BAND_BYTES = 32 * 1024 * 1024
+
+# memory a worker uses before it decodes anything: the interpreter, Pillow
+# and their libraries. A memory limit covers this too.
+BASELINE_BYTES = 128 * 1024 * 1024
+
+def get_decoded_bytes(im):
+    """Estimate how much memory a fully decoded image needs."""
+    return im.width * im.height * RAW_MODE_BYTES.get(im.mode, 4)
+
+def get_raw_strips(im):
+    """Get the uncompressed strips of a TIFF, if it is laid out so that it
+    can be read a band of rows at a time.
+
+    Args:
+        im: an opened, but not loaded, PIL.Image.
+
+    Returns:
+        list: (first row, last row, file offset) tuples, sorted by row, or
+        None if the image is compressed or tiled.
+    """
+    if im.mode not in RAW_MODE_BYTES or not im.tile:
+        return None
+    row_bytes = im.width * RAW_MODE_BYTES[im.mode]
+    strips = []
+    for tile in im.tile:
+        codec, extents, offset, args = tile
+        if codec != 'raw' or args[0] != im.mode or args[1] not in (0, row_bytes) or args[2] != 1:
+            return None
+        x0, y0, x1, y1 = extents
+        if (x0, x1) != (0, im.width):
+            return None
+        strips.append((y0, y1, offset))
+    return sorted(strips)
+
+def read_rows(f, im, strips, y0, y1):
+    """Read rows y0 to y1 of an uncompressed TIFF into a new image."""
+    row_bytes = im.width * RAW_MODE_BYTES[im.mode]
+    data = []
+    for strip_y0, strip_y1, offset in strips:
+        top = max(y0, strip_y0)
+        bottom = min(y1, strip_y1)
+        if top < bottom:
+            f.seek(offset + (top - strip_y0) * row_bytes)
+            data.append(f.read((bottom - top) * row_bytes))
+    return Image.frombytes(im.mode, (im.width, y1 - y0), b''.join(data))
+
+def reduce_in_bands(tif_file, im, strips, size, band_bytes=BAND_BYTES):
+    """Scale an uncompressed TIFF down a band of rows at a time, so that
+    only one band of the full size image is in memory at once.
+
+    Args:
+        tif_file (str): path to the TIFF.
+        im: the opened TIFF.
+        strips (list): from get_raw_strips().
+        size (int): fit the result in a size by size box.
+        band_bytes (int): roughly how much of the TIFF to decode at once.
+
+    Returns:
+        PIL.Image
+    """
+    factor = max(1, min(im.width // size, im.height // size))
+    row_bytes = im.width * RAW_MODE_BYTES[im.mode]
+    # bands are a multiple of the reduction factor high, so that no output
+    # row is split between two bands.
+    band_rows = max(factor, band_bytes // row_bytes // factor * factor)
+
+    out = Image.new(
+        im.mode,
+        (math.ceil(im.width / factor), math.ceil(im.height / factor))
+    )
+    with open(tif_file, 'rb') as f:
+        for y in range(0, im.height, band_rows):
+            band = read_rows(f, im, strips, y, min(y + band_rows, im.height))
+            out.paste(band.reduce(factor), (0, y // factor))
+    out.thumbnail((size, size))
+    return out
+
+def get_jpeg_image(tif_file, im, size=None, memory_limit=None):
+    """Decode a TIFF for conversion, keeping memory use down.
+
+    When a size is given, uncompressed TIFFs are read in bands and reduced
+    as they go. Other TIFFs are decoded in full and then reduced. When a
+    memory limit is given, pages that would go over it raise MemoryError
+    before anything is decoded.
+
+    Args:
+        tif_file (str): path to the TIFF.
+        im: the opened TIFF.
+        size (int): fit the result in a size by size box, or None to keep
+        the full size.
+        memory_limit (int): the memory limit of the whole process, or None.
+        BASELINE_BYTES of it are set aside for the process itself.
+
+    Returns:
+        PIL.Image
+    """
+    strips = get_raw_strips(im) if size else None
+    band_bytes = BAND_BYTES
+    if memory_limit:
+        available = memory_limit - BASELINE_BYTES
+        band_bytes = max(1, min(band_bytes, available // 4))
+    if strips:
+        needed = min(get_decoded_bytes(im), band_bytes) * 2
+    else:
+        needed = get_decoded_bytes(im)
+    if memory_limit and needed > available:
+        raise MemoryError(
+            'decoding needs about {}MB, over the {}MB left under the limit'.format(
+                needed // 2 ** 20, max(0, available) // 2 ** 20
+            )
+        )
+
+    if strips:
+        return reduce_in_bands(tif_file, im, strips, size, band_bytes)
+    if size:
+        # JPEG sources can be decoded at a fraction of their size; this does
+        # nothing for other formats.
+        im.draft(im.mode, (size, size))
+        factor = max(1, min(im.width // size, im.height // size))
+        if factor > 1:
+            im = im.reduce(factor)
+        im.thumbnail((size, size))
+    return im
+
+def init_worker(memory_limit=None):
+    """Set up a worker process. With a memory limit, the worker's data
+    segment is capped, so going over it raises MemoryError for that page
+    instead of getting the process killed."""
+    if memory_limit:
+        resource.setrlimit(resource.RLIMIT_DATA, (memory_limit, memory_limit))
+
+@contextlib.contextmanager
+def memory_limited(memory_limit=None):
+    """Cap this process's data segment for a while, like init_worker()
+    does for worker processes, for converting pages without a pool. Only
+    the soft limit is lowered, so it can be put back afterwards."""
+    if not memory_limit:
+        yield
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_DATA)
+    if hard != resource.RLIM_INFINITY:
+        memory_limit = min(memory_limit, hard)
+    resource.setrlimit(resource.RLIMIT_DATA, (memory_limit, hard))
+    try:
+        yield
+    finally:
+        resource.setrlimit(resource.RLIMIT_DATA, (soft, hard))
+
+def convert_page(page, size=None, memory_limit=None):
+    """Convert one TIFF to a JPEG. The JPEG is written to a temporary file
+    in the same directory and renamed into place, so an interrupted run
+    never leaves a partial JPEG behind.
+
+    Args:
+        page (tuple): (tif_file, jpg_file)
+        size (int): see get_jpeg_image().
+        memory_limit (int): see get_jpeg_image().
+
+    Returns:
+        tuple: (tif_file, seconds, error), where error is None on success.
+    """
+    tif_file, jpg_file = page
+    start = time.perf_counter()
+    tmp_file = os.path.join(
+        os.path.dirname(jpg_file),
+        '.{}.tmp'.format(os.path.basename(jpg_file))
+    )
+    try:
+        with Image.open(tif_file) as im:
+            get_jpeg_image(tif_file, im, size, memory_limit).save(
+                tmp_file,
+                format='JPEG'
+            )
+        os.replace(tmp_file, jpg_file)
+    except Exception as e:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        return tif_file, time.perf_counter() - start, '{}: {}'.format(type(e).__name__, e)
+    return tif_file, time.perf_counter() - start, None
+
+def convert_pages(pages, jobs=None, size=None, memory_limit=None):
+    """Convert pages across a pool of worker processes.
+
+    Args:
+        pages (list): (tif_file, jpg_file) tuples, from get_pages().
+        jobs (int): number of worker processes. Defaults to the number of
+        CPUs.
+        size (int): see get_jpeg_image().
+        memory_limit (int): memory ceiling for each worker, in bytes.
+
+    Returns:
+        a generator of (tif_file, seconds, error) tuples, in the same order
+        as pages.
+    """
+    jobs = jobs or os.cpu_count() or 1
+    convert = functools.partial(
+        convert_page,
+        size=size,
+        memory_limit=memory_limit
+    )
+    if jobs == 1:
+        for page in pages:
+            with memory_limited(memory_limit):
+                result = convert(page)
+            yield result
+        return
+
+    def get_executor():
+        return concurrent.futures.ProcessPoolExecutor(
+            max_workers=jobs,
+            initializer=init_worker,
+            initargs=(memory_limit,)
+        )
+
+    # a few pages per worker are in flight at once, so that when a worker
+    # dies, e.g. from running out of memory outside of a page's own
+    # conversion, only those pages are lost with the pool.
+    pages = iter(pages)
+    pending = collections.deque()
+    executor = get_executor()
+    try:
+        while True:
+            while len(pending) < jobs * 2:
+                page = next(pages, None)
+                if page is None:
+                    break
+                try:
+                    future = executor.submit(convert, page)
+                except concurrent.futures.process.BrokenProcessPool:
+                    executor.shutdown()
+                    executor = get_executor()
+                    future = executor.submit(convert, page)
+                pending.append((page, executor, future))
+            if not pending:
+                return
+            page, page_executor, future = pending.popleft()
+            try:
+                result = future.result()
+            except concurrent.futures.process.BrokenProcessPool as e:
+                result = (page[0], 0.0, '{}: {}'.format(type(e).__name__, e))
+                if page_executor is executor:
+                    executor.shutdown()
+                    executor = get_executor()
+            yield result
+    finally:
+        executor.shutdown()
+
 if __name__ == '__main__':
     arguments = docopt(__doc__)
 
+    jobs = int(arguments['--jobs']) if arguments['--jobs'] else None
+    size = int(arguments['--size']) if arguments['--size'] else None
+    if arguments['--memory-limit']:
+        memory_limit = int(arguments['--memory-limit']) * 2 ** 20
+        if memory_limit <= BASELINE_BYTES:
+            sys.stderr.write('--memory-limit must be over {}MB.\n'.format(BASELINE_BYTES // 2 ** 20))
+            sys.exit(1)
+    else:
+        memory_limit = None
+
+    # pages from every issue go into one pool, so that a few large issues
+    # don't leave most of the workers idle.
+    pages = []
     for identifier in get_identifiers_under_root(
         arguments['--local-root']
     ):
-        jpg_dir = None
-        tif_dir = None
-        mvol_dir = identifier_chunk_to_path(arguments['--local-root'], identifier)
-        if os.path.exists('{}{}TIFF'.format(mvol_dir, os.path.sep)):
-            jpg_dir = '{}{}JPEG'.format(mvol_dir, os.path.sep)
-            tif_dir = '{}{}TIFF'.format(mvol_dir, os.path.sep)
-        elif os.path.exists('{}{}tif'.format(mvol_dir, os.path.sep)):
-            jpg_dir = '{}{}jpg'.format(mvol_dir, os.path.sep)
-            tif_dir = '{}{}tif'.format(mvol_dir, os.path.sep)
-        else: 
-            raise NotImplementedError
-
-        if tif_dir == None:
-            continue
-
-        assert(os.path.exists(mvol_dir))
-        assert(os.path.exists(tif_dir))
-        assert(os.path.exists(jpg_dir) == False)
-
-        if not os.path.isdir(jpg_dir):
-            print(jpg_dir)
-            os.mkdir(jpg_dir)
-
-        for tif_file in sorted(os.listdir(tif_dir)):
-            if identifier.startswith('mvol-0004') or identifier.startswith('mvol-0448'):
-                size = (6800, 6800)
-            else:
-                size = (1024, 1024)
-
-            im = Image.open(os.path.sep.join((tif_dir, tif_file)))
-
-            #because no jpegs were produced for this set, the
-            #coordinates match the TIFFs- so there is no need to alter
-            #them. JPEGs can be saved at the same size as TIFFs. 
-            #im.thumbnail(size)
-
-            stem = pathlib.Path(os.path.sep.join((tif_dir, tif_file))).stem
-            jpg_file = '{}{}{}.jpg'.format(jpg_dir, os.path.sep, stem)
-            im.save(jpg_file, format='JPEG')
+        pages.extend(get_pages(arguments['--local-root'], identifier))
+
+    start = time.perf_counter()
+    converted = 0
+    failed = 0
+    for tif_file, seconds, error in convert_pages(pages, jobs, size, memory_limit):
+        if error:
+            failed += 1
+            sys.stderr.write('{}: {}\n'.format(tif_file, error))
+        else:
+            converted += 1
+        done = converted + failed
+        if done % 100 == 0 or done == len(pages):
+            elapsed = time.perf_counter() - start
+            sys.stderr.write('{}/{} pages, {:.1f} pages/s\n'.format(
+                done, len(pages), done / elapsed if elapsed else 0.0
+            ))
+
+    elapsed = time.perf_counter() - start
+    sys.stderr.write(
+        'converted {} pages ({} failed) in {:.1f}s: {:.1f} pages/s\n'.format(
+            converted, failed, elapsed, (converted + failed) / elapsed if elapsed else 0.0
+        )
+    )
+    if failed:
+        sys.exit(1)
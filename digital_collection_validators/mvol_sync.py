@@ -1,51 +1,153 @@
 import argparse
+import collections
+import concurrent.futures
 import getpass
 import os
 import owncloud
-import paramiko
 import sys
+import tempfile
+from classes import SENTINEL_NAMES, XTFValidator, diff_manifests, get_manifest_from_webdav
+from sentinelutility import get_tree_listing
+
+HOSTNAMES = {
+  'development': 'campub-xtf.lib.uchicago.edu',
+  'production': 'xtf.lib.uchicago.edu'
+}
+
+def list_owncloud_tree(oc, p, workers=8):
+  '''List everything under a directory on owncloud. The whole tree is
+     requested with a single Depth: infinity PROPFIND where the server
+     allows it, otherwise directories are listed a level at a time with
+     concurrent requests.
 
-def get_last_mod_date_from_owncloud(oc, directory):
-  '''
      Arguments:
-     directory, e.g. "IIIF_Files/mvol/0004/0030/0103"
- 
+     oc, an owncloud object.
+     p, the directory path as a string, e.g. "IIIF_Files/mvol/0004"
+     workers, the number of concurrent requests for the fallback walk.
+
      Returns:
-     datetime object.
+     a list of owncloud.FileInfo objects.
   '''
- 
-  raise NotImplementedError
+  entries = get_tree_listing(oc, p)
+  if entries is not None:
+    return entries
+
+  entries = []
+  with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+    directories = [p]
+    while directories:
+      listings = executor.map(oc.list, directories)
+      directories = []
+      for listing in listings:
+        for e in listing:
+          entries.append(e)
+          if e.is_dir():
+            directories.append(e.path)
+  return entries
 
-def get_last_mod_date_from_xtf(directory, server):
+def get_owncloud_manifest(oc, identifier_chunk, workers=8):
+  '''Build a sync manifest for an identifier chunk on owncloud. Sentinel
+     files are left out, since they are never copied to XTF.
+
+     Arguments:
+     oc, an owncloud object.
+     identifier_chunk, e.g. "mvol-0004"
+     workers, see list_owncloud_tree().
+
+     Returns:
+     a sorted list of ManifestEntry tuples.
   '''
+  return get_manifest_from_webdav(
+    list_owncloud_tree(oc, identifier_to_path(identifier_chunk, 'owncloud'), workers),
+    SENTINEL_NAMES
+  )
+
+def get_xtf_manifest(xtf, identifier_chunk):
+  '''Build a sync manifest for an identifier chunk on an XTF server, with
+     one listing of the bookreader directory and one remote find command
+     per batch of identifiers.
+
      Arguments:
-     directory, e.g. "/usr/local/apache-tomcat-6.0/webapps/campub/data/bookreader/mvol-0004-0030-0103"
-     server, e.g. development, production
- 
+     xtf, a connected XTFValidator.
+     identifier_chunk, e.g. "mvol-0004"
+
      Returns:
-     datetime object.
+     a sorted list of ManifestEntry tuples.
   '''
+  return xtf.get_manifest(xtf.get_identifiers(identifier_chunk))
 
-  hostnames = {
-    'development': 'campub-xtf.lib.uchicago.edu',
-    'production': 'xtf.lib.uchicago.edu'
-  }
+def get_sync_report(owncloud_manifest, xtf_manifests):
+  '''Compare owncloud with each XTF server.
 
-  password = getpass.getpass('SSH password: ')
+     Arguments:
+     owncloud_manifest, a sorted list of ManifestEntry tuples.
+     xtf_manifests, a dict mapping server names, e.g. "development", to
+     sorted lists of ManifestEntry tuples.
+
+     Returns:
+     a dict mapping identifiers to dicts mapping server names to lists of
+     (status, owncloud_entry, xtf_entry) differences. Identifiers that are
+     in sync everywhere have no differences.
+  '''
+  report = {}
+  for entry in owncloud_manifest:
+    report.setdefault(entry.path.split('/')[0], {})
+  for server, xtf_manifest in xtf_manifests.items():
+    for entry in xtf_manifest:
+      report.setdefault(entry.path.split('/')[0], {})
+    for difference in diff_manifests(owncloud_manifest, xtf_manifest):
+      entry = difference[1] or difference[2]
+      report[entry.path.split('/')[0]].setdefault(server, []).append(difference)
+  return report
 
-  ssh = paramiko.SSHClient()
-  ssh.set_missing_host_key_policy(paramiko.WarningPolicy)
-  ssh.load_system_host_keys()
-  ssh.connect(hostnames[server], username='xtf', password=password)
+def copy_to_xtf(oc, xtf, differences):
+  '''Copy files that are missing or changed on an XTF server from owncloud.
+     Files that are only on the XTF server are left alone.
 
-  #raise NotImplementedError
+     Arguments:
+     oc, an owncloud object.
+     xtf, a connected XTFValidator.
+     differences, (status, owncloud_entry, xtf_entry) tuples from
+     diff_manifests().
+
+     Returns:
+     the number of files copied.
+  '''
+  sftp = xtf.ftp.clients[0].open_sftp()
+  copied = 0
+  try:
+    with tempfile.TemporaryDirectory() as tmp:
+      for status, owncloud_entry, xtf_entry in differences:
+        if status == 'extra':
+          continue
+        identifier, relpath = owncloud_entry.path.split('/', 1)
+        local_file = os.path.join(tmp, 'transfer')
+        oc.get_file(
+          '{}/{}'.format(identifier_to_path(identifier, 'owncloud'), relpath),
+          local_file
+        )
+        # the identifier itself may be new to this server, so make sure
+        # every directory from the identifier's down exists.
+        directories = [xtf.get_path(identifier)]
+        for d in relpath.split('/')[:-1]:
+          directories.append('{}/{}'.format(directories[-1], d))
+        for directory in directories:
+          try:
+            sftp.stat(directory)
+          except IOError:
+            sftp.mkdir(directory)
+        sftp.put(local_file, '{}/{}'.format(directories[0], relpath))
+        copied += 1
+  finally:
+    sftp.close()
+  return copied
 
 def identifier_to_path(identifier, server):
   '''
      Arguments:
      identifier, e.g. "mvol", "mvol-0004", "mvol-0004-0030-0103"
-     server, e.g. owncloud, development, production. 
- 
+     server, e.g. owncloud, development, production.
+
      Returns:
      path, e.g. "/usr/local/apache-tomcat-6.0/webapps/campub/data/bookreader/mvol-0004-0030-0103"
   '''
@@ -58,37 +160,109 @@ def identifier_to_path(identifier, server):
     return 'xtf@xtf.lib.uchicago.edu:/usr/local/apache-tomcat-6.0/webapps/campub/data/bookreader/{}'.format(identifier)
   else:
     raise NotImplementedError
-       
+
 if __name__ == '__main__':
   """ Check to see which directories are out of sync between owncloud,
-      development and production. 
+      development and production.
 
-      List all of the owncloud directories under "mvol". Show if they are
-      valid, and if files are present and in sync in dev and production.
+      List all of the owncloud directories under "mvol". Show if files are
+      present and in sync in dev and production.
       python mvol_sync.py --list mvol
 
-      List all of the owncloud directories under "mvol-0004". Show if they are
-      valid, and if files are present and in sync in dev and production.
+      List all of the owncloud directories under "mvol-0004". Show if files
+      are present and in sync in dev and production.
       python mvol_sync.py --list mvol-0004
 
-      List all of the owncloud directories under "mvol-0004-0030". Show if they
-      are valid, and if files are present and in sync in dev and production.
+      List all of the owncloud directories under "mvol-0004-0030". Show if
+      files are present and in sync in dev and production.
       python mvol_sync.py --list mvol-0004-0030
 
-      Copy files from owncloud to the development server:
+      Copy files that differ from owncloud to the development server:
       python mvol_sync.py --copy-to-dev mvol-0004-0030-0103
 
-      Copy files from owncloud to the production server:
-      python mvol_sync.py --copy-to-dev mvol-0004-0030-0103
+      Copy files that differ from owncloud to the production server:
+      python mvol_sync.py --copy-to-production mvol-0004-0030-0103
+
+      Validate a year of issues on the production server, from an
+      inventory taken with a few remote commands:
+      python mvol_sync.py --validate-production mvol-0004-0030
   """
 
   parser = argparse.ArgumentParser()
   parser.add_argument("identifier", help="e.g. mvol-0004-0030-0103")
+  mode = parser.add_mutually_exclusive_group(required=True)
+  mode.add_argument("--list", action="store_true",
+                    help="show which identifiers are out of sync.")
+  mode.add_argument("--copy-to-dev", action="store_true",
+                    help="copy files that differ to the development server.")
+  mode.add_argument("--copy-to-production", action="store_true",
+                    help="copy files that differ to the production server.")
+  mode.add_argument("--validate-dev", action="store_true",
+                    help="validate identifiers on the development server.")
+  mode.add_argument("--validate-production", action="store_true",
+                    help="validate identifiers on the production server.")
+  parser.add_argument("--workers", type=int, default=8,
+                      help="concurrent WebDAV requests when the server won't list the whole tree at once.")
 
   args = parser.parse_args()
 
+  if args.list:
+    servers = ('development', 'production')
+  elif args.copy_to_dev or args.validate_dev:
+    servers = ('development',)
+  else:
+    servers = ('production',)
+
+  password = getpass.getpass('SSH password: ')
+
+  xtfs = {}
+  for server in servers:
+    xtfs[server] = XTFValidator(server == 'production')
+    xtfs[server].connect(HOSTNAMES[server], {'username': 'xtf', 'password': password})
+
+  if args.validate_dev or args.validate_production:
+    for identifier, errors in xtfs[servers[0]].validate_chunk(args.identifier):
+      if errors:
+        sys.stdout.write(''.join(errors))
+      else:
+        sys.stdout.write('{} valid\n'.format(identifier))
+    xtfs[servers[0]].ftp.close()
+    sys.exit()
+
   oc = owncloud.Client(os.environ['OWNCLOUD_WEBDAV_SERVER'])
-  username = os.environ['OWNCLOUD_WEBDAV_USERNAME']
-  password = os.environ['OWNCLOUD_WEBDAV_PASSWORD']
+  oc.login(
+    os.environ['OWNCLOUD_WEBDAV_USERNAME'],
+    os.environ['OWNCLOUD_WEBDAV_PASSWORD']
+  )
+
+  # build every manifest once, then compare them in a single pass.
+  owncloud_manifest = get_owncloud_manifest(oc, args.identifier, args.workers)
+  report = get_sync_report(
+    owncloud_manifest,
+    dict((server, get_xtf_manifest(xtf, args.identifier)) for server, xtf in xtfs.items())
+  )
+
+  if args.list:
+    for identifier in sorted(report):
+      statuses = []
+      for server in servers:
+        differences = report[identifier].get(server, [])
+        if not differences:
+          statuses.append('{} in sync'.format(server))
+        else:
+          counts = collections.Counter(d[0] for d in differences)
+          statuses.append('{} out of sync ({})'.format(
+            server,
+            ', '.join('{} {}'.format(counts[s], s) for s in sorted(counts))
+          ))
+      sys.stdout.write('{}\t{}\n'.format(identifier, '\t'.join(statuses)))
+  else:
+    server = servers[0]
+    differences = []
+    for identifier in sorted(report):
+      differences.extend(report[identifier].get(server, []))
+    copied = copy_to_xtf(oc, xtfs[server], differences)
+    sys.stdout.write('copied {} files to {}.\n'.format(copied, server))
 
-  print(get_last_mod_date_from_xtf(identifier_to_path(args.identifier, 'development'), 'development'))
+  for xtf in xtfs.values():
+    xtf.ftp.close()
@@ -2,7 +2,7 @@
 
 """Usage:
    rac ls <identifier-chunk> ...
-   rac validate (--list-valid | --show-errors) <identifier-chunk> ...
+   rac validate (--list-valid | --show-errors) [--jobs=<n>] [--processes] <identifier-chunk> ...
 """
 
 import os
@@ -26,8 +26,11 @@ if __name__ == '__main__':
 
 
     elif arguments['validate']:
-        for identifier in identifiers:
-            errors = rac_valid.validate(identifier)
+        for identifier, errors in rac_valid.validate_identifiers(
+            identifiers,
+            int(arguments['--jobs'] or 1),
+            arguments['--processes']
+        ):
             if arguments['--show-errors']:
                 for error in errors:
                     sys.stdout.write(error)
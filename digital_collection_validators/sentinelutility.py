@@ -1,35 +1,172 @@
 import argparse
+import calendar
+import concurrent.futures
 import owncloud
 import os
 import getpass
 import sys
 import re
 import tempfile
+import urllib.parse
 
-def get_mvol_mmdd_directories(oc, p):
+# the same names as classes.SENTINEL_NAMES. They are repeated here so that
+# this script only needs pyocclient, not the validators' dependencies.
+SENTINEL_NAMES = ('ready', 'queue', 'valid', 'invalid')
+
+MVOL_MMDD_RE = re.compile('^/?IIIF_Files/mvol/\\d{4}/\\d{4}/\\d{4}/?$')
+MVOL_PARENT_RE = re.compile('^/?IIIF_Files/mvol(/\\d{4}){0,3}/?$')
+
+def is_complete_listing(p, entries):
+  '''Check whether a Depth: infinity listing really went all the way down.
+     Some servers answer an infinite PROPFIND with a single level instead of
+     refusing it, so a listing with directories in it but nothing deeper
+     than one level below p is treated as truncated.
+
+     Arguments:
+     p, the directory path that was listed.
+     entries, a list of owncloud.FileInfo objects.
+
+     Returns:
+     False if the listing stops one level below p. Empty directories
+     further down, e.g. an empty POS directory, don't matter. A tree whose
+     subdirectories are all empty looks truncated too, but walking it
+     level by level is cheap, since there is nothing below them.
+  '''
+  depth = len([s for s in p.split('/') if s])
+  if not any(e.is_dir() for e in entries):
+    return True
+  return any(
+    len([s for s in e.path.split('/') if s]) > depth + 1
+    for e in entries
+  )
+
+def move_without_overwrite(oc, source, target):
+  '''Move a file over WebDAV, without replacing the target. The MOVE is
+     sent with "Overwrite: F", so the server answers 412 Precondition
+     Failed if the target already exists. owncloud.Client.move() always
+     overwrites.
+
+     This relies on Client._make_dav_request() and Client._webdav_url,
+     which are private in pyocclient 0.6. Check them again before
+     upgrading pyocclient.
+
+     Arguments:
+     oc, an owncloud object.
+     source, target, paths on the server.
+
+     Raises:
+     owncloud.HTTPResponseError, e.g. with status 404 or 412.
+  '''
+  oc._make_dav_request(
+    'MOVE',
+    source,
+    headers={
+      'Destination': oc._webdav_url + urllib.parse.quote(target),
+      'Overwrite': 'F'
+    }
+  )
+
+def get_tree_listing(oc, p):
+  '''Get everything under a path with a single Depth: infinity PROPFIND.
+     The response is read and parsed in full before this returns.
+
+     Arguments:
+     oc, an owncloud object.
+     p, the directory path as a string.
+
+     Returns:
+     a list of owncloud.FileInfo objects, or None if the server won't list
+     the whole tree at once.
+  '''
+  try:
+    entries = oc.list(p, depth='infinity')
+  except owncloud.HTTPResponseError:
+    return None
+  if entries is None or not is_complete_listing(p, entries):
+    return None
+  return entries
+
+def walk_mvol_mmdd_directories(oc, p, workers=8):
+  '''Find mvol mmdd directories by listing one level at a time, with up to
+     workers PROPFIND requests in flight at once.
+
+     Arguments:
+     oc, an owncloud object.
+     p, the directory path as a string.
+     workers, the number of concurrent requests.
+
+     Returns:
+     a generator of paths to mmdd directories, in the order they are found.
+  '''
+  with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+    pending = set([executor.submit(oc.list, p)])
+    while pending:
+      done, pending = concurrent.futures.wait(
+        pending,
+        return_when=concurrent.futures.FIRST_COMPLETED
+      )
+      for future in done:
+        for e in future.result():
+          if not e.is_dir():
+            continue
+          if MVOL_MMDD_RE.match(e.path):
+            yield e.path
+          elif MVOL_PARENT_RE.match(e.path):
+            pending.add(executor.submit(oc.list, e.path))
+
+def iter_mvol_mmdd_directories(oc, p, workers=8):
+  '''Find mvol mmdd directories under a given path. The whole tree is
+     requested with a single Depth: infinity PROPFIND. pyocclient reads and
+     parses that whole response, which lists every ALTO, TIFF and JPEG
+     under the path, before the first directory is yielded, so memory use
+     grows with the size of the tree. If the server refuses depth infinity,
+     the tree is walked a level at a time with concurrent requests, and
+     directories are yielded as they are found.
+
+     Arguments:
+     oc, an owncloud object.
+     p, the directory path as a string, e.g. "IIIF_Files/mvol/0004/1930"
+     workers, the number of concurrent requests for the fallback walk.
+
+     Returns:
+     a generator of paths to mmdd directories.
+  '''
+  if MVOL_MMDD_RE.match(p):
+    yield p
+    return
+  if not MVOL_PARENT_RE.match(p):
+    return
+
+  entries = get_tree_listing(oc, p)
+  if entries is not None:
+    for e in entries:
+      if e.is_dir() and MVOL_MMDD_RE.match(e.path):
+        yield e.path
+  else:
+    for mmdd in walk_mvol_mmdd_directories(oc, p, workers):
+      yield mmdd
+
+def get_mvol_mmdd_directories(oc, p, workers=8):
   '''Get a list of mvol mmdd directories from a given path. 
 
      Arguments:
      oc, an owncloud object.
      p, the directory path as a string, e.g. "IIIF_Files/mvol/0004/1930"
+     workers, the number of concurrent requests for the fallback walk.
 
      Returns: 
-     a list of strings, paths to mmdd directories. 
+     a sorted list of strings, paths to mmdd directories. 
   '''
+  return sorted(iter_mvol_mmdd_directories(oc, p, workers))
 
-  if re.match('^/?IIIF_Files/mvol/\d{4}/\d{4}/\d{4}/?$', p):
-    return [p]
-  elif re.match('^/?IIIF_Files/mvol(/\d{4}){0,3}/?$', p):
-    directories = []
-    for e in oc.list(p):
-      if e.is_dir():
-        directories = directories + get_mvol_mmdd_directories(oc, e.path)
-    return directories
-  else:
-    return []
+def get_directory_path(p):
+  '''Normalize a WebDAV directory path to a leading slash and no trailing
+     slash, the form FileInfo.get_path() returns for the files inside it.'''
+  return '/' + p.strip('/')
 
 def get_sentinel_files(oc, file_info):
-  '''Get the sentinel files in a given mmdd directory.
+  '''Get the sentinel files in a given mmdd directory. Sentinels are read
+     from the directory listing itself, so this is a single request.
 
      Arguments:
      oc, an owncloud object. 
@@ -40,11 +177,51 @@ def get_sentinel_files(oc, file_info):
   '''
   sentinels = []
   for entry in oc.list(file_info.get_path()):
-    if entry.get_name() in ('ready', 'queue', 'valid', 'invalid'):
-      sentinels.append(oc.file_info(entry.path))
+    if not entry.is_dir() and entry.get_name() in SENTINEL_NAMES:
+      sentinels.append(entry)
   return sentinels
 
-def runutil(oc, file_info, mode):
+def get_sentinel_map(oc, p, workers=8):
+  '''Get the sentinels in every mvol mmdd directory under a given path.
+
+     The whole tree is read with one Depth: infinity PROPFIND where the
+     server allows it. Otherwise mmdd directories are found by walking the
+     tree, and each one is listed once, with up to workers requests in
+     flight at once.
+
+     Arguments:
+     oc, an owncloud object.
+     p, the directory path as a string, e.g. "IIIF_Files/mvol/0004/1930"
+     workers, the number of concurrent requests.
+
+     Returns:
+     a dict mapping mmdd directory paths, e.g.
+     "/IIIF_Files/mvol/0004/1930/0103", to sets of sentinel file names.
+  '''
+  sentinel_map = {}
+  if MVOL_PARENT_RE.match(p):
+    entries = get_tree_listing(oc, p)
+    if entries is not None:
+      for e in entries:
+        if e.is_dir():
+          if MVOL_MMDD_RE.match(e.path):
+            sentinel_map.setdefault(get_directory_path(e.path), set())
+        elif e.get_name() in SENTINEL_NAMES and MVOL_MMDD_RE.match(e.get_path()):
+          sentinel_map.setdefault(e.get_path(), set()).add(e.get_name())
+      return sentinel_map
+    # the tree listing was already refused, so walk without asking again.
+    directories = list(walk_mvol_mmdd_directories(oc, p, workers))
+  else:
+    directories = list(iter_mvol_mmdd_directories(oc, p, workers))
+  with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+    for d, listing in zip(directories, executor.map(oc.list, directories)):
+      sentinel_map[get_directory_path(d)] = set(
+        e.get_name() for e in listing
+        if not e.is_dir() and e.get_name() in SENTINEL_NAMES
+      )
+  return sentinel_map
+
+def runutil(oc, file_info, mode, sentinels=None):
   '''
      Modify the sentinel files in a given mmdd directory.
  
@@ -52,21 +229,94 @@ def runutil(oc, file_info, mode):
      oc, an owncloud object. 
      file_info, an owncloud.FileInfo object describing an mmdd directory.
      mode, "addready"|"fix"|"deleteall".
+     sentinels, the names of the sentinel files in this directory, e.g. from
+     get_sentinel_map(). If None, the directory is listed.
 
      Side effect:
      manages sentinel files.
   '''
-  sentinels = get_sentinel_files(oc, file_info)
+  if sentinels is None:
+    sentinels = set(s.get_name() for s in get_sentinel_files(oc, file_info))
   if mode == "addready" and len(sentinels) == 0:
     oc.put_file(file_info, "ready")
-  elif mode == "fix" and len(sentinels) > 1:
-    for s in sentinels:
-      if s.get_name() in ('ready', 'queue', 'valid', 'invalid'):
-        oc.delete(s)
-  elif mode == "deleteall":
-    for s in sentinels:
-      if s.get_name() in ('ready', 'queue', 'valid', 'invalid'):
-        oc.delete(s)
+  elif (mode == "fix" and len(sentinels) > 1) or mode == "deleteall":
+    for name in sorted(sentinels):
+      oc.delete('{}/{}'.format(get_directory_path(file_info.path), name))
+
+class WebDAVSentinelStore:
+  '''Sentinel files kept in mvol mmdd directories on owncloud, for a
+     classes.SentinelQueue. Claims are WebDAV MOVE requests, so the server
+     decides which of two schedulers gets an identifier.
+  '''
+
+  def __init__(self, oc, workers=8):
+    '''Arguments:
+       oc, an owncloud object.
+       workers, the number of concurrent requests when listing.
+    '''
+    self.oc = oc
+    self.workers = workers
+
+  def _get_sentinel_path(self, identifier, name):
+    return '/IIIF_Files/{}/{}'.format(identifier.replace('-', '/'), name)
+
+  def get_sentinels(self, identifiers):
+    '''Get the sentinels in some identifiers' mmdd directories, with one
+       listing per directory.
+
+       Returns:
+       a dict mapping identifiers to dicts of sentinel names and their
+       modification times, as unix timestamps.
+    '''
+    def get_sentinels(identifier):
+      try:
+        listing = self.oc.list(get_directory_path(self._get_sentinel_path(identifier, '')))
+      except owncloud.HTTPResponseError:
+        return {}
+      return dict(
+        (e.get_name(), calendar.timegm(e.get_last_modified().timetuple()))
+        for e in listing
+        if not e.is_dir() and e.get_name() in SENTINEL_NAMES
+      )
+    identifiers = list(identifiers)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+      return dict(zip(identifiers, executor.map(get_sentinels, identifiers)))
+
+  def move(self, identifier, source, target):
+    '''Move a sentinel, without replacing the target, e.g. if another
+       scheduler claimed the identifier first.
+
+       Returns:
+       False if the source was already gone or the target already exists.
+    '''
+    try:
+      move_without_overwrite(
+        self.oc,
+        self._get_sentinel_path(identifier, source),
+        self._get_sentinel_path(identifier, target)
+      )
+    except owncloud.HTTPResponseError as e:
+      if e.status_code in (404, 412):
+        return False
+      raise
+    return True
+
+  def touch(self, identifier, name):
+    '''Write a sentinel again to update its modification time.'''
+    self.oc.put_file_contents(self._get_sentinel_path(identifier, name), b'')
+
+  def write(self, identifier, name, text):
+    self.oc.put_file_contents(
+      self._get_sentinel_path(identifier, name),
+      text.encode('utf-8')
+    )
+
+  def remove(self, identifier, name):
+    try:
+      self.oc.delete(self._get_sentinel_path(identifier, name))
+    except owncloud.HTTPResponseError as e:
+      if e.status_code != 404:
+        raise
 
 if __name__ == '__main__':
   parser = argparse.ArgumentParser()
@@ -75,6 +325,8 @@ if __name__ == '__main__':
   parser.add_argument("mode", help='''addready to add ready to all empty folders,
                       fix to delete sentinel files from any folder with more than one,
                       deleteall to delete all sentinel files''')
+  parser.add_argument("--workers", type=int, default=8,
+                      help="concurrent WebDAV requests when the server won't list the whole tree at once.")
   args = parser.parse_args()
  
   if not args.mode in ('addready', 'fix', 'deleteall'):
@@ -101,8 +353,9 @@ if __name__ == '__main__':
     fd.close()
     os.rename(temptuple[1], "ready")
   
-  for p in get_mvol_mmdd_directories(oc, args.directory):
-    runutil(oc, oc.file_info(p), args.mode)
+  sentinel_map = get_sentinel_map(oc, args.directory, args.workers)
+  for p in sorted(sentinel_map):
+    runutil(oc, owncloud.FileInfo(p + '/', 'dir'), args.mode, sentinel_map[p])
 
   if(args.mode == "addready"):
     os.remove("ready")
@@ -2,7 +2,7 @@
 
 """Usage:
    speculum ls <identifier-chunk> ...
-   speculum validate (--list-valid | --show-errors) <identifier-chunk> ...
+   speculum validate (--list-valid | --show-errors) [--jobs=<n>] [--processes] <identifier-chunk> ...
 """
 
 import os
@@ -26,8 +26,11 @@ if __name__ == '__main__':
 
 
     elif arguments['validate']:
-        for identifier in identifiers:
-            errors = spec_valid.validate(identifier)
+        for identifier, errors in spec_valid.validate_identifiers(
+            identifiers,
+            int(arguments['--jobs'] or 1),
+            arguments['--processes']
+        ):
             if arguments['--show-errors']:
                 for error in errors:
                     sys.stdout.write(error)
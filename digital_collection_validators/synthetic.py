@@ -0,0 +1,155 @@
+"""Synthetic collections with the on-disk layouts of the projects, for
+tests and benchmarks. Generated mvol issues pass validation."""
+
+import io, os
+from PIL import Image
+
+
+def get_tiff_bytes(size):
+    """Get the bytes of a grayscale TIFF with some detail in it."""
+    with io.BytesIO() as f:
+        Image.radial_gradient('L').resize((size, size)).save(f, format='TIFF')
+        return f.getvalue()
+
+
+def get_jpeg_bytes(size):
+    with io.BytesIO() as f:
+        Image.radial_gradient('L').resize((size, size)).save(f, format='JPEG')
+        return f.getvalue()
+
+
+def get_pdf_bytes(pages):
+    with io.BytesIO() as f:
+        Image.new('L', (8, 8)).save(
+            f,
+            format='PDF',
+            save_all=True,
+            append_images=[Image.new('L', (8, 8))] * (pages - 1)
+        )
+        return f.getvalue()
+
+
+def write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data.encode('utf-8') if isinstance(data, str) else data)
+
+
+def generate_mvol_issue(root, identifier, pages, tiff, jpeg, pdf, pos=False, jpegs=False):
+    """Write one mvol mmdd directory that passes validation.
+
+    Args:
+        root (str): the local root.
+        identifier (str): e.g. 'mvol-0004-1930-0103'
+        pages (int): number of pages.
+        tiff, jpeg, pdf (bytes): file contents to reuse.
+        pos (bool): write a POS directory instead of ALTO.
+        jpegs (bool): write a JPEG directory too.
+    """
+    path = os.path.join(root, *identifier.split('-'))
+    for p in range(1, pages + 1):
+        page = '{}_{}'.format(identifier, str(p).zfill(8))
+        if pos:
+            write(os.path.join(path, 'POS', page + '.pos'), '0 0 100 100 text\n')
+        else:
+            write(
+                os.path.join(path, 'ALTO', page + '.xml'),
+                '<alto><Layout><Page ID="p{}"><PrintSpace><TextBlock>'
+                '<TextLine><String CONTENT="text"/></TextLine>'
+                '</TextBlock></PrintSpace></Page></Layout></alto>'.format(p)
+            )
+        write(os.path.join(path, 'TIFF', page + '.tif'), tiff)
+        if jpegs:
+            write(os.path.join(path, 'JPEG', page + '.jpg'), jpeg)
+    write(
+        os.path.join(path, identifier + '.dc.xml'),
+        '<?xml version="1.0" encoding="utf-8"?>'
+        '<metadata xmlns:dc="http://purl.org/dc/elements/1.1/">'
+        '<dc:title>Synthetic</dc:title>'
+        '<dc:date>{}-{}-{}</dc:date>'
+        '<dc:description>Generated for benchmarking.</dc:description>'
+        '<dc:identifier>{}</dc:identifier>'
+        '</metadata>'.format(
+            identifier.split('-')[2],
+            identifier.split('-')[3][:2],
+            identifier.split('-')[3][2:],
+            identifier
+        )
+    )
+    write(
+        os.path.join(path, identifier + '.struct.txt'),
+        'object\tpage\tmilestone\n' + ''.join(
+            '{}\t{}\n'.format(str(p).zfill(8), p) for p in range(1, pages + 1)
+        )
+    )
+    write(os.path.join(path, identifier + '.txt'), 'text')
+    write(os.path.join(path, identifier + '.pdf'), pdf)
+
+
+def generate_collection(root, scale=10, page_size=256):
+    """Build a synthetic collection with the on-disk layouts of mvol,
+    chopin, gms, apf and rac.
+
+    Args:
+        root (str): directory to write to.
+        scale (int): issues per mvol year, and objects per project.
+        page_size (int): width and height of TIFFs.
+
+    Returns:
+        dict: project names mapped to the identifiers that were written.
+    """
+    tiff = get_tiff_bytes(page_size)
+    jpeg = get_jpeg_bytes(64)
+    pdfs = {}
+    identifiers = {}
+
+    # mvol/<title>/<year>/<mmdd>, with a few page counts, some issues with
+    # POS instead of ALTO, and some with JPEGs.
+    identifiers['mvol'] = []
+    n = 0
+    for title in ('0004', '0448'):
+        for year in ('1930', '1931'):
+            for i in range(scale):
+                identifier = 'mvol-{}-{}-{}{}'.format(
+                    title, year, str(i // 28 + 1).zfill(2), str(i % 28 + 1).zfill(2)
+                )
+                pages = (4, 8, 12)[n % 3]
+                if pages not in pdfs:
+                    pdfs[pages] = get_pdf_bytes(pages)
+                generate_mvol_issue(
+                    root, identifier, pages, tiff, jpeg, pdfs[pages],
+                    pos=(n % 4 == 3),
+                    jpegs=(n % 2 == 1)
+                )
+                identifiers['mvol'].append(identifier)
+                n += 1
+
+    # chopin/chopin-001/tifs/chopin-001-001.tif, and the same for gms.
+    for project, digits in (('chopin', 3), ('gms', 4)):
+        identifiers[project] = []
+        for i in range(1, scale + 1):
+            identifier = '{}-{}'.format(project, str(i).zfill(digits))
+            for p in range(1, 11):
+                write(
+                    os.path.join(root, project, identifier, 'tifs', '{}-{}.tif'.format(identifier, str(p).zfill(3))),
+                    tiff
+                )
+            identifiers[project].append(identifier)
+
+    # apf/1/apf1-00001.tif
+    identifiers['apf'] = []
+    for d in ('1', '2'):
+        for i in range(1, scale * 10 + 1):
+            identifier = 'apf{}-{}'.format(d, str(i).zfill(5))
+            write(os.path.join(root, 'apf', d, identifier + '.tif'), tiff)
+            identifiers['apf'].append(identifier)
+
+    # rac/0392/tifs/chess-0392-001.tif. There is no rac benchmark yet,
+    # since get_path() does not handle rac.
+    identifiers['rac'] = []
+    for i in range(1, scale + 1):
+        identifier = 'chess-0392-{}'.format(str(i).zfill(3))
+        write(os.path.join(root, 'rac', '0392', 'tifs', identifier + '.tif'), tiff)
+        identifiers['rac'].append(identifier)
+
+    return identifiers
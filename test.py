@@ -1,12 +1,236 @@
+import datetime
+import hashlib
 import io
+import json
+import owncloud
 import unittest
+import unittest.mock
 import os
+import paramiko
+from PIL import Image
 import re
+import resource
+import shutil
 import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import zlib
 
 from digital_collection_validators.classes import *
+from digital_collection_validators import make_mvol_jpegs, synthetic
+import benchmark
 from pathlib import Path
 
+# command line scripts import their neighbours as top level modules.
+sys.modules.setdefault('classes', sys.modules['digital_collection_validators.classes'])
+from digital_collection_validators import sentinelutility
+sys.modules.setdefault('sentinelutility', sentinelutility)
+from digital_collection_validators import mvol_sync
+
+
+# file contents shared by every generated test issue.
+TIFF_BYTES = synthetic.get_tiff_bytes(8)
+JPEG_BYTES = synthetic.get_jpeg_bytes(8)
+
+# the validation table as it was before upgrade_db().
+LEGACY_VALIDATION_TABLE = 'CREATE TABLE validation(identifier TEXT, identifier_date TEXT, validation integer, validation_date TEXT, validation_errors TEXT)'
+
+
+def make_mvol_issue(local_root, identifier, pages=3):
+    """Build a small, valid mvol mmdd directory for testing, with the same
+    generator as the benchmark collection."""
+    synthetic.generate_mvol_issue(
+        local_root,
+        identifier,
+        pages,
+        TIFF_BYTES,
+        JPEG_BYTES,
+        synthetic.get_pdf_bytes(pages)
+    )
+    return os.path.join(local_root, *identifier.split('-'))
+
+
+class LocalSFTPStandIn:
+    """Stands in for a connected paramiko.SSHClient, serving SFTP requests
+    from the local filesystem."""
+
+    def open_sftp(self):
+        return self
+
+    def close(self):
+        pass
+
+    def listdir_iter(self, path):
+        for name in os.listdir(path):
+            yield paramiko.SFTPAttributes.from_stat(os.stat(os.path.join(path, name)), name)
+
+    def listdir_attr(self, path):
+        return list(self.listdir_iter(path))
+
+    def stat(self, path):
+        return paramiko.SFTPAttributes.from_stat(os.stat(path))
+
+    def open(self, path, mode='r'):
+        return open(path, mode)
+
+    def mkdir(self, path):
+        os.mkdir(path)
+
+    def put(self, localpath, remotepath):
+        shutil.copy(localpath, remotepath)
+
+    def exec_command(self, command):
+        p = subprocess.run(command, shell=True, capture_output=True, text=True)
+        return io.StringIO(), io.StringIO(p.stdout), io.StringIO(p.stderr)
+
+
+class LocalWebDAVStandIn:
+    """Stands in for a logged in owncloud.Client, answering PROPFIND
+    requests from the local filesystem."""
+
+    def __init__(self, root, allow_infinity=True, shallow_infinity=False):
+        self.root = root
+        self.allow_infinity = allow_infinity
+        # answer Depth: infinity with a single level, like some servers do.
+        self.shallow_infinity = shallow_infinity
+        self.requests = []
+
+    def _file_info(self, path):
+        full_path = os.path.join(self.root, path.strip('/'))
+        if os.path.isdir(full_path):
+            return owncloud.FileInfo('/' + path.strip('/') + '/', 'dir')
+        return owncloud.FileInfo(
+            '/' + path.strip('/'),
+            'file',
+            {
+                '{DAV:}getcontentlength': str(os.path.getsize(full_path)),
+                '{DAV:}getlastmodified': time.strftime(
+                    '%a, %d %b %Y %H:%M:%S GMT',
+                    time.gmtime(os.path.getmtime(full_path))
+                )
+            }
+        )
+
+    def _list(self, path, depth):
+        entries = []
+        base = path.strip('/')
+        for name in sorted(os.listdir(os.path.join(self.root, base))):
+            entry = self._file_info(base + '/' + name)
+            entries.append(entry)
+            if depth == 'infinity' and entry.is_dir():
+                entries.extend(self._list(entry.path, depth))
+        return entries
+
+    def list(self, path, depth=1):
+        self.requests.append(('PROPFIND', path, depth))
+        if depth == 'infinity' and not self.allow_infinity:
+            raise owncloud.HTTPResponseError(403)
+        if not os.path.isdir(os.path.join(self.root, path.strip('/'))):
+            raise owncloud.HTTPResponseError(404)
+        if self.shallow_infinity:
+            depth = 1
+        return self._list(path, depth)
+
+    def file_info(self, path):
+        self.requests.append(('PROPFIND', path, 0))
+        return self._file_info(path)
+
+    def get_file(self, remote_path, local_file):
+        self.requests.append(('GET', remote_path))
+        shutil.copy(os.path.join(self.root, remote_path.strip('/')), local_file)
+        return True
+
+    def put_file(self, remote_path, local_source_file):
+        if isinstance(remote_path, owncloud.FileInfo):
+            remote_path = remote_path.path
+        self.requests.append(('PUT', remote_path))
+        if remote_path.endswith('/'):
+            remote_path += os.path.basename(local_source_file)
+        shutil.copy(local_source_file, os.path.join(self.root, remote_path.strip('/')))
+        return True
+
+    def delete(self, path):
+        if isinstance(path, owncloud.FileInfo):
+            path = path.path
+        self.requests.append(('DELETE', path))
+        try:
+            os.remove(os.path.join(self.root, path.strip('/')))
+        except FileNotFoundError:
+            raise owncloud.HTTPResponseError(404)
+        return True
+
+    _webdav_url = 'http://localhost/remote.php/webdav'
+
+    def move(self, source, target, overwrite=True):
+        self.requests.append(('MOVE', source, target))
+        target_path = os.path.join(self.root, target.strip('/'))
+        if not overwrite and os.path.exists(target_path):
+            raise owncloud.HTTPResponseError(412)
+        try:
+            os.rename(os.path.join(self.root, source.strip('/')), target_path)
+        except FileNotFoundError:
+            raise owncloud.HTTPResponseError(404)
+        return True
+
+    def _make_dav_request(self, method, path, headers=None):
+        assert method == 'MOVE'
+        return self.move(
+            path,
+            urllib.parse.unquote(headers['Destination'][len(self._webdav_url):]),
+            headers.get('Overwrite', 'T') == 'T'
+        )
+
+    def put_file_contents(self, path, data):
+        self.requests.append(('PUT', path))
+        with open(os.path.join(self.root, path.strip('/')), 'wb') as f:
+            f.write(data)
+        return True
+
+
+class MvolTestCase(unittest.TestCase):
+    """Builds the mvol issues listed in issues under a temporary local root,
+    self.root, and points an MvolValidator at it. Subclasses change
+    issues, pages and subdirectory to get a different collection."""
+
+    issues = ('mvol-0004-1930-0103',)
+    pages = 3
+    # e.g. 'IIIF_Files', to build the collection below the temporary
+    # directory instead of in it.
+    subdirectory = None
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.root = self.tmp.name
+        if self.subdirectory:
+            self.root = os.path.join(self.tmp.name, self.subdirectory)
+        self.mmdd_paths = dict(
+            (i, make_mvol_issue(self.root, i, self.pages)) for i in self.issues
+        )
+        if self.issues:
+            self.mmdd_path = self.mmdd_paths[self.issues[0]]
+        self.validator = MvolValidator()
+        self.validator.set_local_root(self.root)
+
+    def connect_to_db(self, path=None):
+        """Connect self.validator to a database with the original
+        validation table, upgraded."""
+        self.validator.connect_to_db(path or os.path.join(self.tmp.name, 'validation.db'))
+        self.addCleanup(self.validator.conn.close)
+        self.validator.conn.execute(LEGACY_VALIDATION_TABLE)
+        self.validator.upgrade_db()
+
+    def connect_locally(self, validator):
+        """Read files through SFTP requests served from the local
+        filesystem, as if the validator had called connect()."""
+        validator.ftp = SFTPFilesystem('localhost', client_factory=LocalSFTPStandIn)
+        self.addCleanup(validator.ftp.close)
+        return validator
+
 
 class TestValidator(unittest.TestCase):
     def __init__(self, *args, **kwargs):
@@ -177,6 +401,26 @@ class TestValidator(unittest.TestCase):
         self.assertEqual(False,self.validator.is_identifier_chunk('speculum-'))
         self.assertEqual(False,self.validator.is_identifier_chunk('speculum-00001'))
 
+    def test_parse_identifier(self):
+        parsed = parse_identifier('mvol-0004-1930-0103')
+        self.assertEqual('mvol', parsed.project)
+        self.assertEqual(('mvol', '0004', '1930', '0103'), parsed.levels)
+        self.assertEqual(4, parsed.depth)
+        self.assertTrue(parsed.is_identifier)
+        self.assertTrue(parsed.is_identifier_chunk)
+
+        self.assertEqual(
+            [
+                ('rac', True, True),
+                ('apf', False, True),
+                (None, False, False)
+            ],
+            [(p.project, p.is_identifier, p.is_identifier_chunk)
+             for p in classify(['chess-0392-001', 'apf1', 'unknown-0001'])]
+        )
+        with self.assertRaises(NotImplementedError):
+            self.validator.is_identifier('unknown-0001')
+
 
 class TestMvolValidator(unittest.TestCase):
     def __init__(self, *args, **kwargs):
@@ -273,13 +517,1197 @@ class TestMvolValidator(unittest.TestCase):
         self.assertTrue(len(self.validator.validate_dc_xml('mvol-0001-0002-0003', f)) > 0)
 
     def test_dc_xml(self):
-        """dc.xml validator accepts a correctly formed file."""
-        with io.StringIO('<metadata><title>test</title><date>2000-01-31</date><description>test</description><identifier>mvol-0004-1900-0101</identifier></metadata>') as f:
+        """dc.xml validator accepts a correctly formed file. Elements are in
+        the Dublin Core namespace, as validate_dc_xml() documents."""
+        with io.StringIO('<metadata xmlns:dc="http://purl.org/dc/elements/1.1/"><dc:title>test</dc:title><dc:date>2000-01-31</dc:date><dc:description>test</dc:description><dc:identifier>mvol-0004-1900-0101</dc:identifier></metadata>') as f:
             self.assertEqual(
                 0,
                 len(self.validator.validate_dc_xml('mvol-0001-0002-0003', f))
             )
 
+
+class TestBatchValidation(MvolTestCase):
+    issues = ('mvol-0004-1930-0103', 'mvol-0004-1930-0104',
+              'mvol-0004-1930-0105', 'mvol-0004-1930-0106')
+
+    def setUp(self):
+        super().setUp()
+        self.identifiers = list(self.issues)
+        # break one issue so the results are not all empty.
+        os.remove(os.path.join(self.mmdd_paths['mvol-0004-1930-0105'], 'mvol-0004-1930-0105.txt'))
+
+    def test_get_identifiers(self):
+        self.assertEqual(
+            self.validator.get_identifiers('mvol-0004-1930'),
+            self.identifiers
+        )
+
+    def test_recursive_ls(self):
+        """identifiers are yielded lazily, in order, without walking page
+        directories."""
+        open(os.path.join(self.mmdd_paths['mvol-0004-1930-0104'], 'TIFF', 'mvol-0004-1930-0199.dc.xml'), 'w').close()
+        identifiers = self.validator.recursive_ls('mvol')
+        self.assertEqual('mvol-0004-1930-0103', next(identifiers))
+        self.assertEqual(self.identifiers[1:], list(identifiers))
+        self.assertEqual([], list(self.validator.recursive_ls('mvol-0004-1931')))
+
+    def test_parallel_matches_serial(self):
+        """thread and process pools return the same results, in the same
+        order, as a serial run."""
+        serial = list(self.validator.validate_identifiers(self.identifiers))
+        self.assertEqual(['mvol-0004-1930-0105 txt missing\n'], serial[2][1])
+        self.assertEqual(
+            serial,
+            list(self.validator.validate_identifiers(self.identifiers, jobs=3))
+        )
+        self.assertEqual(
+            serial,
+            list(self.validator.validate_identifiers(self.identifiers, jobs=2, processes=True))
+        )
+
+
+class TestDirectorySnapshot(MvolTestCase):
+    pages = 2
+
+    def test_snapshot_contents(self):
+        snapshot = self.validator.get_directory_snapshot('mvol-0004-1930-0103')
+        self.assertEqual(
+            snapshot.listdir('TIFF'),
+            ['mvol-0004-1930-0103_00000001.tif', 'mvol-0004-1930-0103_00000002.tif']
+        )
+        self.assertTrue(snapshot.isdir('ALTO'))
+        self.assertTrue(snapshot.isfile('mvol-0004-1930-0103.pdf'))
+        self.assertEqual(
+            os.path.getsize(os.path.join(self.mmdd_path, 'mvol-0004-1930-0103.pdf')),
+            snapshot.getsize('mvol-0004-1930-0103.pdf')
+        )
+        self.assertEqual(10, len(snapshot))
+        with self.assertRaises(FileNotFoundError):
+            snapshot.listdir('POS')
+
+    def test_validate_reads_snapshot(self):
+        """checks report the same errors when they read from a snapshot."""
+        open(os.path.join(self.mmdd_path, 'mvol-0004-1930-0103.pdf'), 'w').close()
+        open(os.path.join(self.mmdd_path, 'extra.jpg'), 'w').close()
+        self.assertEqual(
+            self.validator.validate('mvol-0004-1930-0103'),
+            [
+                'mvol-0004-1930-0103.pdf is an empty file.\n',
+                'non-allowable file extra.jpg in mvol-0004-1930-0103\n'
+            ]
+        )
+        self.assertEqual({}, self.validator.snapshots)
+
+
+class TestIncrementalValidation(MvolTestCase):
+    def setUp(self):
+        super().setUp()
+        for root, dirs, files in os.walk(self.mmdd_path):
+            for f in dirs + files + ['.']:
+                os.utime(os.path.join(root, f), (1000000000, 1000000000))
+        self.connect_to_db()
+        # upgrading an upgraded database changes nothing.
+        self.validator.upgrade_db()
+
+    def test_get_changed_identifiers(self):
+        identifiers = ['mvol-0004-1930-0103', 'mvol-0004-1930-0104']
+        changed = self.validator.get_changed_identifiers(identifiers)
+        self.assertEqual(
+            {'mvol-0004-1930-0103': (1000000000, 12), 'mvol-0004-1930-0104': None},
+            changed
+        )
+
+        self.validator.conn.execute(
+            'INSERT INTO validation (identifier, validation, validation_date, entry_count) VALUES (?, 1, ?, 9)',
+            ('mvol-0004-1930-0103', '2020-10-30T15:42:06.860035')
+        )
+        self.assertEqual(
+            ['mvol-0004-1930-0104'],
+            list(self.validator.get_changed_identifiers(identifiers))
+        )
+        self.assertEqual(
+            identifiers,
+            list(self.validator.get_changed_identifiers(identifiers, check_count=True))
+        )
+
+        os.utime(os.path.join(self.mmdd_path, 'TIFF'))
+        self.assertEqual(
+            identifiers,
+            list(self.validator.get_changed_identifiers(identifiers))
+        )
+
+    def test_clean_run_states(self):
+        """results recorded with states from a full run, as mvol validate
+        --clean does, are current for the next incremental run."""
+        identifiers = ['mvol-0004-1930-0103']
+        states = self.validator.get_identifier_states(identifiers)
+        self.validator.record_validation_results(
+            self.validator.validate_identifiers(identifiers),
+            states=states
+        )
+        self.assertEqual(
+            [('mvol-0004-1930-0103', datetime.datetime.fromtimestamp(1000000000).isoformat(), 12)],
+            self.validator.conn.execute('SELECT identifier, identifier_date, entry_count FROM validation').fetchall()
+        )
+        self.assertEqual({}, self.validator.get_changed_identifiers(identifiers, check_count=True))
+
+
+class TestAltoWellformedness(MvolTestCase):
+    pages = 4
+
+    def test_check_xml_wellformed(self):
+        path = os.path.join(self.tmp.name, 'test.xml')
+        with open(path, 'w') as f:
+            f.write('<alto>\n' + '<String CONTENT="x"/>\n' * 1000 + '<bad></alto>')
+        with open(path, 'rb') as f:
+            self.assertEqual(
+                (1002, 8),
+                DigitalCollectionValidator._check_xml_wellformed(f, chunk_size=16)
+            )
+        with open(path, 'w') as f:
+            f.write('<alto>\n' + '<String CONTENT="x"/>\n' * 1000 + '</alto>')
+        with open(path, 'rb') as f:
+            self.assertIsNone(DigitalCollectionValidator._check_xml_wellformed(f, chunk_size=16))
+        # unbound namespace prefixes are errors, as they are for ElementTree.
+        self.assertEqual(
+            (1, 7),
+            DigitalCollectionValidator._check_xml_wellformed(io.BytesIO(b'<alto><a:b/></alto>'))
+        )
+
+    def test_alto_errors_in_order(self):
+        for p, content in (('00000002', '<alto>'), ('00000004', b'<alto>\xff</alto>')):
+            with open(os.path.join(self.mmdd_path, 'ALTO', 'mvol-0004-1930-0103_{}.xml'.format(p)), 'wb') as f:
+                f.write(content if isinstance(content, bytes) else content.encode('utf-8'))
+        self.validator.set_io_threads(3)
+        self.assertEqual(
+            self.validator.validate_directory('mvol-0004-1930-0103', 'ALTO'),
+            [
+                'mvol-0004-1930-0103/ALTO/mvol-0004-1930-0103_00000002.xml problem: not well-formed at line 1, column 7.\n',
+                'mvol-0004-1930-0103/ALTO/mvol-0004-1930-0103_00000004.xml problem: not well-formed at line 1, column 7.\n'
+            ]
+        )
+
+
+class TestTiffStructure(MvolTestCase):
+    def test_check_tiff_structure(self):
+        """reads size and compression from the header, and catches
+        truncation anywhere in the file."""
+        with io.BytesIO() as f:
+            Image.new('RGB', (640, 480)).save(f, format='TIFF', compression='tiff_lzw')
+            data = f.getvalue()
+        self.assertEqual(
+            TiffInfo(640, 480, 5, 1),
+            DigitalCollectionValidator._check_tiff_structure(io.BytesIO(data))
+        )
+        for length in (len(data) - 1, len(data) // 2, 6, 0):
+            with self.assertRaises(ValueError):
+                DigitalCollectionValidator._check_tiff_structure(io.BytesIO(data[:length]))
+
+    def test_truncated_tiff(self):
+        tif_file = os.path.join(self.mmdd_path, 'TIFF', 'mvol-0004-1930-0103_00000002.tif')
+        Image.new('L', (100, 100)).save(tif_file, format='TIFF')
+        with open(tif_file, 'r+b') as f:
+            f.truncate(os.path.getsize(tif_file) - 1)
+        self.assertEqual(
+            ['mvol-0004-1930-0103/TIFF/mvol-0004-1930-0103_00000002.tif problem: strip 0 runs past the end of the file.\n'],
+            self.validator.validate_tiff_directory('mvol-0004-1930-0103')
+        )
+        info = self.validator.get_tiff_info('mvol-0004-1930-0103')
+        self.assertEqual(TiffInfo(8, 8, 1, 1), info['mvol-0004-1930-0103_00000001.tif'])
+        self.assertEqual('strip 0 runs past the end of the file', info['mvol-0004-1930-0103_00000002.tif'])
+
+
+class TestPdfStructure(MvolTestCase):
+    def test_check_pdf_structure(self):
+        with open('testdocs/mini-sueto.pdf', 'rb') as f:
+            self.assertEqual(
+                PdfInfo('1.5', 2),
+                DigitalCollectionValidator._check_pdf_structure(f)
+            )
+            f.seek(0)
+            data = f.read()
+        with self.assertRaises(ValueError):
+            DigitalCollectionValidator._check_pdf_structure(io.BytesIO(data[:-100]))
+        # point the xref entry for the catalog somewhere else.
+        entry = re.compile(rb'\d{10} 00000 n').search(data, data.rindex(b'xref', 0, data.rindex(b'startxref'))).start()
+        damaged = data[:entry] + b'0000000001' + data[entry + 10:]
+        with self.assertRaises(ValueError):
+            DigitalCollectionValidator._check_pdf_structure(io.BytesIO(damaged))
+
+    def test_large_page_tree(self):
+        """a page tree whose /Kids array comes before /Count, as
+        Ghostscript writes it, is read past the first window."""
+        kids = b' '.join(b'%d 0 R' % n for n in range(3, 703))
+        objects = [
+            b'<< /Type /Catalog /Pages 2 0 R >>',
+            b'<< /Type /Pages /Kids [' + kids + b'] /Count 700 >>'
+        ]
+        data = b'%PDF-1.4\n'
+        offsets = []
+        for number, o in enumerate(objects, 1):
+            offsets.append(len(data))
+            data += b'%d 0 obj\n' % number + o + b'\nendobj\n'
+        xref_offset = len(data)
+        data += b'xref\n0 3\n0000000000 65535 f \n' + b''.join(
+            b'%010d 00000 n \n' % offset for offset in offsets
+        ) + b'trailer\n<< /Size 3 /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % xref_offset
+        self.assertGreater(len(objects[1]), PDF_OBJECT_WINDOW_SIZE)
+        self.assertEqual(
+            PdfInfo('1.4', 700),
+            DigitalCollectionValidator._check_pdf_structure(io.BytesIO(data))
+        )
+
+    def test_xref_stream(self):
+        """PDF 1.5 xref streams with PNG predictors and object streams."""
+        o1 = b'<< /Type /Catalog /Pages 2 0 R >>'
+        o2 = b'<< /Type /Pages /Kids [] /Count 7 >>'
+        header = '1 0 2 {} '.format(len(o1)).encode()
+        body = zlib.compress(header + o1 + o2)
+        data = b'%PDF-1.5\n'
+        objstm_offset = len(data)
+        data += '3 0 obj\n<< /Type /ObjStm /N 2 /First {} /Filter /FlateDecode /Length {} >>\nstream\n'.format(
+            len(header), len(body)
+        ).encode() + body + b'\nendstream\nendobj\n'
+        xref_offset = len(data)
+        rows = [(0, 0, 255), (2, 3, 0), (2, 3, 1), (1, objstm_offset, 0), (1, xref_offset, 0)]
+        raw = b''
+        previous = bytes(4)
+        for t, f2, f3 in rows:
+            row = bytes([t]) + f2.to_bytes(2, 'big') + bytes([f3])
+            raw += b'\x02' + bytes((a - b) & 0xff for a, b in zip(row, previous))
+            previous = row
+        body = zlib.compress(raw)
+        data += '4 0 obj\n<< /Type /XRef /Size 5 /W [1 2 1] /Root 1 0 R /Filter /FlateDecode /DecodeParms << /Predictor 12 /Columns 4 >> /Length {} >>\nstream\n'.format(
+            len(body)
+        ).encode() + body + '\nendstream\nendobj\nstartxref\n{}\n%%EOF\n'.format(xref_offset).encode()
+        self.assertEqual(
+            PdfInfo('1.5', 7),
+            DigitalCollectionValidator._check_pdf_structure(io.BytesIO(data))
+        )
+
+    def test_validate_pdf(self):
+        self.assertEqual([], self.validator.validate_pdf('mvol-0004-1930-0103'))
+        os.remove(os.path.join(self.mmdd_path, 'TIFF', 'mvol-0004-1930-0103_00000003.tif'))
+        self.assertEqual(
+            ['mvol-0004-1930-0103 pdf has 3 pages, but there are 2 TIFFs.\n'],
+            self.validator.validate_pdf('mvol-0004-1930-0103')
+        )
+        pdf_file = os.path.join(self.mmdd_path, 'mvol-0004-1930-0103.pdf')
+        with open(pdf_file, 'r+b') as f:
+            f.truncate(os.path.getsize(pdf_file) // 2)
+        self.assertEqual(
+            ['mvol-0004-1930-0103 pdf problem: startxref missing.\n'],
+            self.validator.validate_pdf('mvol-0004-1930-0103')
+        )
+
+
+class TestDcXmlFiles(MvolTestCase):
+    issues = ('mvol-0004-1930-0103', 'mvol-0004-1930-0104', 'mvol-0004-1930-0105')
+    pages = 1
+
+    def test_validate_dc_xml_files(self):
+        with open(os.path.join(self.mmdd_paths['mvol-0004-1930-0104'], 'mvol-0004-1930-0104.dc.xml'), 'w') as f:
+            f.write('<metadata>')
+        with open(os.path.join(self.mmdd_paths['mvol-0004-1930-0105'], 'mvol-0004-1930-0105.dc.xml'), 'w') as f:
+            f.write('<metadata xmlns:dc="http://purl.org/dc/elements/1.1/"><dc:title>test</dc:title><dc:date>1930-13-05</dc:date>'
+                    '<dc:description>test</dc:description></metadata>')
+        self.assertEqual(
+            [
+                ('mvol-0004-1930-0103', []),
+                ('mvol-0004-1930-0104', ['mvol-0004-1930-0104 dc.xml not well-formed\n']),
+                ('mvol-0004-1930-0105', [
+                    'mvol-0004-1930-0105 dc.xml does not contain a single dc:identifier element\n',
+                    'mvol-0004-1930-0105 dc.xml has an incorrect month field\n'
+                ])
+            ],
+            self.validator.validate_dc_xml_files('mvol-0004-1930')
+        )
+
+
+class TestBenchmarkCollection(MvolTestCase):
+    issues = ()
+
+    def setUp(self):
+        super().setUp()
+        self.identifiers = synthetic.generate_collection(self.root, scale=2, page_size=16)
+
+    def test_generated_collection_is_valid(self):
+        """the synthetic collection passes validation, so benchmarks time
+        the same work as on real data."""
+        local_root = self.root + '/'
+        self.assertEqual(sorted(self.identifiers['mvol']), self.validator.get_identifiers('mvol'))
+        for cls, project in ((MvolValidator, 'mvol'), (ChopinValidator, 'chopin'), (GmsValidator, 'gms')):
+            validator = cls()
+            validator.set_local_root(local_root)
+            for identifier in self.identifiers[project]:
+                self.assertEqual([], validator.validate(identifier), identifier)
+
+    def test_compare_to_baseline(self):
+        results = {'a': {'min': 1.0}, 'b': {'min': 2.0}, 'c': {'min': 0.0002}}
+        baseline = {'a': {'min': 0.9}, 'b': {'min': 1.0}, 'c': {'min': 0.0001}}
+        self.assertEqual(
+            [('a', 1.0, 0.9, False), ('b', 2.0, 1.0, True), ('c', 0.0002, 0.0001, False)],
+            benchmark.compare_to_baseline(results, baseline, 0.25)
+        )
+
+
+class TestProfiling(MvolTestCase):
+    issues = ('mvol-0004-1930-0103', 'mvol-0004-1930-0104')
+
+    def setUp(self):
+        super().setUp()
+        self.identifiers = list(self.issues)
+        self.validator.enable_profiling()
+
+    def test_profile_checks(self):
+        """each check is recorded, and totals include I/O pool threads."""
+        self.validator.validate('mvol-0004-1930-0103')
+        records = dict((r['check'], r) for r in self.validator.profile)
+        self.assertEqual(
+            ['get_directory_snapshot', 'validate_alto_or_pos_directory',
+             'validate_tiff_directory', 'validate_pdf', 'validate_struct_txt',
+             'validate_txt', 'validate_dc_xml', 'validate_allowable_files_only',
+             'validate'],
+            [r['check'] for r in self.validator.profile]
+        )
+        self.assertEqual(3, records['validate_alto_or_pos_directory']['files'])
+        self.assertEqual(1, records['validate_pdf']['files'])
+        self.assertEqual(
+            sum(r['files'] for r in self.validator.profile[:-1]),
+            records['validate']['files']
+        )
+        if os.path.exists(PROC_IO_PATH):
+            self.assertGreater(records['validate_alto_or_pos_directory']['bytes_read'], 0)
+            self.assertGreater(records['validate_alto_or_pos_directory']['read_write_syscalls'], 0)
+
+    def test_profile_from_worker_processes(self):
+        results = list(self.validator.validate_identifiers(self.identifiers, jobs=2, processes=True))
+        self.assertEqual([(i, []) for i in self.identifiers], results)
+        self.assertEqual(
+            self.identifiers,
+            [r['identifier'] for r in self.validator.profile if r['check'] == 'validate']
+        )
+
+    def test_write_profile(self):
+        self.validator.validate('mvol-0004-1930-0103')
+        with io.StringIO() as f:
+            write_profile_jsonl(self.validator.profile, f)
+            lines = f.getvalue().splitlines()
+        self.assertEqual(9, len(lines))
+        self.assertEqual('get_directory_snapshot', json.loads(lines[0])['check'])
+        path = os.path.join(self.tmp.name, 'mvol.prom')
+        write_profile_prometheus(self.validator.profile, path)
+        with open(path) as f:
+            prom = f.read()
+        self.assertIn('# TYPE dcv_check_runs gauge\n', prom)
+        self.assertIn('dcv_check_runs{check="validate_pdf"} 1\n', prom)
+        self.assertIn('dcv_check_files{check="validate_pdf"} 1\n', prom)
+
+
+class TestHierarchySchema(MvolTestCase):
+    issues = ()
+
+    def setUp(self):
+        super().setUp()
+        db_path = os.path.join(self.tmp.name, 'validation_test.db')
+        shutil.copy('testdocs/validation_test.db', db_path)
+        self.validator.connect_to_db(db_path)
+        self.addCleanup(self.validator.conn.close)
+        self.validator.upgrade_db()
+        self.legacy = DigitalCollectionValidator()
+        self.legacy.connect_to_db('testdocs/validation_test.db')
+        self.addCleanup(self.legacy.conn.close)
+
+    def test_indexed_queries_match_legacy_queries(self):
+        for chunk in ('mvol', 'mvol-0005', 'mvol-0005-0003', 'mvol-0005-0003-0002', 'mvol-0006'):
+            for valid_only in (True, False):
+                self.assertEqual(
+                    self.legacy.get_identifiers_from_db(chunk, valid_only),
+                    self.validator.get_identifiers_from_db(chunk, valid_only)
+                )
+            self.assertEqual(
+                self.legacy.get_identifier_chunk_children_from_db(chunk),
+                self.validator.get_identifier_chunk_children_from_db(chunk)
+            )
+
+    def test_summary(self):
+        self.assertEqual(
+            [('mvol-0005', 17, 15, 2)],
+            self.validator.get_identifier_chunk_summary_from_db('mvol')
+        )
+        self.assertEqual(
+            ('mvol-0005-0003', 6, 4, 2),
+            self.validator.get_identifier_chunk_summary_from_db('mvol-0005')[2]
+        )
+
+    def test_trigger_fills_in_new_rows(self):
+        self.validator.conn.execute(
+            'INSERT INTO validation (identifier, validation) VALUES (?, 1)',
+            ('mvol-0004-1930-0103-01',)
+        )
+        self.assertEqual(
+            ('mvol', '0004', '1930', '0103', '01', 5),
+            self.validator.conn.execute(
+                'SELECT project, level1, level2, level3, level4, depth FROM validation WHERE identifier = ?',
+                ('mvol-0004-1930-0103-01',)
+            ).fetchone()
+        )
+        self.assertEqual(
+            ['mvol-0004-1930-0103'],
+            self.validator.get_identifier_chunk_children_from_db('mvol-0004-1930')
+        )
+
+
+class TestRecordValidationResults(MvolTestCase):
+    issues = ()
+
+    def setUp(self):
+        super().setUp()
+        self.db_path = os.path.join(self.tmp.name, 'validation.db')
+        self.validator.connect_to_db(self.db_path)
+        self.addCleanup(self.validator.conn.close)
+        self.validator.conn.execute(LEGACY_VALIDATION_TABLE)
+        self.validator.conn.executemany(
+            'INSERT INTO validation (identifier, validation, validation_date) VALUES (?, ?, ?)',
+            [('mvol-0004-1930-0101', 0, '2020-01-01'),
+             ('mvol-0004-1930-0101', 1, '2021-01-01'),
+             ('mvol-0004-1930-0101', 0, '2019-01-01')]
+        )
+        self.validator.conn.commit()
+        self.validator.upgrade_db()
+
+    def test_upgrade_keeps_newest_row(self):
+        self.assertEqual(
+            [('mvol-0004-1930-0101', 1, '2021-01-01')],
+            self.validator.conn.execute('SELECT identifier, validation, validation_date FROM validation').fetchall()
+        )
+        self.assertEqual(
+            'wal',
+            self.validator.conn.execute('PRAGMA journal_mode').fetchone()[0]
+        )
+        # NORMAL
+        self.assertEqual(1, self.validator.conn.execute('PRAGMA synchronous').fetchone()[0])
+
+    def test_synchronous_only_relaxed_under_wal(self):
+        """databases that were never upgraded keep full syncing."""
+        validator = MvolValidator()
+        validator.connect_to_db(os.path.join(self.tmp.name, 'rollback.db'))
+        try:
+            # FULL
+            self.assertEqual(2, validator.conn.execute('PRAGMA synchronous').fetchone()[0])
+        finally:
+            validator.conn.close()
+        validator.connect_to_db(self.db_path)
+        try:
+            self.assertEqual(1, validator.conn.execute('PRAGMA synchronous').fetchone()[0])
+        finally:
+            validator.conn.close()
+
+    def test_record_validation_results(self):
+        results = [
+            ('mvol-0004-1930-0101', []),
+            ('mvol-0004-1930-0102', ['mvol-0004-1930-0102 pdf missing.\n']),
+            ('mvol-0004-1930-0103', []),
+            ('mvol-0004-1930-0104', []),
+            ('mvol-0004-1930-0105', [])
+        ]
+        self.assertEqual(5, self.validator.record_validation_results(
+            results,
+            '2022-01-01T00:00:00',
+            {'mvol-0004-1930-0103': (0, 12)},
+            batch_size=2
+        ))
+        self.assertEqual(5, self.validator.record_validation_results(
+            results[1:] + [('mvol-0004-1930-0101', ['mvol-0004-1930-0101 txt missing.\n'])],
+            '2022-01-02T00:00:00'
+        ))
+        self.assertEqual(
+            [('mvol-0004-1930', 5, 3, 2)],
+            self.validator.get_identifier_chunk_summary_from_db('mvol-0004')
+        )
+        self.assertEqual(
+            ('mvol-0004-1930-0101 txt missing.\n', '2022-01-02T00:00:00', None, '1930'),
+            self.validator.conn.execute(
+                'SELECT validation_errors, validation_date, entry_count, level2 FROM validation WHERE identifier = ?',
+                ('mvol-0004-1930-0101',)
+            ).fetchone()
+        )
+
+    def test_readers_and_writers_during_a_write(self):
+        """readers don't block behind a write, and writers wait their turn."""
+        writer = MvolValidator()
+        writer.connect_to_db(self.db_path)
+        writer.conn.execute('BEGIN IMMEDIATE')
+        writer.conn.execute(
+            'INSERT INTO validation (identifier, validation) VALUES (?, 1)',
+            ('mvol-0004-1930-0102',)
+        )
+        self.assertEqual(
+            ['mvol-0004-1930-0101'],
+            self.validator.get_identifiers_from_db('mvol-0004')
+        )
+
+        def record():
+            other = MvolValidator()
+            other.connect_to_db(self.db_path)
+            other.record_validation_results([('mvol-0004-1930-0103', [])])
+            other.conn.close()
+        thread = threading.Thread(target=record)
+        thread.start()
+        time.sleep(0.2)
+        writer.conn.commit()
+        thread.join()
+        self.assertEqual(
+            ['mvol-0004-1930-0101', 'mvol-0004-1930-0102', 'mvol-0004-1930-0103'],
+            self.validator.get_identifiers_from_db('mvol-0004')
+        )
+        writer.conn.close()
+
+
+class TestWatch(MvolTestCase):
+    def setUp(self):
+        super().setUp()
+        self.connect_to_db()
+
+    def watch(self, changes, expected, reconcile_interval=600):
+        """Watch mvol-0004, make changes once the first round of validation
+        is done, and collect rounds until every expected identifier has been
+        validated again. Rounds are counted rather than timed, so a slow
+        machine only makes this slower; stop is a safety net."""
+        stop = threading.Event()
+        watchdog = threading.Timer(60, stop.set)
+        watchdog.start()
+        try:
+            watch = self.validator.watch(['mvol-0004'], debounce=0.3, reconcile_interval=reconcile_interval, stop=stop)
+            # the first round catches up with identifiers that were never
+            # validated.
+            rounds = [next(watch)]
+            changes()
+            validated = set()
+            for results in watch:
+                rounds.append(results)
+                validated.update(identifier for identifier, errors in results)
+                if validated >= set(expected):
+                    break
+            watch.close()
+        finally:
+            watchdog.cancel()
+        return rounds
+
+    def test_revalidate_on_change(self):
+        def changes():
+            # a burst of changes to one issue, and a new issue.
+            for p in range(3):
+                os.remove(os.path.join(self.mmdd_path, 'ALTO', 'mvol-0004-1930-0103_{}.xml'.format(str(p + 1).zfill(8))))
+            make_mvol_issue(self.root, 'mvol-0004-1930-0104')
+
+        rounds = self.watch(changes, ['mvol-0004-1930-0103', 'mvol-0004-1930-0104'])
+        self.assertEqual([[('mvol-0004-1930-0103', [])]], rounds[:1])
+        # each identifier is validated once after its changes settle.
+        later = sorted(r for results in rounds[1:] for r in results)
+        self.assertEqual(
+            ['mvol-0004-1930-0103', 'mvol-0004-1930-0104'],
+            [identifier for identifier, errors in later]
+        )
+        self.assertNotEqual([], later[0][1])
+        self.assertEqual([], later[1][1])
+        self.assertEqual(
+            [('mvol-0004-1930-0103', 0), ('mvol-0004-1930-0104', 1)],
+            self.validator.conn.execute('SELECT identifier, validation FROM validation ORDER BY identifier').fetchall()
+        )
+
+    def test_removed_identifier(self):
+        """results for an issue that was removed are deleted."""
+        def changes():
+            shutil.rmtree(self.mmdd_path)
+            make_mvol_issue(self.root, 'mvol-0004-1930-0104')
+
+        self.watch(changes, ['mvol-0004-1930-0104'])
+        self.assertEqual(
+            [('mvol-0004-1930-0104', 1)],
+            self.validator.conn.execute('SELECT identifier, validation FROM validation ORDER BY identifier').fetchall()
+        )
+
+    def test_reconcile_without_events(self):
+        """changes are found by rescanning when inotify isn't available."""
+        def changes():
+            path = os.path.join(self.mmdd_path, 'mvol-0004-1930-0103.txt')
+            with open(path, 'w') as f:
+                f.write('')
+            # file times are coarser than the clock, so make sure this
+            # change is newer than the first round of validation.
+            later = time.time() + 1
+            os.utime(path, (later, later))
+
+        with unittest.mock.patch('digital_collection_validators.classes._Inotify', side_effect=OSError):
+            with unittest.mock.patch('sys.stderr'):
+                rounds = self.watch(changes, ['mvol-0004-1930-0103'], reconcile_interval=0.5)
+        self.assertEqual(
+            ['mvol-0004-1930-0103.txt is an empty file.\n'],
+            rounds[-1][0][1]
+        )
+
+
+class TestSentinelQueue(MvolTestCase):
+    issues = ('mvol-0004-1930-0103', 'mvol-0004-1930-0104', 'mvol-0004-1930-0105')
+    subdirectory = 'IIIF_Files'
+
+    def setUp(self):
+        super().setUp()
+        self.identifiers = list(self.issues)
+        os.remove(os.path.join(self.mmdd_paths['mvol-0004-1930-0104'], 'mvol-0004-1930-0104.txt'))
+
+    def get_sentinels(self):
+        return dict(
+            (i, sorted(n for n in os.listdir(p) if n in ('ready', 'queue', 'valid', 'invalid')))
+            for i, p in self.mmdd_paths.items()
+        )
+
+    def test_process_ready_identifiers(self):
+        for identifier in self.identifiers[:2]:
+            Path(self.mmdd_paths[identifier], 'ready').touch()
+        results = list(SentinelQueue(self.validator, jobs=2).process(['mvol-0004'], once=True))
+        self.assertEqual(self.identifiers[:2], sorted(i for i, errors in results))
+        self.assertEqual(
+            {'mvol-0004-1930-0103': ['valid'], 'mvol-0004-1930-0104': ['invalid'], 'mvol-0004-1930-0105': []},
+            self.get_sentinels()
+        )
+        with open(os.path.join(self.mmdd_paths['mvol-0004-1930-0104'], 'invalid')) as f:
+            self.assertEqual(''.join(dict(results)['mvol-0004-1930-0104']), f.read())
+
+    def test_queued_results_are_current(self):
+        """results recorded with their state, as mvol queue does, aren't
+        validated again by an incremental run."""
+        self.connect_to_db()
+        Path(self.mmdd_paths['mvol-0004-1930-0103'], 'ready').touch()
+        for identifier, errors in SentinelQueue(self.validator).process(['mvol-0004'], once=True):
+            self.validator.record_validation_results(
+                [(identifier, errors)],
+                states={identifier: self.validator.get_identifier_state(identifier)}
+            )
+        # sentinels touched afterwards, e.g. by a lease renewal, don't count.
+        later = time.time() + 60
+        os.utime(os.path.join(self.mmdd_paths['mvol-0004-1930-0103'], 'valid'), (later, later))
+        self.assertEqual(
+            {},
+            self.validator.get_changed_identifiers(['mvol-0004-1930-0103'], check_count=True)
+        )
+
+    def test_expired_lease_returns_to_queue(self):
+        """an identifier left in the queue by a crashed scheduler is picked
+        up again once its lease expires, but not before."""
+        queue_path = os.path.join(self.mmdd_paths['mvol-0004-1930-0103'], 'queue')
+        Path(queue_path).touch()
+        sentinel_queue = SentinelQueue(self.validator, lease_timeout=60)
+        self.assertEqual([], list(sentinel_queue.process(['mvol-0004'], once=True)))
+        os.utime(queue_path, (time.time() - 120, time.time() - 120))
+        self.assertEqual(
+            [('mvol-0004-1930-0103', [])],
+            list(sentinel_queue.process(['mvol-0004'], once=True))
+        )
+        self.assertEqual(['valid'], self.get_sentinels()['mvol-0004-1930-0103'])
+
+    def test_claim_refuses_to_replace_queue(self):
+        """an identifier marked ready again while another scheduler holds
+        its lease is not claimed a second time."""
+        mmdd_path = self.mmdd_paths['mvol-0004-1930-0103']
+        oc = LocalWebDAVStandIn(self.tmp.name)
+        for store in (LocalSentinelStore(self.validator), sentinelutility.WebDAVSentinelStore(oc)):
+            Path(mmdd_path, 'queue').touch()
+            Path(mmdd_path, 'ready').touch()
+            self.assertEqual([], SentinelQueue(self.validator, store).claim(self.identifiers))
+            self.assertEqual(['queue', 'ready'], self.get_sentinels()['mvol-0004-1930-0103'])
+            os.remove(os.path.join(mmdd_path, 'queue'))
+            os.remove(os.path.join(mmdd_path, 'ready'))
+
+    def test_webdav_store(self):
+        Path(self.mmdd_paths['mvol-0004-1930-0104'], 'ready').touch()
+        Path(self.mmdd_paths['mvol-0004-1930-0105'], 'valid').touch()
+        oc = LocalWebDAVStandIn(self.tmp.name)
+        store = sentinelutility.WebDAVSentinelStore(oc)
+        results = list(SentinelQueue(self.validator, store).process(['mvol-0004'], once=True))
+        self.assertEqual(['mvol-0004-1930-0104'], [i for i, errors in results])
+        self.assertEqual(
+            {'mvol-0004-1930-0103': [], 'mvol-0004-1930-0104': ['invalid'], 'mvol-0004-1930-0105': ['valid']},
+            self.get_sentinels()
+        )
+        self.assertIn(
+            ('MOVE', '/IIIF_Files/mvol/0004/1930/0104/ready', '/IIIF_Files/mvol/0004/1930/0104/queue'),
+            oc.requests
+        )
+
+
+class TestSFTPFilesystem(MvolTestCase):
+    def setUp(self):
+        super().setUp()
+        self.remote = self.connect_locally(MvolValidator())
+        self.remote.set_local_root(self.root)
+        self.ftp = self.remote.ftp
+
+    def test_workers_get_no_secrets(self):
+        """validators copied into worker processes reconnect without the
+        password."""
+        self.remote.ssh_connection = ('localhost', {'username': 'xtf', 'password': 'secret'})
+        self.assertEqual(
+            ('localhost', {'username': 'xtf'}),
+            self.remote.__getstate__()['ssh_connection']
+        )
+        self.assertNotIn('ftp', self.remote.__getstate__())
+
+    def test_listdir_attr_many(self):
+        paths = [os.path.join(self.mmdd_path, d) for d in ('TIFF', 'ALTO')]
+        self.assertEqual(
+            [sorted(os.listdir(p)) for p in paths],
+            [sorted(a.filename for a in l) for l in self.ftp.listdir_attr_many(paths)]
+        )
+
+    def test_open_holds_channel(self):
+        with self.ftp.open(os.path.join(self.mmdd_path, 'mvol-0004-1930-0103.txt')) as f:
+            self.assertEqual(7, self.ftp.channels.qsize())
+            self.assertEqual('text', f.read())
+        self.assertEqual(8, self.ftp.channels.qsize())
+
+    def test_validate_over_sftp(self):
+        """validation gives the same results over SFTP."""
+        os.remove(os.path.join(self.mmdd_path, 'TIFF', 'mvol-0004-1930-0103_00000002.tif'))
+        self.assertEqual(
+            ['mvol-0004-1930-0103 pdf has 3 pages, but there are 2 TIFFs.\n',
+             'file count mismatch in mvol-0004-1930-0103\n'],
+            self.remote.validate('mvol-0004-1930-0103')
+        )
+        self.assertEqual(
+            self.validator.validate('mvol-0004-1930-0103'),
+            self.remote.validate('mvol-0004-1930-0103')
+        )
+        self.assertEqual(8, self.ftp.channels.qsize())
+
+    def test_validate_xtf_chunk(self):
+        """an XTF chunk is validated from an inventory, listing nothing over
+        SFTP but the bookreader directory, and the inventory is dropped
+        afterwards."""
+        os.remove(os.path.join(self.mmdd_path, 'TIFF', 'mvol-0004-1930-0103_00000002.tif'))
+        # XTF keeps every identifier's directory side by side.
+        bookreader = os.path.join(self.tmp.name, 'bookreader')
+        os.mkdir(bookreader)
+        shutil.copytree(self.mmdd_path, os.path.join(bookreader, 'mvol-0004-1930-0103'))
+        os.mkdir(os.path.join(bookreader, 'mvol-0005-1930-0101'))
+        xtf = XTFValidator(True)
+        xtf.get_path = lambda identifier: os.path.join(bookreader, identifier)
+        xtf.ftp = self.ftp
+        with unittest.mock.patch.object(self.ftp, 'listdir_attr', wraps=self.ftp.listdir_attr) as listdir_attr, \
+             unittest.mock.patch.object(self.ftp, 'listdir_attr_many', side_effect=AssertionError):
+            self.assertEqual(
+                [('mvol-0004-1930-0103', self.validator.validate('mvol-0004-1930-0103'))],
+                list(xtf.validate_chunk('mvol-0004'))
+            )
+        listdir_attr.assert_called_once_with(bookreader)
+        self.assertEqual({}, xtf.inventory)
+        self.assertEqual(
+            self.validator.get_directory_snapshot('mvol-0004-1930-0103').entries,
+            xtf.get_directory_snapshot('mvol-0004-1930-0103').entries
+        )
+
+    def test_get_newest_modification_times(self):
+        """the SFTP walk, the remote find and a local walk agree."""
+        os.utime(os.path.join(self.mmdd_path, 'ALTO', 'mvol-0004-1930-0103_00000002.xml'), (2000000000, 2000000000))
+        os.makedirs(os.path.join(self.tmp.name, 'mvol', '0004', '1930', '0104'))
+        identifiers = ['mvol-0004-1930-0103', 'mvol-0004-1930-0104', 'mvol-0004-1930-0105']
+        expected = {
+            'mvol-0004-1930-0103': 2000000000,
+            'mvol-0004-1930-0104': 0,
+            'mvol-0004-1930-0105': None
+        }
+        self.assertEqual(expected, self.validator.get_newest_modification_times(identifiers))
+        self.assertEqual(expected, self.remote.get_newest_modification_times(identifiers))
+        self.assertEqual(expected, self.remote.get_newest_modification_times(identifiers, use_find=True))
+        with self.assertRaises(FileNotFoundError):
+            self.remote.get_newest_modification_time('mvol-0004-1930-0105')
+
+
+class TestSentinelUtility(MvolTestCase):
+    issues = ()
+
+    def setUp(self):
+        super().setUp()
+        self.mmdd_directories = []
+        for identifier in ('mvol-0004-1930-0103', 'mvol-0004-1930-0104',
+                           'mvol-0004-1931-0101', 'mvol-0005-1930-0101'):
+            mmdd_path = os.path.join(self.tmp.name, 'IIIF_Files', *identifier.split('-'))
+            os.makedirs(os.path.join(mmdd_path, 'TIFF'))
+            Path(mmdd_path, 'TIFF', '{}_00000001.tif'.format(identifier)).touch()
+            self.mmdd_directories.append('/IIIF_Files/{}/'.format(identifier.replace('-', '/')))
+
+    def test_mmdd_directories_depth_infinity(self):
+        """the whole tree is found with one request when the server allows
+        it, even with empty directories in it."""
+        os.makedirs(os.path.join(self.tmp.name, 'IIIF_Files', 'mvol', '0004', '1930', '0103', 'POS'))
+        oc = LocalWebDAVStandIn(self.tmp.name)
+        self.assertEqual(
+            self.mmdd_directories,
+            sentinelutility.get_mvol_mmdd_directories(oc, 'IIIF_Files/mvol')
+        )
+        self.assertEqual(1, len(oc.requests))
+        self.assertEqual(
+            self.mmdd_directories[:2],
+            sentinelutility.get_mvol_mmdd_directories(oc, 'IIIF_Files/mvol/0004/1930')
+        )
+
+    def test_mmdd_directories_fallback_walk(self):
+        """the tree is walked a level at a time when depth infinity is
+        refused, or answered with a single level."""
+        oc = LocalWebDAVStandIn(self.tmp.name, shallow_infinity=True)
+        self.assertEqual(
+            self.mmdd_directories,
+            sentinelutility.get_mvol_mmdd_directories(oc, 'IIIF_Files/mvol', workers=4)
+        )
+        oc = LocalWebDAVStandIn(self.tmp.name, allow_infinity=False)
+        self.assertEqual(
+            self.mmdd_directories,
+            sentinelutility.get_mvol_mmdd_directories(oc, 'IIIF_Files/mvol', workers=4)
+        )
+        # mvol, two projects and three years; mmdd directories aren't listed.
+        self.assertEqual(6, len([r for r in oc.requests if r[2] == 1]))
+        self.assertEqual(
+            ['/IIIF_Files/mvol/0004/1930/0103'],
+            list(sentinelutility.iter_mvol_mmdd_directories(oc, '/IIIF_Files/mvol/0004/1930/0103'))
+        )
+
+    def add_sentinels(self, sentinels):
+        for mmdd, names in sentinels.items():
+            for name in names:
+                Path(self.tmp.name, mmdd.strip('/'), name).touch()
+
+    def test_sentinel_names_match(self):
+        """the script's copy of the sentinel names stays in step."""
+        self.assertEqual(SENTINEL_NAMES, sentinelutility.SENTINEL_NAMES)
+
+    def test_sentinel_files_from_listing(self):
+        """sentinel state comes from the listing, not a request per file."""
+        self.add_sentinels({'/IIIF_Files/mvol/0004/1930/0103': ('ready', 'valid')})
+        oc = LocalWebDAVStandIn(self.tmp.name)
+        sentinels = sentinelutility.get_sentinel_files(
+            oc,
+            oc._file_info('/IIIF_Files/mvol/0004/1930/0103/')
+        )
+        self.assertEqual(['ready', 'valid'], sorted(s.get_name() for s in sentinels))
+        self.assertEqual(1, len(oc.requests))
+
+    def test_sentinel_map(self):
+        self.add_sentinels({
+            '/IIIF_Files/mvol/0004/1930/0103': ('ready', 'valid'),
+            '/IIIF_Files/mvol/0005/1930/0101': ('queue',)
+        })
+        expected = {
+            '/IIIF_Files/mvol/0004/1930/0103': set(['ready', 'valid']),
+            '/IIIF_Files/mvol/0004/1930/0104': set(),
+            '/IIIF_Files/mvol/0004/1931/0101': set(),
+            '/IIIF_Files/mvol/0005/1930/0101': set(['queue'])
+        }
+        oc = LocalWebDAVStandIn(self.tmp.name)
+        self.assertEqual(expected, sentinelutility.get_sentinel_map(oc, 'IIIF_Files/mvol'))
+        self.assertEqual(1, len(oc.requests))
+
+        # without depth infinity, each mmdd directory is listed once.
+        oc = LocalWebDAVStandIn(self.tmp.name, allow_infinity=False)
+        self.assertEqual(expected, sentinelutility.get_sentinel_map(oc, 'IIIF_Files/mvol'))
+        self.assertEqual(6 + 4, len([r for r in oc.requests if r[2] == 1]))
+        self.assertEqual(0, len([r for r in oc.requests if r[2] == 0]))
+        self.assertEqual(1, len([r for r in oc.requests if r[2] == 'infinity']))
+
+    def test_runutil_fix(self):
+        self.add_sentinels({'/IIIF_Files/mvol/0004/1930/0103': ('ready', 'valid')})
+        oc = LocalWebDAVStandIn(self.tmp.name)
+        sentinel_map = sentinelutility.get_sentinel_map(oc, 'IIIF_Files/mvol')
+        for p in sorted(sentinel_map):
+            sentinelutility.runutil(oc, owncloud.FileInfo(p + '/', 'dir'), 'fix', sentinel_map[p])
+        self.assertEqual(
+            [('DELETE', '/IIIF_Files/mvol/0004/1930/0103/ready'),
+             ('DELETE', '/IIIF_Files/mvol/0004/1930/0103/valid')],
+            [r for r in oc.requests if r[0] == 'DELETE']
+        )
+        self.assertEqual(set(), sentinelutility.get_sentinel_map(oc, 'IIIF_Files/mvol')['/IIIF_Files/mvol/0004/1930/0103'])
+
+
+class TestSyncManifests(MvolTestCase):
+    issues = ('mvol-0004-1930-0103', 'mvol-0004-1930-0104')
+    subdirectory = 'IIIF_Files'
+
+    def setUp(self):
+        super().setUp()
+        Path(self.mmdd_path, 'valid').touch()
+
+    def test_diff_manifests(self):
+        source = [
+            ManifestEntry('a/1', 1, 100.0, None),
+            ManifestEntry('a/2', 1, 100.0, None),
+            ManifestEntry('a/3', 1, 100.0, 'x'),
+            ManifestEntry('b/1', 1, 100.0, None),
+            ManifestEntry('b/2', 1, 100.5, None)
+        ]
+        target = [
+            ManifestEntry('a/2', 2, 100.0, None),
+            ManifestEntry('a/3', 1, 100.0, 'y'),
+            ManifestEntry('a/4', 1, 100.0, None),
+            ManifestEntry('b/1', 1, 50.0, None),
+            ManifestEntry('b/2', 1, 100.0, None)
+        ]
+        self.assertEqual(
+            [('missing', 'a/1'), ('changed', 'a/2'), ('changed', 'a/3'),
+             ('extra', 'a/4'), ('changed', 'b/1')],
+            [(status, (s or t).path) for status, s, t in diff_manifests(source, target)]
+        )
+
+    def test_local_and_webdav_manifests_match(self):
+        """a WebDAV listing and a local walk of the same files are in sync."""
+        identifiers = ['mvol-0004-1930-0103', 'mvol-0004-1930-0104']
+        local = self.validator.get_manifest(identifiers)
+        oc = LocalWebDAVStandIn(self.tmp.name)
+        webdav = get_manifest_from_webdav(
+            oc.list('IIIF_Files/mvol', depth='infinity'),
+            ('ready', 'queue', 'valid', 'invalid')
+        )
+        # ten files per issue, and one sentinel.
+        self.assertEqual(21, len(local))
+        self.assertIn('mvol-0004-1930-0103/valid', [e.path for e in local])
+        self.assertNotIn('mvol-0004-1930-0103/valid', [e.path for e in webdav])
+        self.assertEqual(
+            [('extra', 'mvol-0004-1930-0103/valid')],
+            [(status, t.path) for status, s, t in diff_manifests(webdav, local)]
+        )
+
+    def test_owncloud_tree_for_an_issue(self):
+        """an issue is listed in full, even from a server that answers
+        depth infinity with a single level."""
+        for oc in (LocalWebDAVStandIn(self.tmp.name),
+                   LocalWebDAVStandIn(self.tmp.name, shallow_infinity=True)):
+            manifest = mvol_sync.get_owncloud_manifest(oc, 'mvol-0004-1930-0103')
+            self.assertEqual(10, len(manifest))
+            self.assertIn(
+                'mvol-0004-1930-0103/TIFF/mvol-0004-1930-0103_00000001.tif',
+                [e.path for e in manifest]
+            )
+
+    def test_copy_new_identifier_to_xtf(self):
+        """copying an identifier the XTF server doesn't have yet creates
+        its directory."""
+        target = os.path.join(self.tmp.name, 'bookreader')
+        os.mkdir(target)
+        xtf = self.connect_locally(XTFValidator(False))
+        xtf.get_path = lambda identifier: os.path.join(target, identifier)
+        oc = LocalWebDAVStandIn(self.tmp.name)
+        differences = list(diff_manifests(
+            mvol_sync.get_owncloud_manifest(oc, 'mvol-0004-1930-0103'),
+            []
+        ))
+        self.assertEqual(10, mvol_sync.copy_to_xtf(oc, xtf, differences))
+        self.assertEqual(
+            ['ALTO', 'TIFF', 'mvol-0004-1930-0103.dc.xml'],
+            sorted(os.listdir(os.path.join(target, 'mvol-0004-1930-0103')))[:3]
+        )
+        self.assertEqual(
+            3,
+            len(os.listdir(os.path.join(target, 'mvol-0004-1930-0103', 'TIFF')))
+        )
+
+    def test_remote_manifest_with_find(self):
+        """over SSH, the manifest comes from a single find command."""
+        identifiers = ['mvol-0004-1930-0103', 'mvol-0004-1930-0104']
+        local = self.validator.get_manifest(identifiers)
+        mmdd_path = self.mmdd_paths['mvol-0004-1930-0104']
+        os.remove(os.path.join(mmdd_path, 'TIFF', 'mvol-0004-1930-0104_00000002.tif'))
+        with open(os.path.join(mmdd_path, 'mvol-0004-1930-0104.txt'), 'a') as f:
+            f.write('more text')
+        remote = self.connect_locally(MvolValidator())
+        remote.set_local_root(self.root)
+        self.assertEqual(
+            [('missing', 'mvol-0004-1930-0104/TIFF/mvol-0004-1930-0104_00000002.tif'),
+             ('changed', 'mvol-0004-1930-0104/mvol-0004-1930-0104.txt')],
+            [(status, s.path) for status, s, t in diff_manifests(
+                local,
+                remote.get_manifest(identifiers + ['mvol-0004-1930-0105'])
+            )]
+        )
+
+
+class TestListDirectory(MvolTestCase):
+    issues = ()
+
+    def setUp(self):
+        super().setUp()
+        self.root = self.tmp.name + '/'
+        for chunk in ('speculum-0001', 'speculum-0002'):
+            for folder, extension in (('tif', 'tif'), ('ocr', 'ocr.txt')):
+                directory = os.path.join(self.root, 'speculum', chunk, folder)
+                os.makedirs(directory)
+                for page in ('001', '002'):
+                    open(os.path.join(directory, '{}-{}.{}'.format(chunk, page, extension)), 'w').close()
+            open(os.path.join(self.root, 'speculum', chunk, 'notes.txt'), 'w').close()
+
+    def test_list_directory(self):
+        """directories are listed concurrently, in sorted order."""
+        validator = DigitalCollectionValidator()
+        validator.set_local_root(self.root)
+        self.assertEqual(
+            ['speculum-0001-001.ocr.txt', 'speculum-0001-002.ocr.txt',
+             'speculum-0001-001.tif', 'speculum-0001-002.tif',
+             'speculum-0002-001.ocr.txt', 'speculum-0002-002.ocr.txt',
+             'speculum-0002-001.tif', 'speculum-0002-002.tif'],
+            validator.list_directory('speculum')
+        )
+        self.assertEqual(
+            ['speculum-0002-001.ocr.txt', 'speculum-0002-002.ocr.txt',
+             'speculum-0002-001.tif', 'speculum-0002-002.tif'],
+            validator.list_directory('speculum-0002')
+        )
+        self.assertEqual(
+            ['speculum-0002-002.tif'],
+            validator.list_directory('speculum-0002-002')
+        )
+
+
+class TestDigests(MvolTestCase):
+    def setUp(self):
+        super().setUp()
+        self.validator.connect_to_db(':memory:')
+        self.addCleanup(self.validator.conn.close)
+        self.hashed = []
+        get_file_digest_or_none = self.validator._get_file_digest_or_none
+
+        def record_file_digest_or_none(path):
+            self.hashed.append(path)
+            return get_file_digest_or_none(path)
+        self.validator._get_file_digest_or_none = record_file_digest_or_none
+
+    def test_only_changed_files_are_hashed(self):
+        txt = os.path.join(self.mmdd_path, 'mvol-0004-1930-0103.txt')
+        digests = self.validator.get_digests(['mvol-0004-1930-0103'])
+        self.assertEqual(10, len(digests))
+        self.assertEqual(10, len(self.hashed))
+        with open(txt, 'rb') as f:
+            self.assertEqual(hashlib.blake2b(f.read()).hexdigest(), digests[txt])
+
+        self.hashed = []
+        self.assertEqual(digests, self.validator.get_digests(['mvol-0004-1930-0103']))
+        self.assertEqual([], self.hashed)
+
+        with open(txt, 'a') as f:
+            f.write('more text')
+        os.remove(os.path.join(self.mmdd_path, 'ALTO', 'mvol-0004-1930-0103_00000001.xml'))
+        digests = self.validator.get_digests(['mvol-0004-1930-0103'])
+        self.assertEqual([txt], self.hashed)
+        self.assertEqual(9, len(digests))
+        self.assertEqual(
+            9,
+            self.validator.conn.execute('SELECT COUNT(*) FROM digest').fetchone()[0]
+        )
+
+    def test_audit_digests(self):
+        """a file that changed without its stat data changing is reported."""
+        txt = os.path.join(self.mmdd_path, 'mvol-0004-1930-0103.txt')
+        self.validator.get_digests(['mvol-0004-1930-0103'])
+        self.assertEqual([], self.validator.audit_digests(['mvol-0004-1930-0103']))
+        st = os.stat(txt)
+        with open(txt, 'r+b') as f:
+            f.write(b'TEXT')
+        os.utime(txt, ns=(st.st_atime_ns, st.st_mtime_ns))
+        self.assertEqual(
+            ['{} digest does not match the recorded digest.\n'.format(txt)],
+            self.validator.audit_digests(['mvol-0004-1930-0103'])
+        )
+
+    def test_remote_digests(self):
+        """after connect(), files are found with 'find' and read over SFTP."""
+        local_digests = self.validator.get_digests(['mvol-0004-1930-0103'])
+        remote = self.connect_locally(MvolValidator())
+        remote.set_local_root(self.root)
+        remote.connect_to_db(':memory:')
+        self.addCleanup(remote.conn.close)
+        self.assertEqual(local_digests, remote.get_digests(['mvol-0004-1930-0103']))
+        self.assertEqual([], remote.audit_digests(['mvol-0004-1930-0103']))
+        with unittest.mock.patch.object(remote, '_open', wraps=remote._open) as _open:
+            remote.get_digests(['mvol-0004-1930-0103'])
+        _open.assert_not_called()
+
+
+def convert_page_or_crash(page, **kwargs):
+    """Stands in for make_mvol_jpegs.convert_page(), killing the worker
+    process on the second page."""
+    if page[0].endswith('_00000002.tif'):
+        os._exit(1)
+    return _convert_page(page, **kwargs)
+
+_convert_page = make_mvol_jpegs.convert_page
+
+
+class TestMakeMvolJpegs(MvolTestCase):
+    def test_convert_pages(self):
+        """pages are converted in parallel, and reruns only convert what is
+        missing."""
+        pages = make_mvol_jpegs.get_pages(self.tmp.name, 'mvol-0004-1930-0103')
+        self.assertEqual(3, len(pages))
+        results = list(make_mvol_jpegs.convert_pages(pages, jobs=2))
+        self.assertEqual([p[0] for p in pages], [r[0] for r in results])
+        self.assertEqual([None, None, None], [r[2] for r in results])
+        self.assertEqual(
+            ['mvol-0004-1930-0103_0000000{}.jpg'.format(p) for p in (1, 2, 3)],
+            sorted(os.listdir(os.path.join(self.mmdd_path, 'JPEG')))
+        )
+        os.remove(pages[1][1])
+        self.assertEqual([pages[1]], make_mvol_jpegs.get_pages(self.tmp.name, 'mvol-0004-1930-0103'))
+
+    def test_reduce_in_bands(self):
+        """reading an uncompressed TIFF in bands gives the same result as
+        decoding it all at once."""
+        tif_file = os.path.join(self.tmp.name, 'striped.tif')
+        full = Image.radial_gradient('L').resize((300, 200)).convert('RGB')
+        full.save(tif_file, format='TIFF')
+        with Image.open(tif_file) as im:
+            strips = make_mvol_jpegs.get_raw_strips(im)
+            self.assertIsNotNone(strips)
+            banded = make_mvol_jpegs.reduce_in_bands(tif_file, im, strips, 100, band_bytes=3000)
+        expected = full.reduce(2)
+        expected.thumbnail((100, 100))
+        self.assertEqual(expected.tobytes(), banded.tobytes())
+        with Image.open(tif_file) as im:
+            with self.assertRaises(MemoryError):
+                make_mvol_jpegs.get_jpeg_image(tif_file, im, memory_limit=1000)
+
+    def test_broken_pool(self):
+        """pages lost with a dead worker are reported as failed, and the
+        rest are converted with a new pool."""
+        make_mvol_issue(self.tmp.name, 'mvol-0004-1930-0104', pages=8)
+        pages = make_mvol_jpegs.get_pages(self.tmp.name, 'mvol-0004-1930-0104')
+        with unittest.mock.patch.object(make_mvol_jpegs, 'convert_page', convert_page_or_crash):
+            results = list(make_mvol_jpegs.convert_pages(pages, jobs=2))
+        self.assertEqual([p[0] for p in pages], [r[0] for r in results])
+        self.assertTrue(results[1][2].startswith('BrokenProcessPool'))
+        # pages submitted once the dead worker was noticed.
+        self.assertEqual([None] * 3, [r[2] for r in results[5:]])
+
+    def test_memory_limit(self):
+        """the limit leaves room for the process itself, and applies to
+        conversions without a pool too."""
+        tif_file = os.path.join(self.tmp.name, 'large.tif')
+        Image.new('L', (1024, 1024)).save(tif_file, format='TIFF')
+        with Image.open(tif_file) as im:
+            with self.assertRaises(MemoryError):
+                make_mvol_jpegs.get_jpeg_image(tif_file, im, memory_limit=make_mvol_jpegs.BASELINE_BYTES + 2 ** 19)
+            make_mvol_jpegs.get_jpeg_image(tif_file, im, memory_limit=make_mvol_jpegs.BASELINE_BYTES + 2 ** 21)
+        before = resource.getrlimit(resource.RLIMIT_DATA)
+        with make_mvol_jpegs.memory_limited(2 ** 40):
+            self.assertEqual(2 ** 40, resource.getrlimit(resource.RLIMIT_DATA)[0])
+        self.assertEqual(before, resource.getrlimit(resource.RLIMIT_DATA))
+
+    def test_convert_page_failure(self):
+        """a page that can't be read leaves no JPEG or temporary file."""
+        tif_file = os.path.join(self.mmdd_path, 'TIFF', 'mvol-0004-1930-0103_00000001.tif')
+        with open(tif_file, 'wb') as f:
+            f.write(b'II*\x00')
+        jpg_file = os.path.join(self.mmdd_path, 'bad.jpg')
+        self.assertIsNotNone(make_mvol_jpegs.convert_page((tif_file, jpg_file))[2])
+        self.assertNotIn('bad.jpg', os.listdir(self.mmdd_path))
+        self.assertNotIn('.bad.jpg.tmp', os.listdir(self.mmdd_path))
+
     
 if __name__ == '__main__':
     unittest.main()